@@ -10,7 +10,7 @@ from txai.models.bc_model import TimeXModel, AblationParameters, transformer_def
 from txai.utils.data.preprocess import process_Boiler_OLD
 from txai.utils.predictors.eval import eval_mv4
 from txai.synth_data.simple_spike import SpikeTrainDataset
-from txai.utils.data.datasets import DatasetwInds
+from txai.utils.data.datasets import DatasetwInds, BatchLoader
 from txai.utils.predictors.loss_cl import *
 from txai.utils.predictors.select_models import simloss_on_val_wboth
 
@@ -71,7 +71,7 @@ def main(args):
         trainB, val, test = process_Boiler_OLD(split_no = i, device = device, base_path = '/content/Ash_TimeX')
         # Output of above are chunks
         train_dataset = DatasetwInds(*trainB)
-        train_loader = torch.utils.data.DataLoader(train_dataset, batch_size = 32, shuffle = True)
+        train_loader = BatchLoader(train_dataset, batch_size = 32, shuffle = True)
 
         # val = (val.X, val.time, val.y)
         # test = (test.X, test.time, test.y)
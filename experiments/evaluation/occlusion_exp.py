@@ -9,6 +9,7 @@ from sklearn.metrics import f1_score, average_precision_score, roc_auc_score
 
 from txai.models.encoders.transformer_simple import TransformerMVTS
 from txai.utils.experimental import get_explainer
+from txai.utils.baseline_comp.run_dynamask import run_dynamask_batch
 from txai.vis.vis_saliency import vis_one_saliency
 from txai.utils.data import process_Synth
 from txai.synth_data.simple_spike import SpikeTrainDataset
@@ -16,7 +17,7 @@ from txai.synth_data.simple_spike import SpikeTrainDataset
 from txai.models.modelv6_v2 import Modelv6_v2
 from txai.models.bc_model import TimeXModel
 
-from txai.utils.functional import transform_to_attn_mask
+from txai.utils.functional import transform_to_keep_mask
 from txai.utils.data.preprocess import process_Epilepsy, process_PAM, process_Boiler_OLD
 
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
@@ -143,14 +144,21 @@ def main(args):
 
             start_time = time.time()
 
-            for i in trange(B):
-                # Eval all explainers:
-                if args.exp_method == 'dyna': # This is a lazy solution, fix later
-                    exp = explainer(model, X[:,i,:].clone(), times[:,i].clone().unsqueeze(1), y = y[i].unsqueeze(0).clone())
-                else:
+            if args.exp_method == 'dyna':
+                # Fits all masks in a batch jointly:
+                for i in trange(0, B, args.exp_batch_size):
+                    generated_exps[:,i:(i + args.exp_batch_size),:] = run_dynamask_batch(model, 
+                        X[:,i:(i + args.exp_batch_size),:].clone(), times[:,i:(i + args.exp_batch_size)].clone(), 
+                        y = y[i:(i + args.exp_batch_size)].clone(), device = device)
+            elif args.exp_method == 'ig':
+                # Interpolation steps for whole batches go through one captum object:
+                generated_exps = explainer.attribute_batch(model, X, times, y, batch_size = args.exp_batch_size).to(X.device)
+            else:
+                for i in trange(B):
+                    # Eval all explainers:
                     exp = explainer(model, X[:,i,:].unsqueeze(1).clone(), times[:,i].unsqueeze(-1).clone(), y[i].unsqueeze(0).clone())
-                #print(exp.shape)
-                generated_exps[:,i,:] = exp
+                    #print(exp.shape)
+                    generated_exps[:,i,:] = exp
 
             end_time = time.time()
 
@@ -192,8 +200,8 @@ def main(args):
         Xperturb = (X * perturb_mask + (1 - perturb_mask) * baseline)
         #print('x perturb', Xperturb.isnan().any())
         seq_mask = (perturb_mask.sum(dim=-1) > 0).transpose(0,1).to(Xperturb.device) # New size: (B, T)
-        attn_mask = transform_to_attn_mask(seq_mask)
-        #attn_mask = None
+        attn_keep = transform_to_keep_mask(seq_mask.float()) # (B, T), no dense (B, T, T) mask
+        #attn_keep = None
 
         # See how perturb mask and seqmask are similar:
         mean_eq = (perturb_mask == seq_mask.transpose(0,1).unsqueeze(-1)).sum(dim=0).float().mean()
@@ -201,9 +209,9 @@ def main(args):
 
         with torch.no_grad():
             if args.exp_method == 'ours':
-                pred = model.encoder_main(Xperturb, times, attn_mask = attn_mask.float())
+                pred = model.encoder_main(Xperturb, times, attn_keep = attn_keep)
             else:
-                pred = model(Xperturb, times, attn_mask = attn_mask.float()) 
+                pred = model(Xperturb, times, attn_keep = attn_keep) 
 
         # Get evaluations:
         pred_prob = pred.softmax(dim=-1).detach().clone().cpu()
@@ -248,6 +256,11 @@ if __name__ == '__main__':
     parser.add_argument('--save_exp_path', default = None)
     parser.add_argument('--savedir', default = '')
     parser.add_argument('--runtime_exp', action = 'store_true')
+    parser.add_argument('--exp_batch_size', default = 64, type = int, help = 'samples per batched explainer call (dyna, ig)')
+    parser.add_argument('--ig_steps', default = 50, type = int)
+    parser.add_argument('--ig_internal_batch_size', default = None, type = int, help = 'max interpolated inputs per IG forward pass')
+    parser.add_argument('--n_workers', default = 1, type = int, help = 'CPU processes for batched IG')
+    parser.add_argument('--threads_per_worker', default = 1, type = int)
 
     args = parser.parse_args()
 
@@ -40,10 +40,98 @@ class WinITWrapper(WinITExplainer):
             return prob_distribution
         return p
 
-    def attribute(self, x, times):
+    def attribute(self, x, times, max_batch_size=None):
         """
         NOTE: added times for positional embedding
-        Compute the WinIT attribution
+        Compute the WinIT attribution, batched over features, window offsets and samples
+            - Counterfactual inputs of a window offset are built and run through the model in chunks of max_batch_size
+                (feature, sample, instance) rows, so peak memory does not grow with window_size * num_features * num_samples
+            - I(S) arrays are assembled on device, scores are moved to NumPy once at the end
+        Args:
+            x:
+                The input Tensor of shape (batch_size, num_features, num_times)
+            times:
+                The times Tensor of shape (batch_size, num_times)
+            max_batch_size:
+                Largest number of counterfactual sequences built and given to the model at once
+                (None runs each window offset in one call)
+
+        Returns:
+            The attribution array of shape (batch_size, num_features, num_times, window_size), same as attribute_sequential
+        """
+        self.base_model.eval()
+        self.base_model.zero_grad()
+
+        with torch.no_grad():
+            tic = time()
+
+            batch_size, num_features, num_timesteps = x.shape
+            feature_sel = torch.eye(num_features, dtype=torch.bool, device=x.device)
+            scores = [torch.zeros(batch_size, num_features, self.window_size, device=x.device)]
+            n_rows = num_features * self.num_samples * batch_size # counterfactual sequences per window offset
+            chunk = n_rows if max_batch_size is None else max_batch_size
+
+            for t in tqdm(range(1, num_timesteps)):
+                window_size = min(t, self.window_size)
+
+                # x = (num_sample, num_feature, n_timesteps)
+                # times = (num_sample, n_timesteps)
+                p_y = self._model_predict(x[:, :, : t + 1], times[:, : t + 1])
+                # P = p(y_t | X_{1:t}), repeated for every (feature, sample)
+                p_y_exp = p_y.repeat([num_features * self.num_samples, 1])
+
+                iS_list = []
+                for n in range(window_size):
+                    time_past = t - n
+                    time_forward = n + 1
+                    counterfactuals = self._generate_counterfactuals(
+                        time_forward, x[:, :, :time_past], x[:, :, time_past : t + 1]
+                    )
+                    # counterfactual shape = (num_feat, num_samples, batch_size, time_forward)
+
+                    # Q = p(y_t | tilde(X)^S_{t-n:t}), inputs are only built for one chunk of
+                    # (feature, sample, instance) rows at a time, s.t. memory is bounded by max_batch_size
+                    p_y_hat = []
+                    for j in range(0, n_rows, chunk):
+                        rows = torch.arange(j, min(j + chunk, n_rows), device=x.device)
+                        f_idx = rows // (self.num_samples * batch_size)
+                        s_idx = (rows // batch_size) % self.num_samples
+                        b_idx = rows % batch_size
+                        x_hat_in = x[b_idx, :, : t + 1].clone() # (rows, nfeat, time)
+                        # replace unknown with counterfactuals of the selected feature
+                        x_hat_in[..., time_past : t + 1] = torch.where(
+                            feature_sel[f_idx].unsqueeze(-1),
+                            counterfactuals[f_idx, s_idx, b_idx].unsqueeze(1).to(x_hat_in.dtype),
+                            x_hat_in[..., time_past : t + 1],
+                        )
+                        p_y_hat.append(self._model_predict(x_hat_in, times[b_idx, : t + 1]))
+                    p_y_hat = torch.cat(p_y_hat, dim=0)
+
+                    iS_sample = self._compute_metric(p_y_exp, p_y_hat).reshape(num_features, self.num_samples, batch_size)
+                    iS_list.append(iS_sample.mean(dim=1))
+
+                iS_sample = torch.stack(iS_list) # (window, nfeat, bs)
+                # For KL, the metric can be unbounded. We clip it for numerical stability.
+                iS_array = torch.clamp(iS_sample, -1e6, 1e6).transpose(0, 1) # (nfeat, window, bs)
+
+                # Compute the I(S) array
+                iS_array = torch.cat([iS_array[:, :1, :], iS_array[:, 1:, :] - iS_array[:, :-1, :]], dim=1)
+
+                score = iS_array.flip(1).permute(2, 0, 1)  # (bs, nfeat, time)
+
+                # Pad the scores when time forward is less than window size.
+                if score.shape[2] < self.window_size:
+                    score = torch.nn.functional.pad(score, (self.window_size - score.shape[2], 0))
+                scores.append(score)
+            print(f"Batch done: Time elapsed: {(time() - tic):.4f}")
+
+            scores = torch.stack(scores).permute(1, 2, 0, 3)  # (bs, fts, ts, window_size)
+            return scores.cpu().numpy()
+
+    def attribute_sequential(self, x, times):
+        """
+        NOTE: added times for positional embedding
+        Compute the WinIT attribution with one model call per (time, window offset, feature), kept for reference
         Args:
             x:
                 The input Tensor of shape (batch_size, num_features, num_times)
@@ -10,7 +10,7 @@ from txai.models.bc_model import TimeXModel, AblationParameters, transformer_def
 from txai.utils.data import process_Synth
 from txai.utils.predictors.eval import eval_mv4
 from txai.synth_data.simple_spike import SpikeTrainDataset
-from txai.utils.data.datasets import DatasetwInds
+from txai.utils.data.datasets import DatasetwInds, BatchLoader
 from txai.utils.predictors.loss_cl import *
 from txai.utils.predictors.select_models import simloss_on_val_wboth, cosine_sim_for_simclr
 
@@ -84,7 +84,7 @@ def main(args):
         #     continue
         D = process_Synth(split_no = i, device = device, base_path = '/n/data1/hms/dbmi/zitnik/lab/users/owq978/TimeSeriesCBM/datasets/LowVarDetect')
         dset = DatasetwInds(D['train_loader'].X.to(device), D['train_loader'].times.to(device), D['train_loader'].y.to(device))
-        train_loader = torch.utils.data.DataLoader(dset, batch_size = 64, shuffle = True)
+        train_loader = BatchLoader(dset, batch_size = 64, shuffle = True)
 
         val, test = D['val'], D['test']
 
@@ -10,7 +10,7 @@ from txai.models.bc_model import TimeXModel, AblationParameters, transformer_def
 from txai.utils.data import process_Synth
 from txai.utils.predictors.eval import eval_mv4
 from txai.synth_data.simple_spike import SpikeTrainDataset
-from txai.utils.data.datasets import DatasetwInds
+from txai.utils.data.datasets import DatasetwInds, BatchLoader
 from txai.utils.predictors.loss_cl import *
 from txai.utils.predictors.select_models import simloss_on_val_wboth, simloss_on_val_laonly, simloss_on_val_cononly, cosine_sim_for_simclr
 from txai.utils.data.preprocess import process_MITECG
@@ -107,7 +107,7 @@ def main(args):
         trainEpi, val, test, _ = process_MITECG(split_no = i, device = device, hard_split = True, need_binarize = True,
             base_path = '/n/data1/hms/dbmi/zitnik/lab/users/owq978/TimeSeriesCBM/datasets/MITECG-Hard/')
         train_dataset = DatasetwInds(trainEpi.X, trainEpi.time, trainEpi.y)
-        train_loader = torch.utils.data.DataLoader(train_dataset, batch_size = 16, shuffle = True)
+        train_loader = BatchLoader(train_dataset, batch_size = 16, shuffle = True)
 
         val = (val.X, val.time, val.y)
         test = (test.X, test.time, test.y)
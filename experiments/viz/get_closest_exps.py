@@ -107,10 +107,10 @@ def get_model(args, X):
 def main_clusters(model, train, test, args):
 
     Xtrain, times_train, y_train = train
-    out_train = batch_forwards(model, Xtrain, times_train, batch_size = 64)
+    out_train = batch_forwards(model, Xtrain, times_train, batch_size = 64, keys = ['z_mask_list'])
 
     Xtest, times_test, y_test = test
-    out_test = batch_forwards(model, Xtest, times_test, batch_size = 64)
+    out_test = batch_forwards(model, Xtest, times_test, batch_size = 64, keys = ['z_mask_list'])
 
     print('zm test', out_test['z_mask_list'].shape)
     print('zm train', out_train['z_mask_list'].shape)
@@ -149,10 +149,11 @@ def main_clusters(model, train, test, args):
 @torch.no_grad()
 def main_sim(model, train, test, args):
     Xtrain, times_train, y_train = train
-    out_train = batch_forwards(model, Xtrain, times_train, batch_size = 64, org_v = args.org_v)
+    keep_keys = ['z_mask_list', 'pred', 'mask_logits']
+    out_train = batch_forwards(model, Xtrain, times_train, batch_size = 64, org_v = args.org_v, keys = keep_keys)
 
     Xtest, times_test, y_test = test
-    out_test = batch_forwards(model, Xtest, times_test, batch_size = 64, org_v = args.org_v)
+    out_test = batch_forwards(model, Xtest, times_test, batch_size = 64, org_v = args.org_v, keys = keep_keys)
 
     ztrain = out_train['z_mask_list'].squeeze(-1)
     ztest = out_test['z_mask_list'].squeeze(-1)
@@ -0,0 +1,47 @@
+import torch
+
+from txai.utils.cl import NegativeSampler
+
+def test_stratified_singleton_class():
+    # Class 2 only has ID 5, its draws must go to the other classes
+    labels = torch.tensor([0, 0, 0, 1, 1, 2])
+    sampler = NegativeSampler(labels.shape[0], num_negatives = 6, mode = 'stratified', labels = labels)
+
+    torch.manual_seed(0)
+    for _ in range(50):
+        batch_ids = torch.arange(labels.shape[0])
+        inds = sampler.sample(batch_ids)
+        assert inds.shape == (6, 6)
+        assert ((inds >= 0) & (inds < labels.shape[0])).all()
+        assert (inds != batch_ids.unsqueeze(1)).all()
+        assert (labels[inds[5]] != 2).all()
+
+def test_stratified_excludes_anchor():
+    labels = torch.tensor([0, 0, 1, 1, 1, 2, 2])
+    sampler = NegativeSampler(labels.shape[0], num_negatives = 9, mode = 'stratified', labels = labels)
+
+    torch.manual_seed(0)
+    batch_ids = torch.arange(labels.shape[0])
+    for _ in range(50):
+        inds = sampler.sample(batch_ids)
+        assert (inds != batch_ids.unsqueeze(1)).all()
+        # Three draws per class:
+        assert (labels[inds].view(-1, 3, 3) == torch.arange(3).view(1, 3, 1)).all()
+
+def test_stratified_remainder_balance():
+    # 7 negatives over 3 classes: 2 each, plus 1 for a random class per call
+    labels = torch.tensor([0, 0, 0, 1, 1, 1, 2, 2, 2])
+    sampler = NegativeSampler(labels.shape[0], num_negatives = 7, mode = 'stratified', labels = labels)
+
+    torch.manual_seed(0)
+    batch_ids = torch.arange(labels.shape[0])
+    totals = torch.zeros(3)
+    for _ in range(300):
+        inds = sampler.sample(batch_ids)
+        counts = torch.stack([(labels[inds] == c).sum(dim = 1) for c in range(3)], dim = 1) # (B, 3)
+        assert ((counts == 2) | (counts == 3)).all() and (counts.sum(dim = 1) == 7).all()
+        totals += counts.float().sum(dim = 0)
+
+    # Each class gets the extra draw about a third of the time
+    share = (totals - 300 * 9 * 2) / (300 * 9)
+    assert ((share - 1 / 3).abs() < 0.1).all()
@@ -0,0 +1,20 @@
+import torch
+
+from txai.utils.data.datasets import DatasetwInds, BatchLoader
+
+def test_batch_loader_matches_dataloader():
+    torch.manual_seed(0)
+    T, N, d = 5, 7, 2
+    dataset = DatasetwInds(torch.randn(T, N, d), torch.arange(T).float().unsqueeze(1).repeat(1, N), torch.randint(0, 3, (N,)))
+
+    # batch_size = 3 leaves a remainder batch
+    ref = list(torch.utils.data.DataLoader(dataset, batch_size = 3, shuffle = False))
+    out = list(BatchLoader(dataset, batch_size = 3, shuffle = False))
+    assert len(out) == len(ref) == 3
+    for batch, batch_ref in zip(out, ref):
+        for a, b in zip(batch, batch_ref):
+            assert torch.equal(a, b)
+
+    # Shuffled batches cover every sample once
+    idx = torch.cat([batch[3] for batch in BatchLoader(dataset, batch_size = 3, shuffle = True)])
+    assert torch.equal(idx.sort().values, torch.arange(N))
@@ -0,0 +1,31 @@
+import torch
+
+from txai.utils.baseline_comp.run_dynamask import run_dynamask, run_dynamask_batch
+
+class TinyModel(torch.nn.Module):
+    # Accepts (T, d) (single sample, as Mask calls it) or (T, B, d) inputs
+    def __init__(self, d, n_classes):
+        super(TinyModel, self).__init__()
+        self.lin = torch.nn.Linear(d, n_classes)
+
+    def forward(self, X, times):
+        if X.dim() == 2:
+            X = X.unsqueeze(1)
+        return self.lin(torch.tanh(X).mean(dim = 0))
+
+def test_batch_matches_sequential():
+    torch.manual_seed(0)
+    T, B, d = 12, 3, 2
+    model = TinyModel(d, 3)
+    model.eval()
+    X = torch.randn(T, B, d)
+    times = torch.arange(1, T + 1).float().unsqueeze(1).repeat(1, B)
+    y = torch.tensor([0, 2, 1])
+
+    config = dict(n_epoch = 10, keep_ratio = 0.2, size_reg_factor_init = 0.01, size_reg_factor_dilation = 100)
+    batch_masks = run_dynamask_batch(model, X, times, y = y, device = 'cpu', **config)
+    assert batch_masks.shape == (T, B, d)
+
+    for i in range(B):
+        mask = run_dynamask(model, X[:,i,:], times[:,i:(i+1)], y = y[i:(i+1)], device = 'cpu', **config)
+        assert torch.allclose(batch_masks[:,i,:], mask, atol = 1e-5)
@@ -0,0 +1,17 @@
+import torch
+
+from txai.baselines.Dynamask.attribution.perturbation import GaussianBlur
+
+def test_apply_batch_matches_apply():
+    torch.manual_seed(0)
+    B, T, d = 3, 15, 2
+    X = torch.randn(B, T, d, dtype = torch.float64)
+    masks = torch.rand(B, T, d, dtype = torch.float64)
+
+    pert = GaussianBlur('cpu')
+    ref = torch.stack([pert.apply(X[i], masks[i]) for i in range(B)])
+    assert torch.allclose(pert.apply_batch(X, masks), ref)
+
+    # Band covering the whole sequence is exact, truncate = 4 only drops weights below exp(-8)
+    assert torch.allclose(GaussianBlur('cpu', truncate = T).apply_batch(X, masks), ref)
+    assert torch.allclose(GaussianBlur('cpu', truncate = 4).apply_batch(X, masks), ref, atol = 1e-2)
@@ -0,0 +1,91 @@
+import numpy as np
+
+from txai.utils.data import imputation
+
+def time_length_loop(X_time, missing_value_num):
+    # Previous per-sample series lengths
+    time_length = []
+    for times in X_time:
+        if np.where(times == missing_value_num)[0].size == 0:
+            time_length.append(times.shape[0])
+        elif np.where(times == missing_value_num)[0][0] == 0:
+            time_length.append(np.where(times == missing_value_num)[0][1])
+        else:
+            time_length.append(np.where(times == missing_value_num)[0][0])
+    return time_length
+
+def forward_loop(X_features, X_time, missing_value_num):
+    time_length = time_length_loop(X_time, missing_value_num)
+    for i, sample in enumerate(X_features):
+        for j, ts in enumerate(sample.T):
+            first_observation = True
+            current_value = -1
+            for k, observation in enumerate(ts[:time_length[i]]):
+                if X_features[i, k, j] == missing_value_num and first_observation:
+                    continue
+                elif X_features[i, k, j] != missing_value_num:
+                    current_value = X_features[i, k, j]
+                    first_observation = False
+                elif X_features[i, k, j] == missing_value_num and not first_observation:
+                    X_features[i, k, j] = current_value
+    return X_features
+
+def mean_loop(X_features, X_time, mean_features, missing_value_num):
+    time_length = time_length_loop(X_time, missing_value_num)
+    for i, sample in enumerate(X_features):
+        missing_values_idx = np.where(sample[:time_length[i], :] == missing_value_num)
+        for row, col in zip(*missing_values_idx):
+            X_features[i, row, col] = mean_features[col]
+    return X_features
+
+def spline_loop(X_features, X_time, missing_value_num):
+    from scipy.interpolate import CubicSpline
+    time_length = time_length_loop(X_time, missing_value_num)
+    for i, sample in enumerate(X_features):
+        for j, ts in enumerate(sample.T):
+            valid_ts = ts[:time_length[i]]
+            zero_idx = np.where(valid_ts == missing_value_num)[0]
+            non_zero_idx = np.nonzero(valid_ts)[0]
+            y = valid_ts[non_zero_idx]
+            if len(y) > 1:
+                x = X_time[i, :time_length[i], 0][non_zero_idx]
+                valid_ts[zero_idx] = CubicSpline(x, y)(X_time[i, :time_length[i], 0][zero_idx])
+                first_obs_index, last_obs_index = non_zero_idx[0], non_zero_idx[-1]
+                valid_ts[:first_obs_index] = valid_ts[first_obs_index]
+                valid_ts[last_obs_index:] = valid_ts[last_obs_index]
+                X_features[i, :time_length[i], j] = valid_ts
+    return X_features
+
+def random_series(N = 7, T = 12, F = 4, seed = 0):
+    rng = np.random.RandomState(seed)
+    X_time = np.zeros((N, T, 1))
+    X = rng.rand(N, T, F) + 0.5
+    X[rng.rand(N, T, F) < 0.5] = 0 # Missing values
+    X[:,:,1] = 0 # All-missing feature
+    for i in range(N):
+        length = rng.randint(3, T + 1)
+        X_time[i, :length, 0] = np.sort(rng.choice(np.arange(1, 60), size = length, replace = False))
+        X[i, length:] = 0 # Padding after the series
+    X_time[0, 0, 0] = 0 # First measurement at time 0, followed by padding
+    X_time[0, -1, 0], X[0, -1] = 0, 0
+    return X, X_time
+
+def test_series_lengths_match_loop():
+    X, X_time = random_series()
+    assert list(imputation.series_lengths(X_time, 0)) == time_length_loop(X_time, 0)
+
+def test_forward_and_mean_match_loop():
+    X, X_time = random_series()
+    assert np.array_equal(imputation.forward_imputation(X.copy(), X_time, 0), forward_loop(X.copy(), X_time, 0))
+
+    mean_features = [1.0, 2.0, 3.0, 4.0]
+    assert np.array_equal(imputation.mean_imputation(X.copy(), X_time, mean_features, 0),
+        mean_loop(X.copy(), X_time, mean_features, 0))
+
+def test_cubic_spline_matches_loop():
+    X, X_time = random_series()
+    ref = spline_loop(X.copy(), X_time, 0)
+    # chunk_size = 3 leaves a remainder chunk of 1 sample
+    for chunk_size in (256, 3):
+        out = imputation.cubic_spline_imputation(X.copy(), X_time, 0, chunk_size = chunk_size)
+        assert np.allclose(out, ref)
@@ -0,0 +1,23 @@
+import torch
+
+from txai.utils.functional import js_divergence, js_divergence_logsoftmax
+from txai.utils.predictors.loss_cl import LabelConsistencyLoss, LabelConsistencyLoss_LS
+
+def combinations_score(mask_labels, full_labels, jsd):
+    # Previous implementation: enumerate all pairs i < j with torch.combinations
+    combs = torch.combinations(torch.arange(mask_labels.shape[0]), r = 2, with_replacement = False)
+    score_mask = jsd(mask_labels[combs[:,0],:], mask_labels[combs[:,1],:])
+    score_full = jsd(full_labels[combs[:,0],:], full_labels[combs[:,1],:])
+    return (score_mask - score_full).pow(2).mean()
+
+def test_label_consistency_matches_combinations():
+    torch.manual_seed(0)
+    for B in (2, 7):
+        mask_labels, full_labels = torch.randn(B, 4, dtype = torch.float64), torch.randn(B, 4, dtype = torch.float64)
+
+        ref = combinations_score(mask_labels.log_softmax(dim=-1), full_labels.log_softmax(dim=-1),
+            lambda p, q: js_divergence(p, q, log_already = True))
+        assert torch.allclose(LabelConsistencyLoss()(mask_labels, full_labels), ref)
+
+        ref_ls = combinations_score(mask_labels, full_labels, js_divergence_logsoftmax)
+        assert torch.allclose(LabelConsistencyLoss_LS()(mask_labels, full_labels), ref_ls)
@@ -0,0 +1,21 @@
+import torch
+
+from txai.models.encoders.positional_enc import PositionalEncodingTF
+
+def test_shared_grid_matches_uncached():
+    pos_encoder = PositionalEncodingTF(16, max_len = 50)
+    T, B = 20, 5
+    for start in (0, 1): # 0-based (MIT-ECG, Boiler) and 1-based (PAM, Epilepsy, synthetic) grids
+        times = torch.arange(start, T + start).float().unsqueeze(1).repeat(1, B)
+        ref = pos_encoder.getPE(times)
+        for _ in range(2): # Miss, then hit
+            out = pos_encoder(times)
+            assert out.shape == (T, B, 16)
+            assert torch.allclose(out, ref)
+    assert len(pos_encoder._grid_cache[(T, 'cpu')]) == 2
+
+def test_irregular_times_not_cached():
+    pos_encoder = PositionalEncodingTF(16, max_len = 50)
+    times = torch.rand(20, 5).cumsum(dim = 0)
+    assert torch.allclose(pos_encoder(times), pos_encoder.getPE(times))
+    assert len(pos_encoder._grid_cache) == 0
@@ -0,0 +1,50 @@
+import torch
+
+from txai.models.run_model_utils import batch_forwards, concat_all_dicts
+
+class TinyExplainer(torch.nn.Module):
+    # Returns the output dict layout of the TimeX models
+    def __init__(self, d, n_classes = 3):
+        super(TinyExplainer, self).__init__()
+        self.lin = torch.nn.Linear(d, n_classes)
+        self.ptypes = torch.randn(5, d)
+
+    def forward(self, src, times, captum_input = False):
+        z = src.mean(dim = 0)
+        mask_logits = src.transpose(0, 1).sigmoid()
+        return {
+            'pred': self.lin(z),
+            'pred_mask': self.lin(z * 2),
+            'mask_logits': mask_logits,
+            'ste_mask': (mask_logits > 0.5).float(),
+            'smooth_src': src * 0.5, # (T, B, d), batched on dim 1
+            'all_z': (z, z + 1),
+            'z_mask_list': z.unsqueeze(-1),
+            'ptype_inds': (z @ self.ptypes.T).argmax(dim = -1),
+            'ptypes': self.ptypes,
+        }
+
+def test_batch_forwards_matches_concat_all_dicts():
+    torch.manual_seed(0)
+    T, N, d = 6, 7, 2
+    X, times = torch.randn(T, N, d), torch.arange(T).float().unsqueeze(1).repeat(1, N)
+    model = TinyExplainer(d)
+
+    # batch_size = 3 leaves a remainder batch
+    with torch.no_grad():
+        ref = concat_all_dicts([model(X[:,s:(s + 3)], times[:,s:(s + 3)]) for s in range(0, N, 3)])
+    out = batch_forwards(model, X, times, batch_size = 3)
+
+    assert out.keys() == ref.keys()
+    for k in ['pred', 'pred_mask', 'mask_logits', 'ste_mask', 'smooth_src', 'z_mask_list']:
+        assert torch.allclose(out[k], ref[k])
+    for a, b in zip(out['all_z'], ref['all_z']):
+        assert torch.allclose(a, b)
+    # Outputs concat_all_dicts does not concatenate stay per-batch lists
+    for k in ['ptype_inds', 'ptypes']:
+        assert isinstance(out[k], list) and len(out[k]) == len(ref[k]) == 3
+        assert all(torch.equal(a, b) for a, b in zip(out[k], ref[k]))
+
+    out = batch_forwards(model, X, times, batch_size = 3, keys = ['z_mask_list', 'ptype_inds'])
+    assert out.keys() == {'z_mask_list', 'ptype_inds'}
+    assert torch.allclose(out['z_mask_list'], ref['z_mask_list'])
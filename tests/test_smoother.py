@@ -0,0 +1,59 @@
+import math
+import torch
+
+from txai.smoother import smoother, exponential_smoother
+
+def smoother_loop(src, time, p, mask = None):
+    # Previous per-step implementation
+    T, B = time.shape
+    new_src = torch.empty_like(src)
+    for t in range(T):
+        coef = 1.0 / (p.reshape(1, B) * math.sqrt(2.0 * math.pi) + 1e-9) * \
+            torch.exp(-0.5 * ((time[:(t+1)] - time[t].unsqueeze(0)) / (p.reshape(1, B) + 1e-9)) ** 2)
+        coef = coef.softmax(dim=0)
+        if mask is not None:
+            coef = coef * mask[:,:(t+1)].transpose(0, 1)
+        new_src[t,:,0] = (src[:(t+1),:,0] * coef).sum(dim=0)
+    return new_src
+
+def exponential_loop(src, p):
+    # new_src[i] = c_i * sum_{j >= i} (1 - p)^(j - i) src[j], c_0 = 1, c_i = p otherwise
+    T, B, d = src.shape
+    new_src = torch.zeros_like(src)
+    for i in range(T):
+        c = torch.ones(B, 1, dtype = src.dtype) if i == 0 else p.reshape(B, 1)
+        for j in range(i, T):
+            new_src[i] += c * (1 - p.reshape(B, 1)) ** (j - i) * src[j]
+    return new_src
+
+def test_smoother_matches_loop():
+    torch.manual_seed(0)
+    T, B = 10, 3
+    src = torch.randn(T, B, 1, dtype = torch.float64)
+    time = torch.rand(T, B, dtype = torch.float64).cumsum(dim=0) * 2
+    p = torch.rand(B, 1, dtype = torch.float64) + 0.5
+    mask = (torch.rand(B, T) > 0.3).double()
+
+    for m in (None, mask):
+        ref = smoother_loop(src, time, p, mask = m)
+        for chunk_size in (None, 3): # 3 leaves a remainder chunk
+            assert torch.allclose(smoother(src, time, p, mask = m, chunk_size = chunk_size), ref)
+
+def test_windowed_smoother_matches_loop():
+    torch.manual_seed(0)
+    T, B = 20, 2
+    src = torch.randn(T, B, 1, dtype = torch.float64)
+    time = torch.arange(T, dtype = torch.float64).unsqueeze(1).repeat(1, B)
+    p = torch.full((B, 1), 0.5, dtype = torch.float64) # Density is negligible past 6 steps
+    ref = smoother_loop(src, time, p)
+    assert torch.allclose(smoother(src, time, p, window = 6), ref, atol = 1e-8)
+
+def test_exponential_smoother_matches_loop():
+    torch.manual_seed(0)
+    T, B, d = 12, 3, 2
+    src = torch.randn(T, B, d, dtype = torch.float64)
+    p = torch.rand(B, 1, dtype = torch.float64)
+    time = torch.arange(T).unsqueeze(1).repeat(1, B)
+    ref = exponential_loop(src, p)
+    for method in ('dense', 'fft'):
+        assert torch.allclose(exponential_smoother(src, time, p, method = method), ref)
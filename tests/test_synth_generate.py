@@ -0,0 +1,53 @@
+import numpy as np
+
+from txai.synth_data.freq_shapes import FreqShapes
+
+def generate_dataset_loop(gen, N):
+    # Previous per-sample generate_dataset, under the global seed
+    class_count = [(N // gen.n_classes)] * (gen.n_classes - 1)
+    class_count.append(N - sum(class_count))
+    X, gt_exps = np.zeros((N, gen.T, gen.D)), []
+    total_count = 0
+    for i, n in enumerate(class_count):
+        for j in range(n):
+            X[total_count,:,:], locs = gen.generate_seq(class_num = i)
+            gt_exps.append(locs)
+            total_count += 1
+    return X, gt_exps
+
+def test_per_sample_matches_loop():
+    gen = FreqShapes(T = 50)
+    np.random.seed(0)
+    X_ref, gt_ref = generate_dataset_loop(gen, 22)
+    np.random.seed(0)
+    X, times, y, gt_exps = gen.generate_dataset(22, per_sample = True, chunk_size = 4) # 4 leaves remainder chunks
+    assert np.array_equal(X, X_ref)
+    assert [[tuple(map(int, c)) for c in g] for g in gt_exps] == [[tuple(map(int, c)) for c in g] for g in gt_ref]
+    assert np.array_equal(y, np.repeat(np.arange(4), [5, 5, 5, 7]))
+
+def test_seeded_dataset_independent_of_workers():
+    gen = FreqShapes(T = 50)
+    X1, _, y1, gt1 = gen.generate_dataset(22, seed = 3, chunk_size = 4)
+    X2, _, y2, gt2 = gen.generate_dataset(22, seed = 3, chunk_size = 4, n_workers = 2)
+    assert np.array_equal(X1, X2) and np.array_equal(y1, y2)
+    assert gt1 == gt2
+
+def test_generate_batch_fixed_seed():
+    gen = FreqShapes(T = 50, noise = 0)
+    for class_num in range(4):
+        np.random.seed(1)
+        X, gt_exps = gen.generate_batch(class_num, 6)
+        np.random.seed(1)
+        X_again, _ = gen.generate_batch(class_num, 6)
+        assert X.shape == (6, 50, 1) and len(gt_exps) == 6
+        assert np.array_equal(X, X_again)
+
+        # Without noise, a sample is nonzero exactly on its ground-truth spikes of width 3, freq steps apart
+        shape, freq = gen.class_prop_map[class_num]
+        spike = (0.25 if shape == 0 else -0.25) * (np.arange(-1, 2)) ** 2 + (-2 if shape == 0 else 2)
+        for k in range(6):
+            locs = np.array([t for t, _ in gt_exps[k]])
+            assert np.array_equal(np.nonzero(X[k,:,0])[0], locs)
+            centers = locs[1::3]
+            assert np.all(np.diff(centers) == freq)
+            assert np.allclose(X[k, locs, 0], np.tile(spike, len(centers)))
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+import torch
+
+from txai.utils.data.utils_phy12 import getStats, mask_normalize, getStats_static, mask_normalize_static
+
+pytestmark = pytest.mark.filterwarnings('ignore::RuntimeWarning') # Means of all-missing columns
+
+def random_series(N = 7, T = 5, F = 4, seed = 0):
+    rng = np.random.RandomState(seed)
+    P = rng.rand(N, T, F) * 3
+    P[rng.rand(N, T, F) < 0.4] = 0 # Missing values
+    P[:,:,2] = 0 # All-missing feature
+    return P
+
+def getStats_loop(P):
+    # Previous per-feature implementation
+    N, T, F = P.shape
+    Pf = P.transpose((2, 0, 1)).reshape(F, -1)
+    mf, stdf = np.zeros((F, 1)), np.ones((F, 1))
+    for f in range(F):
+        vals_f = Pf[f, :]
+        vals_f = vals_f[vals_f > 0]
+        mf[f] = np.mean(vals_f)
+        stdf[f] = np.max([np.std(vals_f), 1e-7])
+    return mf, stdf
+
+def test_getStats_matches_loop():
+    P = random_series()
+    mf_ref, stdf_ref = getStats_loop(P)
+    # chunk_size = 3 leaves a remainder chunk of 1 sample, moments are merged across chunks
+    for P_in, chunk_size in ((P, None), (P, 3), (P, 1), (torch.from_numpy(P), 3)):
+        mf, stdf = getStats(P_in, chunk_size = chunk_size)
+        assert np.allclose(mf, mf_ref, equal_nan = True)
+        assert np.allclose(stdf, stdf_ref, equal_nan = True)
+
+def test_mask_normalize_matches_loop():
+    P = random_series()
+    mf, stdf = getStats_loop(P)
+    M = (P > 0)
+    ref = np.concatenate([(P - mf.reshape(1, 1, -1)) / (stdf.reshape(1, 1, -1) + 1e-18) * M, M], axis = 2)
+    assert np.allclose(mask_normalize(P, mf, stdf), ref, equal_nan = True)
+
+    out = np.empty(ref.shape)
+    mask_normalize(P, mf, stdf, out = out, chunk_size = 3)
+    assert np.allclose(out, ref, equal_nan = True)
+
+def test_static_matches_loop():
+    rng = np.random.RandomState(0)
+    P = rng.rand(11, 9) * 2
+    P[rng.rand(11, 9) < 0.3] = 0
+    P[:,3] = 0 # All-missing continuous column
+    bool_categorical = [0, 1, 1, 0, 1, 1, 1, 1, 0]
+
+    ms_ref, ss_ref = np.zeros((9, 1)), np.ones((9, 1))
+    for s in range(9):
+        if bool_categorical[s] == 0:
+            vals_s = P[:,s][P[:,s] > 0]
+            ms_ref[s], ss_ref[s] = np.mean(vals_s), np.std(vals_s)
+
+    ms, ss = getStats_static(P, dataset = 'P12')
+    assert np.allclose(ms, ms_ref, equal_nan = True)
+    assert np.allclose(ss, ss_ref, equal_nan = True)
+
+    ref = (P - ms_ref.reshape(1, -1)) / (ss_ref.reshape(1, -1) + 1e-18)
+    ref[ref <= 0] = 0
+    assert np.allclose(mask_normalize_static(P.copy(), ms, ss), ref, equal_nan = True)
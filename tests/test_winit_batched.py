@@ -0,0 +1,46 @@
+import os, sys
+import numpy as np
+import pytest
+import torch
+
+# WinIT is an external baseline package, winit_wrapper is imported as a script module (as in saliency_exp_synth.py)
+pytest.importorskip('txai.baselines.WinIT.winit.explainer.winitexplainers')
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'experiments', 'evaluation'))
+from winit_wrapper import WinITWrapper
+
+class TinyModel(torch.nn.Module):
+    def __init__(self, d, n_classes):
+        super(TinyModel, self).__init__()
+        self.lin = torch.nn.Linear(d, n_classes)
+
+    def forward(self, x, times):
+        # x: (T, B, d) -> (B, n_classes) probabilities
+        return self.lin(torch.tanh(x).mean(dim = 0)).softmax(dim = -1)
+
+class DeterministicWinIT(WinITWrapper):
+    # Fixed counterfactuals and metric, so both paths see the same inputs
+    def __init__(self, base_model, window_size, num_samples):
+        self.base_model, self.window_size, self.num_samples = base_model, window_size, num_samples
+
+    def _generate_counterfactuals(self, time_forward, x_past, x_current):
+        # (num_feat, num_samples, batch_size, time_forward)
+        base = x_past.mean(dim = -1, keepdim = True).expand(-1, -1, time_forward).transpose(0, 1)
+        shift = torch.arange(1, self.num_samples + 1, dtype = x_past.dtype).view(1, -1, 1, 1) * 0.1
+        return base.unsqueeze(1) + shift
+
+    def _compute_metric(self, p_y_exp, p_y_hat):
+        return (p_y_exp - p_y_hat).abs().sum(dim = -1)
+
+def test_attribute_matches_sequential():
+    torch.manual_seed(0)
+    B, d, T = 3, 2, 7
+    x = torch.randn(B, d, T)
+    times = torch.arange(1, T + 1).float().unsqueeze(0).repeat(B, 1)
+    winit = DeterministicWinIT(TinyModel(d, 3), window_size = 3, num_samples = 2)
+
+    ref = winit.attribute_sequential(x, times)
+    # max_batch_size = 5 leaves a remainder chunk (d * num_samples * B = 12 rows per window offset)
+    for max_batch_size in (None, 5):
+        out = winit.attribute(x, times, max_batch_size = max_batch_size)
+        assert out.shape == ref.shape
+        assert np.allclose(out, ref, atol = 1e-5)
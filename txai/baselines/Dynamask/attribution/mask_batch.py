@@ -0,0 +1,155 @@
+import time
+
+import numpy as np
+import torch
+import torch.optim as optim
+
+from txai.baselines.Dynamask.attribution.perturbation import Perturbation
+
+
+class BatchMask:
+    """This class allows to fit one dynamic mask per sample for a whole batch in a single optimization.
+
+    Each sample only contributes to the loss through its own mask, so summing the per-sample losses gives every
+    mask the same gradient (and SGD trajectory) as fitting it alone with Mask.
+
+    Attributes:
+        perturbation (attribution.perturbation.Perturbation):
+            An object of the Perturbation class implementing apply_batch.
+        device: The device used to work with the torch tensors.
+        verbose (bool): True is some messages should be displayed during optimization.
+        random_seed (int): Random seed for reproducibility.
+        deletion_mode (bool): True if the masks should identify the most impactful deletions.
+        eps (float): Small number used for numerical stability.
+        mask_tensor (torch.tensor): The (B, T, N_features) tensor containing the mask coefficients.
+        B (int): Number of samples.
+        T (int): Number of time steps.
+        N_features (int): Number of features.
+        Y_target (torch.tensor): Black-box prediction.
+        hist (torch.tensor): History tensor containing the batch-averaged metrics at different epochs.
+    """
+
+    def __init__(
+        self,
+        perturbation: Perturbation,
+        device,
+        verbose: bool = False,
+        random_seed: int = 42,
+        deletion_mode: bool = False,
+        eps: float = 1.0e-7,
+    ):
+        self.verbose = verbose
+        self.device = device
+        self.random_seed = random_seed
+        self.deletion_mode = deletion_mode
+        self.perturbation = perturbation
+        self.eps = eps
+        self.X = None
+        self.mask_tensor = None
+        self.B = None
+        self.T = None
+        self.N_features = None
+        self.Y_target = None
+        self.f = None
+        self.n_epoch = None
+        self.hist = None
+
+    def fit(
+        self,
+        X,
+        time_input,
+        f,
+        loss_function,
+        target=None,
+        n_epoch: int = 500,
+        keep_ratio=0.5,
+        initial_mask_coeff: float = 0.5,
+        size_reg_factor_init=0.5,
+        size_reg_factor_dilation: float = 100,
+        time_reg_factor=0,
+        learning_rate: float = 1.0e-1,
+        momentum: float = 0.9,
+    ):
+        """This method fits a mask to each sample of X for the black-box function f.
+
+        Args:
+            X: Input tensor of shape (B, T, N_features).
+            time_input: Times of shape (T, B), passed to f.
+            f: Black-box taking (T, B, N_features) inputs and times.
+            loss_function: Loss with reduction="none", returning one error per sample.
+            target: If the output to approximate is different from f(X), it can be specified optionally.
+            n_epoch: Number of steps for the optimization.
+            keep_ratio: Fraction of elements kept by the mask, float or (B,) tensor for per-sample values.
+            initial_mask_coeff: Initial value for the mask coefficients.
+            size_reg_factor_init: Initial size regulation coefficient, float or (B,) tensor.
+            size_reg_factor_dilation: Ratio between the final and the initial size regulation factor.
+            time_reg_factor: Regulation factor for the variation in time, float or (B,) tensor.
+            learning_rate: Learning rate for the torch SGD optimizer.
+            momentum: Momentum for the SGD optimizer.
+
+        Returns:
+            None
+        """
+        t_fit = time.time()
+        torch.manual_seed(self.random_seed)
+        error_factor = 1 - 2 * self.deletion_mode  # In deletion mode, the error has to be maximized
+        reg_multiplicator = np.exp(np.log(size_reg_factor_dilation) / n_epoch)
+        self.f = f
+        self.X = X
+        self.n_epoch = n_epoch
+        self.B, self.T, self.N_features = X.shape
+        n_elements = self.T * self.N_features
+
+        def per_sample(v, dtype=torch.float32):
+            return torch.as_tensor(v, dtype=dtype, device=self.device).expand(self.B)
+
+        reg_factor = per_sample(size_reg_factor_init).clone()
+        time_reg_factor = per_sample(time_reg_factor)
+
+        if target is None:
+            with torch.no_grad():
+                self.Y_target = f(X.transpose(0, 1), time_input)
+        else:
+            self.Y_target = target
+
+        # The initial mask is defined with the initial mask coefficient
+        self.mask_tensor = initial_mask_coeff * torch.ones(size=X.shape, device=self.device)
+        mask_tensor_new = self.mask_tensor.clone().detach().requires_grad_(True)
+        optimizer = optim.SGD([mask_tensor_new], lr=learning_rate, momentum=momentum)
+        hist = torch.zeros(3, 0)
+        # Reference vectors used in the size regulator (one row per sample, same as Mask for scalar keep_ratio)
+        n_zeros = ((1 - per_sample(keep_ratio, dtype=torch.float64)) * n_elements).floor().long()
+        reg_ref = (torch.arange(n_elements, device=self.device).unsqueeze(0) >= n_zeros.unsqueeze(1)).float()
+
+        for k in range(n_epoch):
+            t_loop = time.time()
+            if self.deletion_mode:
+                X_pert = self.perturbation.apply_batch(X=X, mask_tensor=(1 - mask_tensor_new))
+            else:
+                X_pert = self.perturbation.apply_batch(X=X, mask_tensor=mask_tensor_new)
+            Y_pert = f(X_pert.transpose(0, 1), time_input)
+            # Per-sample losses (error [L_e] + size regulation [L_a] + time variation regulation [L_c])
+            error = loss_function(Y_pert, self.Y_target)
+            mask_tensor_sorted = mask_tensor_new.reshape(self.B, n_elements).sort(dim=1)[0]
+            size_reg = ((reg_ref - mask_tensor_sorted) ** 2).mean(dim=1)
+            time_reg = (torch.abs(mask_tensor_new[:, 1 : self.T - 1, :] - mask_tensor_new[:, : self.T - 2, :])).mean(dim=(1, 2))
+            loss = (error_factor * error + reg_factor * size_reg + time_reg_factor * time_reg).sum()
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            # Ensures that the constraint is fulfilled
+            mask_tensor_new.data = mask_tensor_new.data.clamp(0, 1)
+            metrics = torch.stack([error.detach().mean(), size_reg.detach().mean(), time_reg.detach().mean()]).cpu().unsqueeze(1)
+            hist = torch.cat((hist, metrics), dim=1)
+            reg_factor *= reg_multiplicator
+            t_loop = time.time() - t_loop
+            if self.verbose:
+                print(
+                    f"Epoch {k + 1}/{n_epoch}: mean error = {metrics[0, 0]:.3g} ; mean size regulator = {metrics[1, 0]:.3g} ;"
+                    f" mean time regulator = {metrics[2, 0]:.3g} ; time elapsed = {t_loop:.3g} s"
+                )
+        self.mask_tensor = mask_tensor_new.detach()
+        self.hist = hist
+        t_fit = time.time() - t_fit
+        if self.verbose:
+            print(f"The optimization of {self.B} masks finished: time elapsed = {t_fit:.3g} s")
@@ -1,6 +1,8 @@
+import math
 from abc import ABC, abstractmethod
 
 import torch
+import torch.nn.functional as F
 
 
 class Perturbation(ABC):
@@ -85,28 +87,82 @@ class GaussianBlur(Perturbation):
         eps (float): Small number used for numerical stability.
         device: Device on which the tensor operations are executed.
         sigma_max (float): Maximal width for the Gaussian blur.
+        truncate (float): If given, apply_batch only sums over a band of half-width ceil(truncate * sigma_max)
+            around each time step, costing O(T * N_features * truncate * sigma_max) instead of O(T^2 * N_features).
+            The kernel width varies with the mask at every time step, so it is not a fixed convolution (no FFT),
+            but sigma <= sigma_max bounds its support. truncate=4 drops weights below exp(-8).
+        dist_cache (dict): Cached time-distance tensors, keyed by sequence length (and band half-width).
     """
 
-    def __init__(self, device, eps=1.0e-7, sigma_max=2):
+    def __init__(self, device, eps=1.0e-7, sigma_max=2, truncate=None):
         super().__init__(eps=eps, device=device)
         self.sigma_max = sigma_max
+        self.truncate = truncate
+        self.dist_cache = {}
+
+    def squared_time_dist(self, T):
+        """Returns the cached (T, T) tensor of squared distances (t1 - t2) ** 2 between time steps."""
+        if T not in self.dist_cache:
+            T_axis = torch.arange(1, T + 1, dtype=int, device=self.device)
+            self.dist_cache[T] = (T_axis.unsqueeze(1) - T_axis.unsqueeze(0)) ** 2
+        return self.dist_cache[T]
+
+    def band_time_dist(self, T, half_width):
+        """Returns cached squared offsets (W,) and the (T, W) validity mask of the band around each time step."""
+        key = (T, half_width)
+        if key not in self.dist_cache:
+            offsets = torch.arange(-half_width, half_width + 1, device=self.device)
+            source = torch.arange(T, device=self.device).unsqueeze(1) + offsets.unsqueeze(0)
+            valid = ((source >= 0) & (source < T)).float()
+            self.dist_cache[key] = (offsets ** 2, valid)
+        return self.dist_cache[key]
 
     def apply(self, X, mask_tensor):
         super().apply(X=X, mask_tensor=mask_tensor)
         T = X.shape[0]
-        T_axis = torch.arange(1, T + 1, dtype=int, device=self.device)
         # Convert the mask into a tensor containing the width of each Gaussian perturbation
         sigma_tensor = self.sigma_max * ((1 + self.eps) - mask_tensor)
         sigma_tensor = sigma_tensor.unsqueeze(0)
         # For each feature and each time, we compute the coefficients for the Gaussian perturbation
-        T1_tensor = T_axis.unsqueeze(1).unsqueeze(2)
-        T2_tensor = T_axis.unsqueeze(0).unsqueeze(2)
-        filter_coefs = torch.exp(torch.divide(-1.0 * (T1_tensor - T2_tensor) ** 2, 2.0 * (sigma_tensor ** 2)))
+        dist_tensor = self.squared_time_dist(T).unsqueeze(2)
+        filter_coefs = torch.exp(torch.divide(-1.0 * dist_tensor, 2.0 * (sigma_tensor ** 2)))
         filter_coefs = torch.divide(filter_coefs, torch.sum(filter_coefs, 0))
         # The perturbation is obtained by replacing each input by the linear combination weighted by Gaussian coefs
         X_pert = torch.einsum("sti,si->ti", filter_coefs, X)
         return X_pert
 
+    def apply_batch(self, X, mask_tensor):
+        """This method applies the perturbation on a batch of inputs, each with its own mask.
+
+        Args:
+            X: Input tensor of shape (B, T, N_features).
+            mask_tensor: Tensor of shape (B, T, N_features) containing the mask coefficients.
+
+        Returns:
+            torch.Tensor: Perturbed inputs of shape (B, T, N_features), equal to apply on each sample
+                (up to the truncated tails if truncate is set).
+        """
+        if X is None or mask_tensor is None:
+            raise NameError("The mask_tensor should be fitted before or while calling the perturb method.")
+        B, T, N_features = mask_tensor.shape
+        # Convert the mask into a tensor containing the width of each Gaussian perturbation
+        sigma_tensor = self.sigma_max * ((1 + self.eps) - mask_tensor)
+        if self.truncate is None:
+            # Dense kernel over all (source, target) time pairs
+            dist_tensor = self.squared_time_dist(T).reshape(1, T, T, 1)
+            filter_coefs = torch.exp(torch.divide(-1.0 * dist_tensor, 2.0 * (sigma_tensor.unsqueeze(1) ** 2)))
+            filter_coefs = filter_coefs / torch.sum(filter_coefs, dim=1, keepdim=True)
+            # The perturbation is obtained by replacing each input by the linear combination weighted by Gaussian coefs
+            return torch.einsum("bsti,bsi->bti", filter_coefs, X)
+        # Banded kernel: windows of the zero-padded input around each time step
+        half_width = min(int(math.ceil(self.truncate * self.sigma_max)), T - 1)
+        offsets_sq, valid = self.band_time_dist(T, half_width)
+        X_windows = F.pad(X, (0, 0, half_width, half_width)).unfold(1, 2 * half_width + 1, 1) # (B, T, N_features, W)
+        filter_coefs = torch.exp(-1.0 * offsets_sq / (2.0 * (sigma_tensor.unsqueeze(-1) ** 2)))
+        filter_coefs = filter_coefs * valid.unsqueeze(1) # Padded positions take no weight
+        filter_coefs = filter_coefs / torch.sum(filter_coefs, dim=-1, keepdim=True)
+        return (filter_coefs * X_windows).sum(dim=-1)
+
     def apply_extremal(self, X: torch.Tensor, extremal_tensor: torch.Tensor):
         N_area, T, N_features = extremal_tensor.shape
         T_axis = torch.arange(1, T + 1, dtype=int, device=self.device)
@@ -117,6 +117,89 @@ class FITExplainer:
                     score[:, i, t] = E_div
         return score
 
+    @torch.no_grad()
+    def attribute_batched(self, x, y, times, n_samples=10, retrospective=False, distance_metric='kl', max_batch_size=None):
+        """
+        Batched version of attribute: same importance scores, computed as torch tensors on device
+            - All (feature, Monte-Carlo sample) counterfactuals of a time step go through the base model in one call
+              (split in chunks of max_batch_size if given)
+            - Each prefix prediction p(y|x_0:t) is computed once and reused as p(y|x_0:t-1) at the next step
+            - The generator is called once per feature per step, with all Monte-Carlo samples stacked in the batch
+        :param x: Sample instance to evaluate score for. Shape:[time, batch, features]
+        :param times: Sample instance time to evaluate score for. Shape [time, batch]
+        :param n_samples: number of Monte-Carlo samples
+        :param max_batch_size: largest batch given to the base model at once
+        :return: Importance score tensor of shape:[batch, features, time]
+        """
+        self.generator.eval()
+        self.generator.to(self.device)
+        x = x.to(self.device)
+        times = times.to(self.device)
+        if len(x.shape) < 3: # Check for batch dimension valid
+            x = x.unsqueeze(dim=1)
+        t_len, B, n_features = x.shape
+        n_cf = n_features * n_samples # Counterfactuals per instance at each time step
+        score = torch.zeros(B, n_features, t_len, device=self.device)
+        is_softmax = type(self.activation).__name__ == type(torch.nn.Softmax(-1)).__name__
+        # Generator needs B, F, T
+        xgen = x.permute(1, 2, 0)
+
+        def predict(x_in, times_in):
+            if max_batch_size is None:
+                return self.activation(self.base_model(x_in, times_in))
+            return torch.cat([self.activation(self.base_model(x_in[:, j:j + max_batch_size], times_in[:, j:j + max_batch_size]))
+                for j in range(0, x_in.shape[1], max_batch_size)], dim=0)
+
+        def kl_sum(p, q):
+            # KL(p || q) summed over classes, as KLDivLoss(log(q), p) in attribute
+            return torch.sum(torch.nn.functional.kl_div(torch.log(q), p, reduction='none'), -1)
+
+        def kl_multilabel_batched(p1, p2):
+            # Per-class Bernoulli KL(p1 || p2), as kl_multilabel
+            return p1 * (torch.log(p1) - torch.log(p2)) + (1 - p1) * (torch.log(1 - p1) - torch.log(1 - p2))
+
+        if retrospective:
+            p_y_full = predict(x, times)
+        p_prev = predict(x[0:1], times[0:1])
+
+        for t in range(1, t_len):
+            p_t = predict(x[:t+1], times[:t+1])
+            p_y_t = p_y_full if retrospective else p_t
+            p_tm1 = p_prev
+
+            # Counterfactual x_t for every (feature, sample) pair, ordered feature-major then sample then instance
+            past = xgen[:, :, :t].repeat(n_samples, 1, 1)
+            current = xgen[:, :, t].repeat(n_samples, 1)
+            x_hat_t = torch.cat([self.generator.forward_conditional(past, current, [i])[0] for i in range(n_features)], dim=0)
+            x_hat = x[:t+1].repeat(1, n_cf, 1)
+            x_hat[t] = x_hat_t.to(x_hat.dtype)
+            y_hat_t = predict(x_hat, times[:t+1].repeat(1, n_cf)).view(n_features, n_samples, B, -1)
+
+            p_y_t_rep = p_y_t.view(1, 1, B, -1)
+            p_tm1_rep = p_tm1.view(1, 1, B, -1)
+            if distance_metric == 'kl':
+                if is_softmax:
+                    div = kl_sum(p_y_t_rep, p_tm1_rep) - kl_sum(p_y_t_rep, y_hat_t)
+                else:
+                    div, _ = torch.max(kl_multilabel_batched(p_y_t_rep, p_tm1_rep) - kl_multilabel_batched(p_y_t_rep, y_hat_t), dim=-1)
+            elif distance_metric == 'mean_divergence':
+                div = torch.abs(y_hat_t - p_y_t_rep).mean(dim=-1)
+            elif distance_metric == 'LHS':
+                div = kl_sum(p_y_t_rep, p_tm1_rep).expand(n_features, n_samples, B)
+            elif distance_metric == 'RHS':
+                div = kl_sum(p_y_t_rep, y_hat_t)
+            E_div = div.mean(dim=1).transpose(0, 1) # Size (B, n_features)
+
+            if distance_metric == 'kl':
+                score[:, :, t] = 2. / (1 + torch.exp(-5 * E_div)) - 1
+            elif distance_metric == 'mean_divergence':
+                score[:, :, t] = 1 - E_div
+            else:
+                score[:, :, t] = E_div
+
+            p_prev = p_t
+        return score
+
 
 class FFCExplainer:
     def __init__(self, model, generator=None,activation=torch.nn.Softmax(-1)):
@@ -2,8 +2,8 @@ import torch
 from torch import nn
 import torch.nn.functional as F
 
-from txai.models.encoders.transformer_simple import TransformerMVTS
-from txai.utils.functional import transform_to_attn_mask
+from txai.models.encoders.transformer_simple import TransformerMVTS, get_time_features
+from txai.utils.functional import transform_to_keep_mask
 from txai.models.mask_generators.maskgen import MaskGenerator
 
 from txai.utils.predictors.loss import GSATLoss, ConnectLoss
@@ -55,6 +55,9 @@ default_loss_weights = {
     'connect': 1.0,
 }
 
+# Outputs that can be requested from TimeXModel.explain (same names as forward's output dict)
+explain_output_keys = ('pred', 'mask_logits', 'ste_mask', 'pred_mask', 'z_mask', 'ptype_inds')
+
 class TimeXModel(nn.Module):
     '''
     Model has full options through config
@@ -158,43 +161,73 @@ class TimeXModel(nn.Module):
 
         self.set_config()
 
-    def forward(self, src, times, captum_input = False):
-        # TODO: return early from function when in eval
-        
+    def time_features(self, times):
+        '''
+        Positional encodings, padding mask and lengths of (T, B) times, shared by all branches of one pass
+        '''
+        return get_time_features(times, self.encoder_pret.pos_encoder)
+
+    def encode_main(self, src, times, captum_input = False, time_feats = None):
+        '''
+        Runs encoder_main, returns (pred_regular, z_main, z_seq_main)
+            - z_seq_main is None unless the mask generator needs it (g_pret_equals_g)
+            - Output can be cached and given to forward as main_outputs when encoder_main is frozen
+        '''
         if captum_input:
             src = src.transpose(0, 1)
             times = times.transpose(0, 1)
 
         if self.ablation_parameters.archtype == 'transformer':
-            pred_regular, z_main, z_seq_main = self.encoder_main(src, times, captum_input = False, get_agg_embed = True)
+            pred_regular, z_main, z_seq_main = self.encoder_main(src, times, captum_input = False, get_agg_embed = True, 
+                time_feats = time_feats)
         else:
             pred_regular, z_main = self.encoder_main(src, times, captum_input = False, get_embedding = True)
+            z_seq_main = None
 
         if not self.ablation_parameters.g_pret_equals_g:
-            z_seq = self.encoder_pret.embed(src, times, captum_input = False, aggregate = False)
+            z_seq_main = None
+
+        return pred_regular, z_main, z_seq_main
+
+    def forward(self, src, times, captum_input = False, main_outputs = None):
+        # TODO: return early from function when in eval
+        
+        if captum_input:
+            src = src.transpose(0, 1)
+            times = times.transpose(0, 1)
+
+        time_feats = self.time_features(times)
+        enc_feats = {'time_feats': time_feats} if self.ablation_parameters.archtype == 'transformer' else {}
+
+        if main_outputs is None:
+            main_outputs = self.encode_main(src, times, captum_input = False, time_feats = time_feats)
+        pred_regular, z_main, z_seq_main = main_outputs
+
+        if not self.ablation_parameters.g_pret_equals_g:
+            z_seq = self.encoder_pret.embed(src, times, captum_input = False, aggregate = False, time_feats = time_feats)
         
 
         # Generate smooth_src: # TODO: expand to lists
         smooth_src_list, mask_in_list, ste_mask_list, = [], [], []
 
         if self.ablation_parameters.g_pret_equals_g:
-            mask_in, ste_mask = self.mask_generator(z_seq_main, src, times)
+            mask_in, ste_mask = self.mask_generator(z_seq_main, src, times, time_feats = time_feats)
         else:
-            mask_in, ste_mask = self.mask_generator(z_seq, src, times)
+            mask_in, ste_mask = self.mask_generator(z_seq, src, times, time_feats = time_feats)
 
         # Need sensor-level masking if multi-variate:
         if self.d_inp > 1 or (self.ablation_parameters.archtype != 'transformer'):
             exp_src, ste_mask_attn = self.multivariate_mask(src, ste_mask)
         else:
-            # Easy, simply transform to attention mask:
-            ste_mask_attn = transform_to_attn_mask(ste_mask)
+            # Easy, simply transform to attention keep-vector:
+            ste_mask_attn = transform_to_keep_mask(ste_mask)
             exp_src = src
 
         if self.ablation_parameters.archtype == 'transformer':
             if self.ablation_parameters.equal_g_gt:
-                pred_mask, z_mask, z_seq_mask = self.encoder_main(exp_src, times, attn_mask = ste_mask_attn, get_agg_embed = True)
+                pred_mask, z_mask, z_seq_mask = self.encoder_main(exp_src, times, attn_keep = ste_mask_attn, get_agg_embed = True, **enc_feats)
             else:
-                pred_mask, z_mask, z_seq_mask = self.encoder_t(exp_src, times, attn_mask = ste_mask_attn, get_agg_embed = True)
+                pred_mask, z_mask, z_seq_mask = self.encoder_t(exp_src, times, attn_keep = ste_mask_attn, get_agg_embed = True, **enc_feats)
         else:
             if self.ablation_parameters.equal_g_gt:
                 pred_mask, z_mask = self.encoder_main(exp_src, times, get_embeddding = True)
@@ -235,12 +268,14 @@ class TimeXModel(nn.Module):
             - More efficient than calling forward due to less module calls
         '''
 
+        time_feats = self.time_features(times)
+
         if self.ablation_parameters.g_pret_equals_g:
-            z_seq = self.encoder_main.embed(src, times, captum_input = False, aggregate = False)
+            z_seq = self.encoder_main.embed(src, times, captum_input = False, aggregate = False, time_feats = time_feats)
         else:
-            z_seq = self.encoder_pret.embed(src, times, captum_input = False, aggregate = False)
+            z_seq = self.encoder_pret.embed(src, times, captum_input = False, aggregate = False, time_feats = time_feats)
 
-        mask_in, ste_mask = self.mask_generator(z_seq, src, times)
+        mask_in, ste_mask = self.mask_generator(z_seq, src, times, time_feats = time_feats)
 
         out_dict = {
             'smooth_src': src,
@@ -250,15 +285,100 @@ class TimeXModel(nn.Module):
 
         return out_dict
 
+    def explain(self, src, times, outputs = ('ste_mask', 'ptype_inds'), captum_input = False):
+        '''
+        Inference-only pass that runs only the modules needed for the requested outputs
+            - outputs: iterable of keys in explain_output_keys, returned dict only holds these keys
+            - Shares the encoder_main pass with the mask generator if g_pret_equals_g and 'pred' is requested
+            - Masked branch goes through encoder_main if equal_g_gt, otherwise encoder_t
+        '''
+
+        outputs = set(outputs)
+        unknown = outputs - set(explain_output_keys)
+        if len(unknown) > 0:
+            raise ValueError('Unknown outputs for explain: {}'.format(sorted(unknown)))
+        if ('ptype_inds' in outputs) and (not self.ablation_parameters.ptype_assimilation):
+            raise ValueError('ptype_inds requires ptype_assimilation = True')
+
+        if captum_input:
+            src = src.transpose(0, 1)
+            times = times.transpose(0, 1)
+
+        is_transformer = (self.ablation_parameters.archtype == 'transformer')
+        need_masked_branch = len(outputs & {'pred_mask', 'z_mask', 'ptype_inds'}) > 0
+        need_mask = need_masked_branch or len(outputs & {'mask_logits', 'ste_mask'}) > 0
+
+        out_dict = {}
+        with torch.inference_mode():
+            time_feats = self.time_features(times)
+            enc_feats = {'time_feats': time_feats} if is_transformer else {}
+            z_seq = None
+            if 'pred' in outputs:
+                if is_transformer:
+                    out_dict['pred'], _, z_seq_main = self.encoder_main(src, times, captum_input = False, get_agg_embed = True, 
+                        time_feats = time_feats)
+                    if self.ablation_parameters.g_pret_equals_g:
+                        z_seq = z_seq_main # Reuse for mask generator
+                else:
+                    out_dict['pred'] = self.encoder_main(src, times, captum_input = False)
+
+            if not need_mask:
+                return out_dict
+
+            if z_seq is None:
+                if self.ablation_parameters.g_pret_equals_g:
+                    z_seq = self.encoder_main.embed(src, times, captum_input = False, aggregate = False, time_feats = time_feats)
+                else:
+                    z_seq = self.encoder_pret.embed(src, times, captum_input = False, aggregate = False, time_feats = time_feats)
+
+            mask_in, ste_mask = self.mask_generator(z_seq, src, times, time_feats = time_feats)
+            if 'mask_logits' in outputs:
+                out_dict['mask_logits'] = mask_in
+            if 'ste_mask' in outputs:
+                out_dict['ste_mask'] = ste_mask
+
+            if not need_masked_branch:
+                return out_dict
+
+            if self.d_inp > 1 or (not is_transformer):
+                exp_src, ste_mask_attn = self.multivariate_mask(src, ste_mask)
+            else:
+                ste_mask_attn = transform_to_keep_mask(ste_mask)
+                exp_src = src
+
+            encoder_masked = self.encoder_main if self.ablation_parameters.equal_g_gt else self.encoder_t
+
+            # Classification head of masked encoder only needed if its prediction is returned
+            need_clf_head = ('pred_mask' in outputs) and (not self.ablation_parameters.label_based_on_mask)
+            if is_transformer:
+                if need_clf_head:
+                    pred_mask, z_mask, _ = encoder_masked(exp_src, times, attn_keep = ste_mask_attn, get_agg_embed = True, **enc_feats)
+                else:
+                    z_mask = encoder_masked.embed(exp_src, times, captum_input = False, attn_keep = ste_mask_attn, **enc_feats)
+            else:
+                pred_mask, z_mask = encoder_masked(exp_src, times, get_embedding = True)
+
+            if 'pred_mask' in outputs:
+                if self.ablation_parameters.label_based_on_mask:
+                    pred_mask = self.z_e_predictor(z_mask)
+                out_dict['pred_mask'] = pred_mask
+            if 'z_mask' in outputs:
+                out_dict['z_mask'] = z_mask
+            if 'ptype_inds' in outputs:
+                _, match_m = self.hard_ptype_matching(z_mask)
+                out_dict['ptype_inds'] = match_m.argmax(dim=-1) # Rows are one-hot
+
+        return out_dict
+
     def forward_pass_ge(self, src, times, ste_mask, captum_input = False):
         if self.d_inp > 1:
             exp_src, ste_mask_attn = self.multivariate_mask(src, ste_mask)
         else:
-            # Easy, simply transform to attention mask:
-            ste_mask_attn = transform_to_attn_mask(ste_mask)
+            # Easy, simply transform to attention keep-vector:
+            ste_mask_attn = transform_to_keep_mask(ste_mask)
             exp_src = src
     
-        pred_mask, z_mask, z_seq_mask = self.encoder_t(exp_src, times, attn_mask = ste_mask_attn, get_agg_embed = True)
+        pred_mask, z_mask, z_seq_mask = self.encoder_t(exp_src, times, attn_keep = ste_mask_attn, get_agg_embed = True)
 
         return pred_mask
 
@@ -273,8 +393,8 @@ class TimeXModel(nn.Module):
         # print('src', src.shape)
         src_masked = src * ste_mask_rs + (1 - ste_mask_rs) * baseline
 
-        # Then deduce attention mask by multiplication across sensors:
-        attention_ste_mask = transform_to_attn_mask(ste_mask)
+        # Then deduce attention keep-vector across sensors:
+        attention_ste_mask = transform_to_keep_mask(ste_mask)
 
         return src_masked, attention_ste_mask
 
@@ -6,32 +6,74 @@ import torch.nn.functional as F
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
 class PositionalEncodingTF(nn.Module):
-    def __init__(self, d_model, max_len=500, MAX=10000,):
+    '''
+    Sinusoidal encoding of (T, B) times, output (T, B, d_model)
+        - Shared grids (every sample has the same times, e.g. arange(T) or arange(1, T+1)) are encoded once for (T, 1),
+            cached per grid and broadcast over B instead of recomputed
+        - regular_times: True always uses the first column as the shared grid (caller guarantees all columns are equal),
+            False always computes sinusoids, None checks each call whether all columns are equal
+    '''
+    def __init__(self, d_model, max_len=500, MAX=10000, regular_times = None, max_cached_grids = 8):
         super(PositionalEncodingTF, self).__init__()
         self.max_len = max_len
         self.d_model = d_model
         self.MAX = MAX
         self._num_timescales = d_model // 2
+        self.regular_times = regular_times
+        self.max_cached_grids = max_cached_grids
+
+        # Not persistent s.t. older state dicts still load:
+        self.register_buffer('timescales', max_len ** torch.linspace(0, 1, self._num_timescales), persistent = False)
+        self._grid_cache = {} # (T, device) -> list of (grid times (T, 1), encodings (T, 1, d_model))
 
     def getPE(self, P_time):
         B = P_time.shape[1] # Number of batches
 
         P_time = P_time.float()
 
-        # timescales = self.max_len ** torch.linspace(0, 1, self._num_timescales).to(device) this was numpy
-        timescales = self.max_len ** torch.linspace(0, 1, self._num_timescales).to(device)
+        timescales = self.timescales.to(P_time.device)
 
         #times = torch.Tensor(P_time.cpu()).unsqueeze(2)
         times = P_time.unsqueeze(2)
 
-        scaled_time = times / torch.Tensor(timescales[None, None, :])
+        scaled_time = times / timescales[None, None, :]
         # Use a 32-D embedding to represent a single time point
         pe = torch.cat([torch.sin(scaled_time), torch.cos(scaled_time)], axis=-1)  # T x B x d_model
         #pe = pe.type(torch.FloatTensor)
 
         return pe
 
-    def forward(self, P_time):
-        pe = self.getPE(P_time)
-        #pe = pe.to(device)
-        return pe
\ No newline at end of file
+    def get_grid_pe(self, grid):
+        '''
+        grid: (T, 1) times shared by all samples, returns cached (T, 1, d_model) encodings
+        '''
+        grid = grid.float()
+        entries = self._grid_cache.setdefault((grid.shape[0], str(grid.device)), [])
+        for cached_grid, pe in entries:
+            if torch.equal(cached_grid, grid):
+                return pe
+        pe = self.getPE(grid)
+        entries.append((grid.clone(), pe))
+        if len(entries) > self.max_cached_grids:
+            entries.pop(0)
+        return pe
+
+    def _apply(self, fn, *args, **kwargs):
+        # Cached encodings live on the old device after .to(...):
+        self._grid_cache = {}
+        return super(PositionalEncodingTF, self)._apply(fn, *args, **kwargs)
+
+    def forward(self, P_time, regular = None):
+        '''
+        P_time: (T, B) times
+        regular: overrides self.regular_times for this call
+        '''
+        regular = self.regular_times if regular is None else regular
+        T, B = P_time.shape[0], P_time.shape[1]
+
+        if regular is not False:
+            grid = P_time[:, :1]
+            if regular or bool((P_time == grid).all()):
+                return self.get_grid_pe(grid).expand(T, B, -1)
+
+        return self.getPE(P_time)
@@ -7,6 +7,7 @@ from reformer_pytorch import Reformer
 import os, ipdb
 import sys; sys.path.append(os.path.dirname(__file__))
 from .positional_enc import PositionalEncodingTF
+from txai.utils.health import health_check
 from ..layers import TransformerEncoderInterpret, TransformerEncoderLayerInterpret
 #from torch.nn import TransformerEncoder, TransformerEncoderLayer
 
@@ -26,6 +27,26 @@ pam_config = {
     'static': False,
 }
 
+def get_time_features(times, pos_encoder, padding_mask = None):
+    '''
+    Features of (T, B) times that every TransformerMVTS/MaskGenerator branch of a model recomputes
+        - pe: (T, B, d_pe) positional encodings
+        - pad_mask: (B, T) bool mask of padded steps (times < -1e5), None if no step is padded
+            - padding_mask: known (B, T) mask, or False for no padding, skips the sentinel scan (host sync)
+        - lengths: (B,) number of steps with times > 0
+    Compute once per batch and pass as time_feats to share across branches
+    '''
+    if padding_mask is None:
+        pad = (times < -1e5)
+        pad_mask = pad.transpose(0,1) if torch.any(pad) else None
+    else:
+        pad_mask = None if (padding_mask is False) else padding_mask
+    return {
+        'pe': pos_encoder(times),
+        'pad_mask': pad_mask,
+        'lengths': torch.sum(times > 0, dim=0),
+    }
+
 class TransformerMVTS(nn.Module):
     """ Transformer model with context embedding, aggregation, split dimension positional and element embedding
     Inputs:
@@ -184,9 +205,16 @@ class TransformerMVTS(nn.Module):
             show_sizes = False,
             src_mask = None,
             attn_mask = None,
+            attn_keep = None,
             aggregate = True,
             get_both_agg_full = False,
+            time_feats = None,
+            padding_mask = None,
         ):
+        '''
+        padding_mask: (B, T) bool mask of padded steps, or False if the batch has no padding
+            - Skips the times < -1e5 sentinel scan (host sync), used where src_mask would be derived from it
+        '''
         #print('src at entry', src.isnan().sum())
 
         if captum_input:
@@ -197,8 +225,13 @@ class TransformerMVTS(nn.Module):
         if len(src.shape) < 3:
             src = src.unsqueeze(dim=1)
 
-        if (src_mask is None) and torch.any(times < -1e5) and (attn_mask is None):
-            src_mask = (times < -1e5).transpose(0,1)
+        if (src_mask is None) and (attn_mask is None) and (attn_keep is None):
+            if padding_mask is not None:
+                src_mask = None if (padding_mask is False) else padding_mask
+            elif time_feats is not None:
+                src_mask = time_feats['pad_mask']
+            elif torch.any(times < -1e5):
+                src_mask = (times < -1e5).transpose(0,1)
             # if attn_mask is not None:
             #     attn_mask *= src_mask.unsqueeze(-1).repeat(1, 1, attn_mask.shape[-1])
             #     src_mask = None
@@ -206,7 +239,10 @@ class TransformerMVTS(nn.Module):
         if show_sizes:
             print('captum input = {}'.format(captum_input), src.shape, 'time:', times.shape)
 
-        lengths = torch.sum(times > 0, dim=0) # Lengths should be size (B,)
+        if time_feats is not None:
+            lengths = time_feats['lengths']
+        else:
+            lengths = torch.sum(times > 0, dim=0) # Lengths should be size (B,)
         maxlen, batch_size = src.shape[0], src.shape[1]
 
         if show_sizes:
@@ -222,16 +258,13 @@ class TransformerMVTS(nn.Module):
             print('self.MLP_encoder(src)', src.shape)
 
         # Must flip times to (T, B) for positional encoder
-        # if src.detach().clone().isnan().sum() > 0:
-        #     print('src before pe', src.isnan().sum())
-        pe = self.pos_encoder(times) # Positional encoder
+        pe = self.pos_encoder(times) if time_feats is None else time_feats['pe'] # Positional encoder
         pe = pe.to(src.device)
         x = torch.cat([pe, src], axis=2) # Concat position and src
 
-        if pe.isnan().sum() > 0:
-            print('pe', pe.isnan().sum())
-        if src.detach().clone().isnan().sum() > 0:
-            print('src after pe', src.isnan().sum())
+        # NaN checks only run under txai.utils.health.monitor_health (no host syncs otherwise):
+        health_check('pe', pe)
+        health_check('src', src)
 
         if show_sizes:
             print('torch.cat([pe, src], axis=2)', x.shape)
@@ -248,9 +281,9 @@ class TransformerMVTS(nn.Module):
         # Transformer must have (T, B, d)
         # src_key_padding_mask is (B, T)
         # mask is (B*n_heads,T,T) - if None has no effect
-        if x.isnan().sum() > 0:
-            print('before enc', x.isnan().sum())
-        output_preagg, attn = self.transformer_encoder(x, src_key_padding_mask = src_mask, mask = attn_mask)
+        # attn_keep is (B, T) - same as mask = keep[:,:,None] * keep[:,None,:], without building (B, T, T)
+        health_check('before enc', x)
+        output_preagg, attn = self.transformer_encoder(x, src_key_padding_mask = src_mask, mask = attn_mask, attn_keep = attn_keep)
 
         if show_sizes:
             print('transformer_encoder', output.shape)
@@ -299,9 +332,12 @@ class TransformerMVTS(nn.Module):
             captum_input = False, # Using captum-style input scheme (src.shape = (B, d, T), times.shape = (B, T))
             show_sizes = False, # Used for debugging
             attn_mask = None,
+            attn_keep = None,
             src_mask = None,
             get_embedding = False,
             get_agg_embed = False,
+            time_feats = None,
+            padding_mask = None,
             ):
         '''
         * Ensure all inputs are cuda before calling forward method
@@ -318,6 +354,9 @@ class TransformerMVTS(nn.Module):
                 - Can provide random mask for baseline purposes
             given_attn_mask (torch.Tensor): Mask on which to apply to the attention mechanism
                 - Can provide random mask for baseline comparison
+            attn_keep (torch.Tensor): (B, T) keep-vector, O(B*T) alternative to a (B, T, T) attn_mask
+            time_feats (dict): output of get_time_features(times, ...), skips recomputing pe/padding/lengths
+            padding_mask (torch.Tensor or False): known (B, T) padding mask, skips the sentinel scan
         '''
 
         #print('src_mask', src_mask.shape)
@@ -327,8 +366,11 @@ class TransformerMVTS(nn.Module):
             captum_input = captum_input,
             show_sizes = show_sizes,
             attn_mask = attn_mask,
+            attn_keep = attn_keep,
             src_mask = src_mask,
-            get_both_agg_full = True)
+            get_both_agg_full = True,
+            time_feats = time_feats,
+            padding_mask = padding_mask)
 
         output = self.mlp(out)
 
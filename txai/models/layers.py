@@ -1,5 +1,6 @@
 import torch
 import itertools
+import contextlib
 import numpy as np
 from torch import nn, Tensor
 import torch.nn.functional as F
@@ -13,10 +14,33 @@ from torch.nn.parameter import Parameter
 from torch.nn.functional import * # Import all needed tools for differentiable attn masking
 
 
+# Attention weights are only computed and returned by TransformerEncoderLayerInterpret while capture is on:
+_attn_capture = {'enabled': False, 'average_attn_weights': True}
+
+@contextlib.contextmanager
+def capture_attention(average_attn_weights = True):
+    '''
+    Makes TransformerEncoderInterpret return attention weights for forward passes inside the block
+        with capture_attention():
+            out, attn = encoder.transformer_encoder(x, ...) # attn[layer][0] is (B, T, T)
+    Outside of it attn entries are None and attention takes the fused path without materializing weights
+    '''
+    prev = dict(_attn_capture)
+    _attn_capture['enabled'] = True
+    _attn_capture['average_attn_weights'] = average_attn_weights
+    try:
+        yield
+    finally:
+        _attn_capture.update(prev)
+
+def attention_capture_enabled():
+    return _attn_capture['enabled']
+
 class TransformerEncoderLayerInterpret(nn.TransformerEncoderLayer):
     '''
     Overloaded version of the encoder layer s.t. we can extract self-attention
         - Also implements differentiable attention masking
+        - Attention weights are only returned inside capture_attention()
     '''
     def __init__(self, *args, **kwargs):
         super(TransformerEncoderLayerInterpret, self).__init__(*args, **kwargs)
@@ -42,13 +66,14 @@ class TransformerEncoderLayerInterpret(nn.TransformerEncoderLayer):
         
 
     def forward(self, src: Tensor, src_mask: Optional[Tensor] = None,
-                src_key_padding_mask: Optional[Tensor] = None) -> Tensor:
+                src_key_padding_mask: Optional[Tensor] = None, attn_keep: Optional[Tensor] = None) -> Tensor:
         r"""Pass the input through the encoder layer.
 
         Args:
             src: the sequence to the encoder layer (required).
             src_mask: the mask for the src sequence (optional).
             src_key_padding_mask: the mask for the src keys per batch (optional).
+            attn_keep: (B, T) differentiable keep-vector, see MultiHeadAttnMask (optional).
 
         Shape:
             see the docs in Transformer class.
@@ -60,7 +85,7 @@ class TransformerEncoderLayerInterpret(nn.TransformerEncoderLayer):
             self.self_attn.batch_first and
             self.self_attn._qkv_same_embed_dim and self.activation_relu_or_gelu and
             self.norm1.eps == self.norm2.eps and
-            src_mask is None and
+            src_mask is None and attn_keep is None and
                 not (src.is_nested and src_key_padding_mask is not None)):
             tensor_args = (
                 src,
@@ -106,12 +131,12 @@ class TransformerEncoderLayerInterpret(nn.TransformerEncoderLayer):
         x = src
         attn_list = []
         if self.norm_first:
-            sa_add, attn = self._sa_block(self.norm1(x), src_mask, src_key_padding_mask)
+            sa_add, attn = self._sa_block(self.norm1(x), src_mask, src_key_padding_mask, attn_keep)
             attn_list.append(attn)
             x = sa_add #x + sa_add KEY EDIT: Removes residual connection that leaked information when masking input
             x = x + self._ff_block(self.norm2(x))
         else:
-            sa_add, attn = self._sa_block(x, src_mask, src_key_padding_mask)
+            sa_add, attn = self._sa_block(x, src_mask, src_key_padding_mask, attn_keep)
             attn_list.append(attn)
             x = self.norm1(sa_add) #self.norm1(x + sa_add) KEY EDIT: Removes residual connection that leaked information when masking inputs
             x = self.norm2(x + self._ff_block(x))
@@ -120,12 +145,15 @@ class TransformerEncoderLayerInterpret(nn.TransformerEncoderLayer):
 
     # self-attention block
     def _sa_block(self, x: Tensor,
-                  attn_mask: Optional[Tensor], key_padding_mask: Optional[Tensor]) -> Tensor:
-        # Modified to output attention weights
+                  attn_mask: Optional[Tensor], key_padding_mask: Optional[Tensor],
+                  attn_keep: Optional[Tensor] = None) -> Tensor:
+        # Modified to output attention weights, only under capture_attention (None otherwise)
         x, attn_weights = self.self_attn(x, x, x,
                            attn_mask=attn_mask,
                            key_padding_mask=key_padding_mask,
-                           need_weights=True)
+                           need_weights=_attn_capture['enabled'],
+                           average_attn_weights=_attn_capture['average_attn_weights'],
+                           attn_keep=attn_keep)
         return self.dropout1(x), attn_weights
 
 class TransformerEncoderInterpret(nn.TransformerEncoder):
@@ -136,13 +164,15 @@ class TransformerEncoderInterpret(nn.TransformerEncoder):
     def __init__(self, *args, **kwargs):
         super(TransformerEncoderInterpret, self).__init__(*args, **kwargs)
 
-    def forward(self, src: Tensor, mask: Optional[Tensor] = None, src_key_padding_mask: Optional[Tensor] = None) -> Tensor:
+    def forward(self, src: Tensor, mask: Optional[Tensor] = None, src_key_padding_mask: Optional[Tensor] = None,
+            attn_keep: Optional[Tensor] = None) -> Tensor:
         r"""Pass the input through the encoder layers in turn.
 
         Args:
             src: the sequence to the encoder (required).
             mask: the mask for the src sequence (optional).
             src_key_padding_mask: the mask for the src keys per batch (optional).
+            attn_keep: (B, T) differentiable keep-vector, see MultiHeadAttnMask (optional).
 
         Shape:
             see the docs in Transformer class.
@@ -157,7 +187,7 @@ class TransformerEncoderInterpret(nn.TransformerEncoder):
                     first_layer.self_attn._qkv_same_embed_dim and first_layer.activation_relu_or_gelu and
                     first_layer.norm1.eps == first_layer.norm2.eps and
                     src.dim() == 3 and self.enable_nested_tensor) :
-                if src_key_padding_mask is not None and not output.is_nested and mask is None:
+                if src_key_padding_mask is not None and not output.is_nested and mask is None and attn_keep is None:
                     tensor_args = (
                         src,
                         first_layer.self_attn.in_proj_weight,
@@ -185,7 +215,7 @@ class TransformerEncoderInterpret(nn.TransformerEncoder):
             if convert_to_nested:
                 output, attn = mod(output, src_mask=mask)
             else:
-                output, attn = mod(output, src_mask=mask, src_key_padding_mask=src_key_padding_mask)
+                output, attn = mod(output, src_mask=mask, src_key_padding_mask=src_key_padding_mask, attn_keep=attn_keep)
             attn_per_layer.append(attn)
 
         if convert_to_nested:
@@ -202,7 +232,7 @@ class MultiHeadAttnMask(torch.nn.MultiheadAttention):
 
     def forward(self, query: Tensor, key: Tensor, value: Tensor, key_padding_mask: Optional[Tensor] = None,
                 need_weights: bool = True, attn_mask: Optional[Tensor] = None,
-                average_attn_weights: bool = True) -> Tuple[Tensor, Optional[Tensor]]:
+                average_attn_weights: bool = True, attn_keep: Optional[Tensor] = None) -> Tuple[Tensor, Optional[Tensor]]:
         r"""
         Args:
             query: Query embeddings of shape :math:`(L, E_q)` for unbatched input, :math:`(L, N, E_q)` when ``batch_first=False``
@@ -237,6 +267,10 @@ class MultiHeadAttnMask(torch.nn.MultiheadAttention):
             average_attn_weights: If true, indicates that the returned ``attn_weights`` should be averaged across
                 heads. Otherwise, ``attn_weights`` are provided separately per head. Note that this flag only has an
                 effect when ``need_weights=True``. Default: ``True`` (i.e. average weights across heads)
+            attn_keep: If specified, a float keep-vector of shape :math:`(N, S)` (self-attention only). Equivalent
+                to the float ``attn_mask`` ``keep[:, :, None] * keep[:, None, :]`` multiplied in after the softmax,
+                but applied as a gating of values (keys) and outputs (queries), so no :math:`(N, L, S)` mask is built.
+                Gradients flow through ``attn_keep``.
 
         Outputs:
             - **attn_output** - Attention outputs of shape :math:`(L, E)` when input is unbatched,
@@ -282,6 +316,8 @@ class MultiHeadAttnMask(torch.nn.MultiheadAttention):
             why_not_fast_path = "_qkv_same_embed_dim was not True"
         elif attn_mask is not None:
             why_not_fast_path = "attn_mask was not None"
+        elif attn_keep is not None:
+            why_not_fast_path = "attn_keep was not None"
         elif query.is_nested and key_padding_mask is not None:
             why_not_fast_path = "key_padding_mask is not supported with NestedTensor input"
 
@@ -343,7 +379,7 @@ class MultiHeadAttnMask(torch.nn.MultiheadAttention):
                 key_padding_mask=key_padding_mask, need_weights=need_weights,
                 attn_mask=attn_mask, use_separate_proj_weight=True,
                 q_proj_weight=self.q_proj_weight, k_proj_weight=self.k_proj_weight,
-                v_proj_weight=self.v_proj_weight, average_attn_weights=average_attn_weights)
+                v_proj_weight=self.v_proj_weight, average_attn_weights=average_attn_weights, attn_keep=attn_keep)
         else:
             attn_output, attn_output_weights = multi_head_attention_forward_differentiable(
                 query, key, value, self.embed_dim, self.num_heads,
@@ -352,7 +388,7 @@ class MultiHeadAttnMask(torch.nn.MultiheadAttention):
                 self.dropout, self.out_proj.weight, self.out_proj.bias,
                 training=self.training,
                 key_padding_mask=key_padding_mask, need_weights=need_weights,
-                attn_mask=attn_mask, average_attn_weights=average_attn_weights)
+                attn_mask=attn_mask, average_attn_weights=average_attn_weights, attn_keep=attn_keep)
         if self.batch_first and is_batched:
             return attn_output.transpose(1, 0), attn_output_weights
         else:
@@ -383,6 +419,7 @@ def multi_head_attention_forward_differentiable(
     static_k: Optional[Tensor] = None,
     static_v: Optional[Tensor] = None,
     average_attn_weights: bool = True,
+    attn_keep: Optional[Tensor] = None,
 ) -> Tuple[Tensor, Optional[Tensor]]:
     r"""
     Args:
@@ -411,6 +448,11 @@ def multi_head_attention_forward_differentiable(
         average_attn_weights: If true, indicates that the returned ``attn_weights`` should be averaged across heads.
             Otherwise, ``attn_weights`` are provided separately per head. Note that this flag only has an effect
             when ``need_weights=True.``. Default: True
+        attn_keep: float keep-vector over positions, gates values before and outputs after attention (self-attention only).
+
+    NOTE: with need_weights=False and no float attn_mask, attention runs through F.scaled_dot_product_attention
+        (fused kernels, weights never materialized). Float attn_masks are multiplied after the softmax, so they
+        use the explicit bmm path.
     Shape:
         Inputs:
         - query: :math:`(L, E)` or :math:`(L, N, E)` where L is the target sequence length, N is the batch size, E is
@@ -486,6 +528,8 @@ def multi_head_attention_forward_differentiable(
         value = value.unsqueeze(1)
         if key_padding_mask is not None:
             key_padding_mask = key_padding_mask.unsqueeze(0)
+        if attn_keep is not None:
+            attn_keep = attn_keep.unsqueeze(0)
 
     # set up shape vars
     tgt_len, bsz, embed_dim = query.shape
@@ -597,6 +641,13 @@ def multi_head_attention_forward_differentiable(
     # update source sequence length after adjustments
     src_len = k.size(1)
 
+    # keep-vector as (bsz * num_heads, S, 1) gate, same for queries and keys:
+    if attn_keep is not None:
+        assert (bias_k is None) and (not add_zero_attn) and (tgt_len == src_len), \
+            "attn_keep is only supported for plain self-attention"
+        keep = attn_keep.to(q.dtype).view(bsz, 1, src_len, 1).expand(-1, num_heads, -1, -1).reshape(bsz * num_heads, src_len, 1)
+        v = v * keep # Zero-out masked keys post-softmax
+
     # merge key padding and attention masks
     if key_padding_mask is not None:
         assert key_padding_mask.shape == (bsz, src_len), \
@@ -632,6 +683,21 @@ def multi_head_attention_forward_differentiable(
     #   See commit: https://github.com/pytorch/pytorch/commit/4d7ec302202caaf35bb8c997d035c54f0c24e192
     #       in the PyTorch GitHub for when it was changed.
 
+    # Fused path: SDPA covers everything except a dense float mask multiplied in after the softmax
+    #   - attn_keep is already applied to v (keys) and is applied to the output (queries) below
+    if (not need_weights) and (attn_mask is None or bool_attn_mask) and hasattr(F, 'scaled_dot_product_attention'):
+        attn_output = F.scaled_dot_product_attention(q, k, v, attn_mask = attn_mask, dropout_p = dropout_p)
+        if attn_keep is not None:
+            attn_output = attn_output * keep # Zero-out masked queries
+
+        attn_output = attn_output.transpose(0, 1).contiguous().view(tgt_len * bsz, embed_dim)
+        attn_output = linear(attn_output, out_proj_weight, out_proj_bias)
+        attn_output = attn_output.view(tgt_len, bsz, attn_output.size(1))
+        if not is_batched:
+            # squeeze the output if input was unbatched
+            attn_output = attn_output.squeeze(1)
+        return attn_output, None
+
     B, Nt, E = q.shape
     q_scaled = q / math.sqrt(E)
     if attn_mask is not None and bool_attn_mask:
@@ -653,6 +719,11 @@ def multi_head_attention_forward_differentiable(
 
     attn_output = torch.bmm(attn_output_weights, v)
 
+    if attn_keep is not None:
+        attn_output = attn_output * keep # Zero-out masked queries
+        if need_weights:
+            attn_output_weights = attn_output_weights * keep * keep.transpose(1, 2)
+
     attn_output = attn_output.transpose(0, 1).contiguous().view(tgt_len * bsz, embed_dim)
     attn_output = linear(attn_output, out_proj_weight, out_proj_bias)
     attn_output = attn_output.view(tgt_len, bsz, attn_output.size(1))
@@ -91,14 +91,22 @@ class MaskGenerator(nn.Module):
 
         return total_mask_reparameterize
 
-    def forward(self, z_seq, src, times, get_agg_z = False):
+    def forward(self, z_seq, src, times, get_agg_z = False, time_feats = None):
+        # time_feats: shared features from get_time_features, pe reused if dimensions match
 
-        if torch.any(times < -1e5):
+        if time_feats is not None:
+            tgt_mask = time_feats['pad_mask']
+        elif torch.any(times < -1e5):
             tgt_mask = (times < -1e5).transpose(0,1)
         else:
             tgt_mask = None
 
-        x = torch.cat([src, self.pos_encoder(times)], dim = -1)
+        if (time_feats is not None) and (time_feats['pe'].shape[-1] == self.pos_encoder.d_model):
+            pe = time_feats['pe']
+        else:
+            pe = self.pos_encoder(times)
+
+        x = torch.cat([src, pe], dim = -1)
         z_seq_dec = self.mask_decoder(tgt = x, memory = z_seq, tgt_key_padding_mask = tgt_mask)
         z_pre_agg = self.pre_agg_net(z_seq_dec)
 
@@ -1,4 +1,6 @@
+import os
 import torch
+import numpy as np
 
 def concat_all_dicts(dlist, org_v = False):
     # Marries together all dictionaries
@@ -34,29 +36,99 @@ def concat_all_dicts(dlist, org_v = False):
 
     return mother_dict
 
-def batch_forwards(model, X, times, batch_size = 64, org_v = False):
+# Dimension along which each forward output is batched (0 if not listed):
+output_batch_dims = {
+    'smooth_src': 1,
+}
+
+# Outputs concatenated across batches, as in concat_all_dicts (others, e.g. ptype_inds, ptypes, stay per-batch lists):
+concat_output_keys = ['pred', 'pred_mask', 'mask_logits', 'ste_mask', 'smooth_src', 'all_z', 'z_mask_list']
+
+def flatten_output_dict(out, keys = None, org_v = False):
+    '''
+    Flattens forward output into {name: tensor}, splitting tuples like all_z into 'all_z.0', 'all_z.1'
+    '''
+    flat = {}
+    for k, v in out.items():
+        if (keys is not None) and (k not in keys):
+            continue
+        if k == 'smooth_src' and org_v:
+            v = torch.stack(v, dim = -1)
+        if isinstance(v, tuple):
+            for i, vi in enumerate(v):
+                flat['{}.{}'.format(k, i)] = vi
+        else:
+            flat[k] = v
+    return flat
+
+def allocate_output_buffer(t, batch_dim, N, memmap_path = None):
+    shape = list(t.shape)
+    shape[batch_dim] = N
+    if memmap_path is not None:
+        np_dtype = torch.empty(0, dtype = t.dtype).numpy().dtype
+        mm = np.memmap(memmap_path, dtype = np_dtype, mode = 'w+', shape = tuple(shape))
+        return torch.from_numpy(mm) # Shares memory with the memmap file
+    return torch.empty(shape, dtype = t.dtype, pin_memory = torch.cuda.is_available())
+
+def batch_forwards(model, X, times, batch_size = 64, org_v = False, keys = None, memmap_dir = None):
     '''
     Runs the model in batches for large datasets. Used to get lots of embeddings, outputs, etc.
-        - Need to use this bc there's a specialized dictionary notation for output of the forward method (see concat_all_dicts)
+        - Output buffers are allocated from the shapes of the first batch and each batch is written in place
+        - keys: only keep these keys of the output dict (e.g. ['z_mask_list', 'pred']), others are never copied
+        - memmap_dir: write outputs to np.memmap files in this directory instead of (pinned) CPU memory
+        - Only concat_output_keys (plus concept_scores if org_v) are concatenated, other outputs are returned as
+            per-batch lists like concat_all_dicts did
     '''
 
-    iters = torch.arange(0, X.shape[1], step = batch_size)
-    out_list = []
+    N = X.shape[1]
+    buffers, lists = None, {}
+    concat_keys = concat_output_keys + (['concept_scores'] if org_v else [])
 
-    for i in range(len(iters)):
-        if i == (len(iters) - 1):
-            batch_X = X[:,iters[i]:,:]
-            batch_times = times[:,iters[i]:]
-        else:
-            batch_X = X[:,iters[i]:iters[i+1],:]
-            batch_times = times[:,iters[i]:iters[i+1]]
+    if memmap_dir is not None:
+        os.makedirs(memmap_dir, exist_ok = True)
+
+    for start in range(0, N, batch_size):
+        batch_X = X[:,start:(start + batch_size),:]
+        batch_times = times[:,start:(start + batch_size)]
 
         with torch.no_grad():
             out = model(batch_X, batch_times, captum_input = False)
 
-        out_list.append(out)
-
-    out_full = concat_all_dicts(out_list, org_v = org_v)
+        out = {k: v for k, v in out.items() if (keys is None) or (k in keys)}
+        for k, v in out.items():
+            if k not in concat_keys:
+                lists.setdefault(k, []).append(v) # Kept as returned by the model
+        flat = flatten_output_dict({k: v for k, v in out.items() if k in concat_keys}, org_v = org_v)
+
+        if buffers is None:
+            buffers = {}
+            for k, v in flat.items():
+                if not torch.is_tensor(v):
+                    continue
+                bd = output_batch_dims.get(k.split('.')[0], 0)
+                mpath = None if memmap_dir is None else os.path.join(memmap_dir, '{}.dat'.format(k))
+                buffers[k] = allocate_output_buffer(v, bd, N, memmap_path = mpath)
+
+        for k, v in flat.items():
+            if k in buffers:
+                bd = output_batch_dims.get(k.split('.')[0], 0)
+                buffers[k].narrow(bd, start, v.shape[bd]).copy_(v, non_blocking = buffers[k].is_pinned())
+            else:
+                lists.setdefault(k, []).append(v)
+
+    if torch.cuda.is_available():
+        torch.cuda.synchronize() # Wait on non_blocking copies into pinned buffers
+
+    # Rebuild tuples, e.g. all_z = (z_main, z_mask):
+    out_full, tuple_parts = {}, {}
+    for k, v in list(buffers.items()) + list(lists.items()):
+        if '.' in k:
+            name, i = k.split('.')
+            tuple_parts.setdefault(name, {})[int(i)] = v
+        else:
+            out_full[k] = v
+    for name, parts in tuple_parts.items():
+        out_full[name] = tuple(parts[i] for i in sorted(parts))
 
     return out_full
 
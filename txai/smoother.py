@@ -7,7 +7,7 @@ import torch.nn.functional as F
 sqrt2PI = math.sqrt(2.0 * math.pi)
 
 class Smoother(nn.Module):
-    def __init__(self, memory_efficient = False, init_p = None):
+    def __init__(self, memory_efficient = False, init_p = None, chunk_size = 64):
         super(Smoother, self).__init__()
         # Parameterize smoothing length s.t. it isn't so close to 0
         if init_p is None:
@@ -15,12 +15,13 @@ class Smoother(nn.Module):
         else:
             self.p = nn.Parameter(torch.tensor(init_p), requires_grad = True)
         self.memory_efficient = memory_efficient
+        self.chunk_size = chunk_size
         # MUST PARAMETERIZE TO BE ABSOLUTE VALUE
 
     def generate_spread_coefs(self, times, tcenter):
         # tcenter = centered point in the curve:
         # Times should already be masked
-        return 1.0 / (self.p * sqrt2PI) * torch.exp(-0.5 * ((times - tcenter) / self.p))
+        return spread_coefs(self.p.abs(), times, tcenter)
 
     def forward(self, src, time, mask = None):
         '''
@@ -29,108 +30,146 @@ class Smoother(nn.Module):
         src: (T, B, 1) Src should be single-channeled
         time: (T, B)
         mask: (T, B, 1) mask follows size of src 
-        '''
 
-        new_src = torch.empty_like(src).to(src.device)
+        Builds (rows, T, B) coefficients for a chunk of centers at a time
+            - memory_efficient: chunk_size centers per chunk, else all T at once
+        '''
 
-        if self.memory_efficient:
-            
-            for t in range(times.shape[0]):
-                coef = self.generate_spread_coefs(time, tcenter = time[t])
+        T = time.shape[0]
+        new_src = torch.empty_like(src)
+        rows = self.chunk_size if self.memory_efficient else T
 
-                if mask is not None:
-                    coef = coef * mask
+        for start in range(0, T, rows):
+            end = min(start + rows, T)
+            coef = self.generate_spread_coefs(time.unsqueeze(0), tcenter = time[start:end].unsqueeze(1)) # (rows, T, B)
 
-                coef = coef.softmax(dim=0) # Softmax across time dimension
-                print('Coef', coef)
-                exit()
+            if mask is not None:
+                coef = coef * mask[...,0].unsqueeze(0)
 
-                new_src[t,:,0] = (src * coef).sum(dim=0) # Should be (B,) tensor 
+            coef = coef.softmax(dim=1) # Softmax across time dimension
 
-        else: # TODO: implement version that uses more memory but consists of only tensor operations (no for loop)
-            # Generate (T, T, B) matrix of coefficients
-            pass
+            new_src[start:end,:,0] = (src[:,:,0].unsqueeze(0) * coef).sum(dim=1)
 
         return new_src
 
 # As functions:
 
+def spread_coefs(p, times, tcenter):
+    '''
+    Gaussian density of times around tcenter, broadcasts over any leading dims
+    times, tcenter: (..., B) tensors
+    p: (B,) or (B, 1) tensor, or float
+    '''
+    p = torch.as_tensor(p, device = times.device).reshape(-1)
+    return 1.0 / (p * sqrt2PI + 1e-9) * torch.exp(-0.5 * ((times - tcenter) / (p + 1e-9)) ** 2)
+
 def generate_spread_coefs(p, times, tcenter):
     '''
     tcenter = centered point in the curve:
     Times should already be masked
     p should be (B,)
     '''
-    #print('tcenter', tcenter.shape)
-    tcenter_rep = tcenter.unsqueeze(0).repeat(times.shape[0], 1)
-    p_rep = p.repeat(1, times.shape[0]).transpose(0, 1)
-    # print('times', times.shape)
-    # print('tcenter_rep', tcenter_rep.shape)
-    # print('prep', p_rep.shape)
-    return 1.0 / (p_rep * sqrt2PI + 1e-9) * torch.exp(-0.5 * ((times - tcenter_rep) / (p_rep + 1e-9)) ** 2)
-
-def smoother(src, time, p, mask = None):
-        new_src = torch.empty_like(src).to(src.device)
-
-        #print('time', time.shape)
-            
-        for t in range(time.shape[0]):
-            # time: (B, T)
-            # tcenter: (B,)
-
-            coef = generate_spread_coefs(p = p, times = time, tcenter = time[t,:])
-
-            coef = coef[:(t+1),:].softmax(dim=0) # Softmax across time dimension
-
-            if mask is not None:
-                coef = coef * mask[:,:(t+1)].transpose(0, 1).squeeze() # Mask after softmax
-                #coef = coef * mask.transpose(0, 1).squeeze()
-
-            #coef = coef[:(t+1),:] / (coef[:(t+1),:].sum() + 1e-9)
+    # times: (T, B), tcenter: (B,) -> (T, B)
+    return spread_coefs(p, times, tcenter.unsqueeze(0))
 
-            #print('coef', coef.shape)
+def causal_windows(x, window):
+    '''
+    x: (T, B) -> (T, B, window), entry k at t holds x[t - window + 1 + k] (zero before start of sequence)
+    '''
+    return F.pad(x.transpose(0, 1), (window - 1, 0)).unfold(1, window, 1).transpose(0, 1)
 
-            #coef_rep = coef.repeat(1, src.shape[1])
-            new_src[t,:,0] = (src[:(t+1),:,0] * coef).sum(dim=0) # Should be (B,) tensor 
+def smoother(src, time, p, mask = None, window = None, chunk_size = None):
+    '''
+    Causal Gaussian smoother: new_src[t] = sum_{s <= t} softmax_s(coef(time[s] - time[t])) * mask[s] * src[s]
 
-        # else: # TODO: implement version that uses more memory but consists of only tensor operations (no for loop)
-        #     # Generate (T, T, B) matrix of coefficients
-        #     pass
+    src: (T, B, 1)
+    time: (T, B)
+    p: (B, 1) smoothing length (gradients flow through all paths)
+    mask: (B, T), applied after softmax
 
-        return new_src
-
-def exponential_smoother(src, time, p):
+    window: if given, only the last window steps get exact coefficients
+        - Coefficients of older steps are treated as 0 (logit exp(0) = 1), carried with a cumulative sum
+        - Exact when the Gaussian density is negligible past window steps, O(T * B * window) memory
+    chunk_size: without window, number of centers per (chunk_size, T, B) block (None = all T)
     '''
-    Simple exponential smoother on whole sample
+    T, B = time.shape
+    x = src[...,0]
+    xm = x if mask is None else x * mask.reshape(B, T).transpose(0, 1)
 
-    NOTE: only works on single-channel, but simple to extend to multivariate
+    if (window is None) or (window >= T):
+        new_src = torch.empty_like(src)
+        rows = T if chunk_size is None else chunk_size
+        causal = torch.ones(T, T, dtype = torch.bool, device = time.device).tril()
 
-    p: (B,) tensor
-    '''
+        for start in range(0, T, rows):
+            end = min(start + rows, T)
+            coef = spread_coefs(p, time.unsqueeze(0), time[start:end].unsqueeze(1)) # (rows, T, B)
+            coef = coef.masked_fill(~causal[start:end].unsqueeze(-1), -math.inf).softmax(dim=1) # Softmax across time dimension
+            new_src[start:end,:,0] = (xm.unsqueeze(0) * coef).sum(dim=1) # Mask after softmax
 
-    #print('p', p.shape)
+        return new_src
 
-    T, B, d = src.shape
+    # Windows as (T, window, B) so p broadcasts over the batch dim:
+    valid = causal_windows(torch.ones_like(time), window).transpose(1, 2).bool()
+    time_w = causal_windows(time, window).transpose(1, 2)
+    logits = spread_coefs(p, time_w, time.unsqueeze(1)).masked_fill(~valid, -math.inf) # (T, window, B)
 
-    #coef = torch.zeros(T, T, B, device = src.device)
+    # Shift by max for stability, out-of-window logits are ~0:
+    shift = logits.max(dim=1)[0].clamp(min = 0)
+    e_band = torch.exp(logits - shift.unsqueeze(1))
+    e_out = torch.exp(-shift)
 
-    #print('p', p)
+    # Number and masked sum of steps older than the window:
+    n_out = (torch.arange(T, device = time.device) + 1 - window).clamp(min = 0).unsqueeze(-1)
+    cs = xm.cumsum(dim=0)
+    sum_out = torch.cat([torch.zeros_like(cs[:window]), cs[:(T - window)]], dim = 0)
 
-    coef = torch.cat([torch.eye(T, device = src.device).unsqueeze(-1) * p[i] for i in range(B)], dim = -1)
+    num = e_out * sum_out + (e_band * causal_windows(xm, window).transpose(1, 2)).sum(dim=1)
+    Z = e_out * n_out + e_band.sum(dim=1)
 
-    #print('coef 1', coef)
+    return (num / Z).unsqueeze(-1)
 
-    coef[0,0,:] = 1 # Top left is 1
+# Above this length, exponential_smoother uses the FFT path by default
+fft_min_len = 256
 
-    for i in range(T):
-        restcol = ((1 - p).repeat(1,T - i).transpose(0,1) ** torch.arange(T - i, device = p.device).unsqueeze(-1).repeat(1,B))
-        #print('rc', restcol.shape)
-        coef[i,i:,:] = coef[i,i,:].unsqueeze(0).repeat(T-i,1) * restcol
+def exponential_smoother(src, time, p, method = None):
+    '''
+    Simple exponential smoother on whole sample
+        - new_src[i] = c_i * sum_{j >= i} (1 - p)^(j - i) src[j], c_0 = 1, c_i = p otherwise
 
-    #print('coef', coef)
-    smoothed_src = torch.bmm(coef.permute(2, 0, 1), src.transpose(1, 0))
+    p: (B, 1) tensor
+    method: 'dense' builds (B, T, T) coefficients, 'fft' convolves with the (1 - p)^k kernel in O(T log T)
+        - None picks 'fft' for T > fft_min_len
+    '''
 
-    #print('Smoothed', smoothed_src.shape)
+    T, B, d = src.shape
+    p = p.reshape(B, 1)
+    q = 1 - p
+
+    if method is None:
+        method = 'fft' if T > fft_min_len else 'dense'
+
+    c = p.repeat(1, T) # (B, T)
+    c = torch.cat([torch.ones_like(c[:,:1]), c[:,1:]], dim = 1) # Top left is 1
+
+    if method == 'dense':
+        k = torch.arange(T, device = src.device)
+        lag = (k.unsqueeze(0) - k.unsqueeze(1)) # lag[i,j] = j - i
+        upper = (lag >= 0)
+        coef = q.unsqueeze(-1) ** lag.clamp(min = 0).unsqueeze(0) * upper.unsqueeze(0) # (B, T, T)
+        coef = coef * c.unsqueeze(-1)
+        smoothed_src = torch.bmm(coef, src.transpose(1, 0))
+
+    elif method == 'fft':
+        # Anti-causal sum = causal convolution on time-reversed input:
+        kernel = q ** torch.arange(T, device = src.device).unsqueeze(0) # (B, T)
+        rev = src.flip(0).permute(1, 2, 0) # (B, d, T)
+        n = 2 * T
+        conv = torch.fft.irfft(torch.fft.rfft(rev, n = n) * torch.fft.rfft(kernel, n = n).unsqueeze(1), n = n)[...,:T]
+        smoothed_src = (conv.flip(-1) * c.unsqueeze(1)).transpose(1, 2) # (B, T, d)
+
+    else:
+        raise NotImplementedError('Unknown method "{}"'.format(method))
 
     return smoothed_src.transpose(0, 1)
 
@@ -145,7 +184,7 @@ if __name__ == '__main__':
 
     texp = torch.arange(rand_seq.shape[0]).unsqueeze(-1).repeat(1, rand_seq.shape[1])
     print('t', texp)
-    smoothed = smoother(rand_seq, time = texp, p = 4)
+    smoothed = smoother(rand_seq, time = texp, p = torch.tensor([[4.0]]))
     print('Before smooth', rand_seq.squeeze())
     print('After smooth', smoothed.squeeze())
 
@@ -14,6 +14,27 @@ from tqdm import trange, tqdm
 
 from txai.synth_data.synth_data_base import GenerateSynth, print_tuple, visualize_some, plot_visualize_some
 
+def spike_batch(T, n, freq, start_high, offsets, values, noise):
+    '''
+    Vectorized FreqShapes sampling of n sequences: spikes repeat every freq steps from a random start
+        - offsets: positions of spike values relative to each spike center, values: (n_values,) spike shape
+        - Spikes not fully inside [0, T) are dropped, like in generate_seq
+    '''
+    start = np.random.randint(0, start_high, size = n)
+    centers = start[:,None] + freq * np.arange(math.ceil(T / freq))[None,:] # (n, n_spikes)
+    valid = (centers + offsets[0] >= 0) & (centers + offsets[-1] < T)
+
+    X = np.zeros((n, T, 1))
+    gt = np.zeros((n, T), dtype = bool)
+    rows, cols = np.nonzero(valid)
+    for o, v in zip(offsets, values):
+        X[rows, centers[rows, cols] + o, 0] = v
+        gt[rows, centers[rows, cols] + o] = True
+
+    X += np.random.normal(loc = 0, scale = noise, size = (n, T, 1))
+    gt_exps = [[(int(g), 0) for g in np.nonzero(gt[k])[0]] for k in range(n)]
+    return X, gt_exps
+
 class FreqShapes(GenerateSynth):
 
     class_prop_map = {
@@ -71,6 +92,14 @@ class FreqShapes(GenerateSynth):
         samp += np.random.normal(loc = 0, scale = self.noise, size = (self.T,1))
 
         return samp, [(g, 0) for g in gt_exp]
+
+    def generate_batch(self, class_num, n):
+        assert class_num in [0,1,2,3], 'class_num must be in [0,1,2]'
+        shape, freq = self.class_prop_map[class_num]
+        spike = 0.25 * (np.arange(-1, 2)) ** 2 - 2 # Downward spike
+        if shape == 1:
+            spike = -0.25 * (np.arange(-1, 2)) ** 2 + 2 # Upward spike
+        return spike_batch(self.T, n, freq, self.T - freq, np.arange(-1, 2), spike, self.noise)
     
 class FreqShapesUpDown(GenerateSynth):
 
@@ -133,6 +162,17 @@ class FreqShapesUpDown(GenerateSynth):
 
         return samp, [(g, 0) for g in gt_exp]
 
+    def generate_batch(self, class_num, n):
+        assert class_num in [0,1,2,3], 'class_num must be in [0,1,2]'
+        shape, freq = self.class_prop_map[class_num]
+        downspike = 0.25 * (np.arange(-1, 2)) ** 2 - 2
+        upspike = -0.25 * (np.arange(-1, 2)) ** 2 + 2
+        if shape == 0:
+            spike = np.concatenate((downspike, upspike)) # Downward then up spike
+        else:
+            spike = np.concatenate((upspike, downspike)) # Upward then downward spike
+        return spike_batch(self.T, n, freq, self.T - freq - 5, np.arange(-3, 3), spike, self.noise)
+
 if __name__ == '__main__':
 
     gen = FreqShapesUpDown(T = 50)
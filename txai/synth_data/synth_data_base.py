@@ -7,12 +7,14 @@ import os
 from sklearn.preprocessing import OneHotEncoder
 from sklearn.preprocessing import StandardScaler, MinMaxScaler
 import random
+import multiprocessing as mp
 import matplotlib.pyplot as plt
 
 import torch
 from tqdm import trange, tqdm
 
 from txai.vis.vis_saliency import vis_one_saliency
+from txai.utils.functional import index_batch
 
 class SynthTrainDataset(torch.utils.data.Dataset):
     def __init__(self, X, times, y):
@@ -22,11 +24,16 @@ class SynthTrainDataset(torch.utils.data.Dataset):
         return self.X.shape[1]
     
     def __getitem__(self, idx):
+        if torch.is_tensor(idx) and idx.dim() > 0: # Batch of indices, e.g. from IndexBatchSampler
+            return self.get_batch(idx)
         x = self.X[:,idx,:]
         T = self.times[:,idx]
         y = self.y[idx]
         return x, T, y 
 
+    def get_batch(self, idx):
+        return index_batch(self.X, self.times, self.y, idx.long())
+
 def print_tuple(t):
     print('X', t[0].shape)
     print('time', t[1].shape)
@@ -87,6 +94,27 @@ def plot_visualize_some(dataset):
         #plt.savefig(save_prefix + 'example_{}.png'.format(i))
         plt.show()
 
+def generate_chunk(args):
+    '''
+    Pool task of GenerateSynth.generate_dataset: seeds the RNGs and generates one chunk
+        - With an out_path, the chunk is written to the memory-mapped output and not sent back
+    '''
+    gen, class_num, start, n, seed, out_path, per_sample = args
+    if seed is not None:
+        np.random.seed(seed)
+        random.seed(seed)
+    if per_sample:
+        Xc, gt = GenerateSynth.generate_batch(gen, class_num, n) # Loop over generate_seq, ignoring overrides
+    else:
+        Xc, gt = gen.generate_batch(class_num, n)
+    if out_path is not None:
+        X = np.load(out_path, mmap_mode = 'r+')
+        X[start:(start + n),:,:] = Xc
+        X.flush()
+        del X
+        return None, gt
+    return Xc, gt
+
 class GenerateSynth:
 
     def __init__(self, T, D, n_classes):
@@ -99,46 +127,94 @@ class GenerateSynth:
     def generate_seq(self, class_num):
         raise NotImplementedError('Must implement generate seq')
 
-    def generate_dataset(self, N = 1000):
+    def generate_batch(self, class_num, n):
+        '''
+        Generates n samples of class class_num
+        Returns X (n, T, D) and a list of n ground-truth coordinate lists (same as n calls to generate_seq)
+            - Default loops over generate_seq, subclasses override this with vectorized versions
+        '''
+        X = np.zeros((n, self.T, self.D))
+        gt_exps = []
+        for k in range(n):
+            X[k,:,:], locs = self.generate_seq(class_num = class_num)
+            gt_exps.append(locs)
+        return X, gt_exps
+
+    def generate_dataset(self, N = 1000, seed = None, n_workers = 1, chunk_size = 1000, out_path = None, per_sample = False):
+        '''
+        seed: if given, each chunk of samples gets its own seed spawned from it, so results do not depend on n_workers
+            (None with n_workers = 1 uses the global RNG state)
+        per_sample: generate with one generate_seq call per sample even if the subclass overrides generate_batch
+            - Vectorized generate_batch overrides (e.g. FreqShapes) draw random numbers in a different order, so only
+                per_sample = True, seed = None, n_workers = 1 reproduces datasets made with the old per-sample loop
+                under the same global seed
+        n_workers: size of the process pool, chunks of at most chunk_size samples (one class each) are spread over it
+        out_path: .npy file X is written to as a memory map (workers write their chunks directly), else X is in memory
+        '''
 
         # Get even number of samples for each class:
         # 3 classes: null class, class 1, class 2
         class_count = [(N // self.n_classes)] * (self.n_classes - 1)
         class_count.append(N - sum(class_count))
 
-        gt_exps = []
-        X = np.zeros((N, self.T, self.D))
-        times = np.zeros((N, self.T))
-        y = np.zeros(N)
+        # Chunks (class_num, first sample, n), samples are ordered by class as before:
+        tasks = []
         total_count = 0
-
         for i, n in enumerate(class_count):
-            for _ in range(n):
-                # n_spikes increases with count (add 1 because zero index)
-                Xi, locs = self.generate_seq(class_num = i)
-                X[total_count,:,:] = Xi
-                times[total_count,:] = np.arange(1,self.T+1) # Steadily increasing times
-                y[total_count] = i # Needs to be zero-indexed
-                gt_exps.append(locs)
-                total_count += 1
+            for s in range(0, n, chunk_size):
+                tasks.append((i, total_count + s, min(chunk_size, n - s)))
+            total_count += n
+
+        if (seed is None) and (n_workers > 1):
+            seed = np.random.randint(2 ** 31) # Still controlled by the global seed
+        if seed is None:
+            seeds = [None] * len(tasks)
+        else:
+            seeds = [int(ss.generate_state(1)[0]) for ss in np.random.SeedSequence(seed).spawn(len(tasks))]
+
+        if out_path is None:
+            X = np.zeros((N, self.T, self.D))
+        else:
+            X = np.lib.format.open_memmap(out_path, mode = 'w+', dtype = np.float64, shape = (N, self.T, self.D))
+            X.flush()
+
+        args = [(self, i, start, n, task_seed, out_path, per_sample) for (i, start, n), task_seed in zip(tasks, seeds)]
+        if n_workers > 1:
+            with mp.get_context('spawn').Pool(n_workers) as pool:
+                results = pool.map(generate_chunk, args)
+        else:
+            results = map(generate_chunk, args)
+
+        gt_exps = [None] * N
+        for (i, start, n), (Xc, gt) in zip(tasks, results):
+            if Xc is not None:
+                X[start:(start + n),:,:] = Xc
+            gt_exps[start:(start + n)] = gt
+        if out_path is not None:
+            X = np.load(out_path, mmap_mode = 'r+') # Reopen to see the workers' writes
+
+        times = np.tile(np.arange(1, self.T + 1), (N, 1)).astype(float) # Steadily increasing times
+        y = np.repeat(np.arange(self.n_classes), class_count).astype(float) # Needs to be zero-indexed
 
         return X, times, y, gt_exps
 
-    def get_all_loaders(self, Ntrain = 1000, Nval = 100, Ntest = 300):
+    def get_all_loaders(self, Ntrain = 1000, Nval = 100, Ntest = 300, seed = None, n_workers = 1, per_sample = False):
+
+        split_seed = lambda k: None if seed is None else seed + k
 
-        Xtrain, timetrain, ytrain, _ = self.generate_dataset(Ntrain)
+        Xtrain, timetrain, ytrain, _ = self.generate_dataset(Ntrain, seed = split_seed(0), n_workers = n_workers, per_sample = per_sample)
         Xtrain, timetrain, ytrain = self.convert_torch(Xtrain, timetrain, ytrain)
         train_dataset = SynthTrainDataset(Xtrain, timetrain, ytrain)
         #train_loader = torch.utils.data.DataLoader(train_dataset, batch_size = batch_size, shuffle = True)
         print('Train loaded')
 
         # Get validation tuple:
-        Xval, timeval, yval, _ = self.generate_dataset(Nval)
+        Xval, timeval, yval, _ = self.generate_dataset(Nval, seed = split_seed(1), n_workers = n_workers, per_sample = per_sample)
         val_tuple = self.convert_torch(Xval, timeval, yval)
         print('Val loaded')
 
         # Get testing tuple:
-        Xtest, timetest, ytest, gt_exps = self.generate_dataset(Ntest)
+        Xtest, timetest, ytest, gt_exps = self.generate_dataset(Ntest, seed = split_seed(2), n_workers = n_workers, per_sample = per_sample)
         test_tuple = self.convert_torch(Xtest, timetest, ytest)
         print('Test loaded')
 
@@ -7,9 +7,10 @@ from txai.utils.predictors.loss_smoother_stats import exp_criterion_eval_smoothe
 from txai.utils.predictors.eval import eval_mv4
 from txai.utils.cl import in_batch_triplet_sampling
 from txai.models.run_model_utils import batch_forwards, batch_forwards_TransformerMVTS
-from txai.utils.cl import basic_negative_sampling
+from txai.utils.cl import basic_negative_sampling, EmbeddingBank
 
 from txai.utils.functional import js_divergence
+from txai.utils.health import monitor_health
 
 default_scheduler_args = {
     'mode': 'max', 
@@ -51,6 +52,11 @@ def train_mv6_consistency(
         simclr_training = False,
         num_negatives_simclr = 64,
         max_batch_size_simclr_negs = None,
+        use_embedding_bank = False,
+        embedding_bank_momentum = None,
+        negative_sampler = None,
+        activation_cache = None,
+        health_monitor = None,
     ):
     '''
     Args:
@@ -59,6 +65,15 @@ def train_mv6_consistency(
         if both label_matching and embedding_matching are true, then sim_criterion must be a list of length 2 
             with [embedding_sim, label_sim] functions
 
+        use_embedding_bank: with simclr_training, gathers negatives from precomputed encoder_main embeddings
+            - embedding_bank_momentum: None for a frozen encoder_main, else momentum of the per-step refresh
+        negative_sampler: optional NegativeSampler used instead of basic_negative_sampling with simclr_training
+            - 'hard' mode uses the embedding bank if it has no embeddings of its own
+        activation_cache: optional ActivationCache over training IDs for outputs of a frozen encoder_main
+            - encoder_main only runs on the first visit of each sample, in eval mode (cached outputs have no dropout)
+        health_monitor: optional HealthMonitor (txai.utils.health) for NaN checks on model outputs
+            - None skips the checks (no per-step host sync), HealthMonitor(on_error = 'exit') matches old behavior
+
     '''
     # TODO: Add weights and biases logging
 
@@ -70,6 +85,15 @@ def train_mv6_consistency(
 
     dataX, dataT, dataY = train_tuple # Unpack training variables
 
+    if simclr_training and use_embedding_bank:
+        bank_batch_size = 64 if max_batch_size_simclr_negs is None else max_batch_size_simclr_negs
+        embedding_bank = EmbeddingBank(model.encoder_main, dataX, dataT, batch_size = bank_batch_size, momentum = embedding_bank_momentum)
+    else:
+        embedding_bank = None
+
+    if (negative_sampler is not None) and (negative_sampler.embeddings is None) and (embedding_bank is not None):
+        negative_sampler.embeddings = embedding_bank.bank
+
     for epoch in range(num_epochs):
         
         model.train()
@@ -83,14 +107,21 @@ def train_mv6_consistency(
             #     src_mask = (X < 1e-7)
             #     out_dict = model(X, times, captum_input = True)
 
-            out_dict = model(X, times, captum_input = True)
+            if activation_cache is not None:
+                with torch.no_grad():
+                    main_outputs = activation_cache.get_or_compute(ids, lambda: model.encode_main(X, times, captum_input = True),
+                        eval_module = model.encoder_main)
+            else:
+                main_outputs = None
+
+            with monitor_health(health_monitor):
+                out_dict = model(X, times, captum_input = True, main_outputs = main_outputs)
             out = out_dict['pred']
             ste_mask = out_dict['ste_mask']
 
-            if out.isnan().sum() > 0:
-                # Exits if nan's are found
-                print('out', out.isnan().sum())
-                exit()
+            if health_monitor is not None:
+                health_monitor.check('out', out)
+                health_monitor.step()
 
             clf_loss = clf_criterion(out, y)
 
@@ -108,23 +139,23 @@ def train_mv6_consistency(
                     org_embeddings, conc_embeddings = out_dict['all_z']
 
                     if simclr_training:
-                        neg_inds = basic_negative_sampling(X, ids, dataX, num_negatives = num_negatives_simclr)
-                        n_inds_flat = neg_inds.flatten()
-                        if max_batch_size_simclr_negs is None:
-                            neg_embeddings = model.encoder_main.embed(dataX[:,n_inds_flat,:], dataT[:,n_inds_flat], captum_input = False)
+                        if negative_sampler is not None:
+                            neg_inds = negative_sampler.sample(ids, anchor_embeddings = org_embeddings)
+                        else:
+                            neg_inds = basic_negative_sampling(X, ids, dataX, num_negatives = num_negatives_simclr)
+                        num_negs = neg_inds.shape[1]
+                        if embedding_bank is not None:
+                            neg_embeddings = embedding_bank.gather(neg_inds)
+                            embedding_bank.refresh(ids, org_embeddings)
                         else:
-                            _, neg_embeddings = batch_forwards_TransformerMVTS(model.encoder_main, dataX[:,n_inds_flat,:], dataT[:,n_inds_flat], batch_size = max_batch_size_simclr_negs)
-
-                        # Reshape to split out number of negatives:
-                        inds = torch.arange(X.shape[0])
-                        #print('is', inds.shape)
-                        #print('ne', neg_embeddings.shape)
-                        inds_rep = torch.repeat_interleave(inds, num_negatives_simclr)
-                        #print(inds_rep)
-                        neg_embeddings = torch.stack([neg_embeddings[(inds_rep==j),:] for j in range(X.shape[0])], dim = 0).transpose(1,2)
-                        # print('neg_emb', neg_embeddings.shape)
-                        # print('c', conc_embeddings.shape)
-                        #neg_embeddings = neg_embeddings.view(org_embeddings.shape[0], -1, num_negatives)
+                            n_inds_flat = neg_inds.flatten()
+                            if max_batch_size_simclr_negs is None:
+                                neg_embeddings = model.encoder_main.embed(dataX[:,n_inds_flat,:], dataT[:,n_inds_flat], captum_input = False)
+                            else:
+                                _, neg_embeddings = batch_forwards_TransformerMVTS(model.encoder_main, dataX[:,n_inds_flat,:], dataT[:,n_inds_flat], batch_size = max_batch_size_simclr_negs)
+
+                            # Reshape to split out number of negatives (neg_inds flattened row-major):
+                            neg_embeddings = neg_embeddings.reshape(X.shape[0], num_negs, -1).transpose(1,2)
 
                         emb_sim_loss = sim_criterion[0](conc_embeddings, org_embeddings, neg_embeddings)
 
@@ -217,6 +248,9 @@ def train_mv6_consistency(
 
         print(f'Epoch: {epoch}: Sparsity = {sparse:.4f} \t Exp Loss = {exp} \t Clf Loss = {clf:.4f} \t CL Loss = {sim_s}')
 
+        if health_monitor is not None:
+            health_monitor.flush() # Report any NaNs accumulated asynchronously
+
         # Eval after every epoch
         # Call evaluation function:
         model.eval()
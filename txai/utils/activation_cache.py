@@ -0,0 +1,104 @@
+import os
+import torch
+import numpy as np
+
+class ActivationCache:
+    '''
+    Per-sample cache of frozen encoder outputs, keyed by the sample index returned by DatasetwInds
+        - Holds a tuple of tensors per sample, e.g. (pred_regular, z_main, z_seq_main) from TimeXModel.encode_main
+        - Entries that are None are passed through as None (not stored)
+        - Sequence-level outputs (T, B, d) are stored batch-first and flipped back on get
+
+    N: number of samples in the training set
+    path: if given, stores outputs in np.memmap files under this directory instead of in memory
+    device: device for in-memory storage and returned tensors (defaults to device of first stored batch)
+
+    NOTE: only valid if the encoder is frozen - outputs are stored as computed on first visit of each sample
+        Pass the encoder as eval_module to get_or_compute: cached outputs are then eval-mode (no dropout), whereas
+        without the cache the encoder sees a fresh dropout draw on every pass while the model is in train mode
+    '''
+    def __init__(self, N, path = None, device = None):
+        self.N = N
+        self.path = path
+        self.device = device
+        self.filled = torch.zeros(N, dtype = torch.bool)
+        self.buffers = None # Allocated on first put, once output shapes are known
+        self.seq_first = None
+
+    def allocate(self, outputs, ids):
+        self.buffers, self.seq_first = [], []
+        if self.device is None:
+            self.device = ids.device
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok = True)
+
+        for i, o in enumerate(outputs):
+            if o is None:
+                self.buffers.append(None)
+                self.seq_first.append(False)
+                continue
+            # Sequence-level outputs come as (T, B, d), store as (N, T, d):
+            seq_first = (len(o.shape) == 3)
+            shape = (self.N,) + (tuple(o.shape[1:]) if not seq_first else (o.shape[0], o.shape[2]))
+            if self.path is not None:
+                buf = np.memmap(os.path.join(self.path, 'out_{}.dat'.format(i)), dtype = np.float32, mode = 'w+', shape = shape)
+            else:
+                buf = torch.empty(shape, dtype = o.dtype, device = self.device)
+            self.buffers.append(buf)
+            self.seq_first.append(seq_first)
+
+    def has(self, ids):
+        return bool(self.filled[ids.cpu()].all())
+
+    @torch.no_grad()
+    def put(self, ids, outputs):
+        if self.buffers is None:
+            self.allocate(outputs, ids)
+
+        ids_cpu = ids.cpu()
+        for buf, seq_first, o in zip(self.buffers, self.seq_first, outputs):
+            if buf is None:
+                continue
+            o = o.detach()
+            if seq_first:
+                o = o.transpose(0, 1)
+            if self.path is not None:
+                buf[ids_cpu.numpy()] = o.float().cpu().numpy()
+            else:
+                buf[ids.to(buf.device)] = o
+
+        self.filled[ids_cpu] = True
+
+    def get(self, ids):
+        outputs = []
+        for buf, seq_first in zip(self.buffers, self.seq_first):
+            if buf is None:
+                outputs.append(None)
+                continue
+            if self.path is not None:
+                o = torch.from_numpy(buf[ids.cpu().numpy()]).to(self.device)
+            else:
+                o = buf[ids.to(buf.device)]
+            if seq_first:
+                o = o.transpose(0, 1)
+            outputs.append(o)
+        return tuple(outputs)
+
+    def get_or_compute(self, ids, compute_fn, eval_module = None):
+        '''
+        Returns cached outputs for ids, or calls compute_fn() (outputs for the whole batch) and stores them
+            - eval_module: module put in eval mode while compute_fn runs (restored afterwards), s.t. cached
+                outputs don't freeze one dropout draw that would be reused every epoch
+        '''
+        if (self.buffers is not None) and self.has(ids):
+            return self.get(ids)
+        was_training = (eval_module is not None) and eval_module.training
+        if was_training:
+            eval_module.eval()
+        try:
+            outputs = compute_fn()
+        finally:
+            if was_training:
+                eval_module.train()
+        self.put(ids, outputs)
+        return outputs
@@ -11,6 +11,8 @@ def run_FIT(
         time,
         FIT_obj, # FIT object with trained generator
         y = None,
+        batched = True, # Uses FITExplainer.attribute_batched, returns a torch tensor
+        max_batch_size = None,
     ):
 
     if y is None:
@@ -18,7 +20,10 @@ def run_FIT(
         with torch.no_grad():
             y = model(X, time)
 
-    score = FIT_obj.attribute(x = X, y = y, times = time)
+    if batched:
+        score = FIT_obj.attribute_batched(x = X, y = y, times = time, max_batch_size = max_batch_size)
+    else:
+        score = FIT_obj.attribute(x = X, y = y, times = time)
 
     return score
 
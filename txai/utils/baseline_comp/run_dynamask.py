@@ -6,6 +6,7 @@ from tqdm import tqdm
 # sys.path.append(os.path.join(os.path.dirname(__file__), '../../baselines/Dynamask/attribution'))
 
 from txai.baselines.Dynamask.attribution.mask import Mask
+from txai.baselines.Dynamask.attribution.mask_batch import BatchMask
 from txai.baselines.Dynamask.attribution.perturbation import GaussianBlur
 from txai.baselines.Dynamask.utils.losses import cross_entropy
 
@@ -67,41 +68,112 @@ def run_dynamask(
     # Extract mask tensor from model:
     return mask.mask_tensor
 
+def run_dynamask_batch(
+        model,
+        X,
+        time_input,
+        n_epoch=50,
+        keep_ratio = 0.01,
+        initial_mask_coeff = 0.5,
+        size_reg_factor_init = 0.001,
+        size_reg_factor_dilation = 100_000,
+        time_reg_factor = 0,
+        learning_rate = 1.0e-1,
+        momentum = 0.9,
+        y = None,
+        device = None,
+        blur_truncate = None,):
+    '''
+    Batched version of run_dynamask, fits one mask per sample in a single optimization
+        X: (T, B, d) input tensor
+        time_input: (T, B) times
+        y (target): (B,) labels, defaults to model predictions as in run_dynamask
+        keep_ratio, size_reg_factor_init, time_reg_factor: float or (B,) tensor of per-sample values
+        blur_truncate: if given, Gaussian blur only uses time steps within blur_truncate * sigma_max (for long T)
+
+    Output: (T, B, d) masks, equal to run_dynamask on each sample up to numerical tolerance (see tests/test_dynamask.py)
+    '''
+
+    pert = GaussianBlur(device, truncate = blur_truncate)
+    mask = BatchMask(pert, device)
+
+    CE = torch.nn.CrossEntropyLoss(reduction = 'none') # One error per sample
+
+    mask.fit(X.transpose(0, 1), time_input, model, loss_function = CE,
+        target = y,
+        n_epoch=n_epoch,
+        keep_ratio = keep_ratio,
+        initial_mask_coeff = initial_mask_coeff,
+        size_reg_factor_init = size_reg_factor_init,
+        size_reg_factor_dilation = size_reg_factor_dilation,
+        time_reg_factor = time_reg_factor,
+        learning_rate = learning_rate,
+        momentum = momentum
+        )
+
+    return mask.mask_tensor.transpose(0, 1)
 
 def screen_dynamask(
         model,
         test_tuples, 
         only_correct = True,
         device = None,
-        dynamask_config = default_config):
+        dynamask_config = default_config,
+        batch_size = None):
     '''
     Screens over an entire test set to produce explanations for Dynamask Explainer
 
     - Assumes all input tensors are on same device
+    - Masks are fit towards the given labels y
 
     test_tuples: list of tuples
         - [(X_0, time_0, y_0), ..., (X_N, time_N, y_N)]
+    only_correct: if True, samples the model misclassifies are skipped (None in the output list)
+    batch_size: if given, fits masks for this many samples at once with run_dynamask_batch
+        - All samples must have the same shape
     '''
 
     out_masks = []
 
     model.eval()
+
+    if batch_size is not None:
+        for i in range(0, len(test_tuples), batch_size):
+            batch = test_tuples[i:(i + batch_size)]
+            X = torch.stack([b[0] for b in batch], dim = 1) # (T, B, d)
+            time = torch.cat([b[1] for b in batch], dim = 1) # (T, B)
+            y = torch.cat([b[2].reshape(-1) for b in batch]) # (B,)
+
+            keep = torch.ones_like(y, dtype = torch.bool)
+            if only_correct:
+                with torch.no_grad():
+                    keep = (model(X, time).argmax(dim=1) == y)
+            inds = keep.nonzero(as_tuple = True)[0]
+
+            batch_masks = [None] * len(batch)
+            if inds.shape[0] > 0:
+                masks = run_dynamask_batch(model = model, X = X[:,inds,:], time_input = time[:,inds], y = y[inds],
+                    **dynamask_config, device = device)
+                for j, m in zip(inds.tolist(), masks.unbind(dim = 1)):
+                    batch_masks[j] = m
+            out_masks += batch_masks
+        return out_masks
+
     for X, time, y in test_tuples:
 
         time.requires_grad_ = False
-    
-        #with torch.no_grad():
-        #     out = model(X, time)
+        y = y.reshape(-1)
 
-        #if (out.softmax(dim=1).argmax(dim=1) == y) or (not only_correct):
+        if only_correct:
+            with torch.no_grad():
+                out = model(X, time)
+            if (out.argmax(dim=1) != y).any():
+                out_masks.append(None)
+                continue
 
-            # Assumes no transformation of shapes, etc.
-        mask = run_dynamask(model = model, X = X, time_input = time, **default_config, device = device)
+        # Assumes no transformation of shapes, etc.
+        mask = run_dynamask(model = model, X = X, time_input = time, y = y, **dynamask_config, device = device)
 
         out_masks.append(mask)
 
     return out_masks
-
-
-
-    
\ No newline at end of file
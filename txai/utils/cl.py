@@ -2,6 +2,8 @@ import torch
 import numpy as np
 import torch.nn.functional as F
 
+from txai.models.run_model_utils import batch_forwards_TransformerMVTS
+
 def basic_negative_sampling(batch, batch_ids, dataX, num_negatives):
     '''
     batch: (B, T, d)
@@ -13,19 +15,158 @@ def basic_negative_sampling(batch, batch_ids, dataX, num_negatives):
     '''
 
     mask = torch.randn(batch.shape[0], dataX.shape[1]) # Size (B, Nx)
-    inds = torch.empty(batch.shape[0], num_negatives).long()
-    for i, bid in enumerate(batch_ids):
-        mask[i, bid] = -1e9 # Effectively ignoring
-        inds[i,:] = mask[i,:].topk(k=num_negatives)[1] # Get indices
-
-    # # randn, get top-k
+    mask[torch.arange(batch.shape[0]), batch_ids.cpu()] = -1e9 # Effectively ignoring anchors
+    inds = mask.topk(k=num_negatives, dim=1)[1] # Get indices, one call for all rows
 
-    # #possible = mask.nonzero(as_tuple=True)[0].numpy()
-    # inds = torch.from_numpy(np.random.choice(possible, size = (num_negatives,)))
+    return inds
 
-    # mask = torch.zeros(dataX.shape[1]).bool(); mask[inds] = 1
+def exclude_anchor_offset(r, anchor_pos):
+    '''
+    Maps draws r in [0, n-1) to [0, n) skipping anchor_pos (broadcast against r)
+        - Keeps the draws uniform over all positions except the anchor
+    '''
+    return r + (r >= anchor_pos).long()
 
-    return inds
+class NegativeSampler:
+    '''
+    Batched negative sampler over a training set of size N, returns (B, num_negatives) index tensors
+        - Draws are with replacement and cost O(B * num_negatives), no (B, N) buffer, so N can be in the millions
+        - Anchor IDs are always excluded
+
+    mode:
+        'uniform': uniform over all training IDs
+        'stratified': negatives split evenly over classes, remainder to random classes (requires labels)
+        'hard': num_negatives most similar candidates out of a uniform pool of size hard_pool_size
+            (requires embeddings, e.g. EmbeddingBank.bank)
+    '''
+    def __init__(self, N, num_negatives, mode = 'uniform', labels = None, embeddings = None, hard_pool_size = 1024, device = None):
+        if N < 2:
+            raise ValueError('negative sampling requires at least 2 training samples, got {}'.format(N))
+        self.N = N
+        self.num_negatives = num_negatives
+        self.mode = mode
+        self.embeddings = embeddings
+        self.hard_pool_size = hard_pool_size
+        self.device = device
+
+        if self.mode == 'stratified':
+            if labels is None:
+                raise ValueError('stratified negative sampling requires labels')
+            labels = labels.to(device)
+            # IDs sorted by class, with class offsets and position of each ID within its class:
+            self.sorted_ids = torch.argsort(labels, stable = True)
+            self.classes, self.class_counts = torch.unique(labels, return_counts = True)
+            self.class_offsets = torch.cumsum(self.class_counts, dim = 0) - self.class_counts
+            self.pos_in_sorted = torch.empty_like(self.sorted_ids)
+            self.pos_in_sorted[self.sorted_ids] = torch.arange(N, device = self.sorted_ids.device)
+            self.labels = labels
+        elif self.mode not in ('uniform', 'hard'):
+            raise ValueError('Unknown negative sampling mode {}'.format(self.mode))
+
+    def uniform(self, batch_ids, n):
+        r = torch.randint(0, self.N - 1, (batch_ids.shape[0], n), device = batch_ids.device)
+        return exclude_anchor_offset(r, batch_ids.unsqueeze(1))
+
+    def stratified(self, batch_ids):
+        batch_ids = batch_ids.to(self.labels.device)
+        B = batch_ids.shape[0]
+        n_classes = self.classes.shape[0]
+        anchor_sorted = self.pos_in_sorted[batch_ids].unsqueeze(1)
+        anchor_labels = self.labels[batch_ids].unsqueeze(1)
+
+        # Remainder negatives go to a random subset of classes, redrawn each call:
+        n_per_class = [self.num_negatives // n_classes] * n_classes
+        for c in torch.randperm(n_classes)[:(self.num_negatives % n_classes)].tolist():
+            n_per_class[c] += 1
+
+        inds = []
+        for c in range(n_classes): # Loop over classes only, each one a single batched draw
+            n_c = n_per_class[c]
+            if n_c == 0:
+                continue
+            count, offset = self.class_counts[c], self.class_offsets[c]
+            same_class = (anchor_labels == self.classes[c])
+            # Anchor's own class has one fewer candidate:
+            high = (count - same_class.long()).clamp(min = 1)
+            r = (torch.rand(B, n_c, device = batch_ids.device) * high).long()
+            r = torch.where(same_class, exclude_anchor_offset(r, anchor_sorted - offset), r)
+            inds_c = self.sorted_ids[(r + offset).clamp(max = self.N - 1)]
+            # Anchor is the only member of its class: these draws go uniformly to the other classes
+            no_candidates = same_class & (count == 1)
+            if no_candidates.any():
+                inds_c = torch.where(no_candidates, self.uniform(batch_ids, n_c), inds_c)
+            inds.append(inds_c)
+
+        return torch.cat(inds, dim = 1)
+
+    @torch.no_grad()
+    def hard(self, batch_ids, anchor_embeddings):
+        if self.embeddings is None:
+            raise ValueError('hard negative sampling requires embeddings')
+        pool = self.uniform(batch_ids, self.hard_pool_size) # Size (B, P)
+        z_pool = F.normalize(self.embeddings[pool], dim = -1) # Size (B, P, d_z)
+        z_anchor = F.normalize(anchor_embeddings.detach(), dim = -1).unsqueeze(-1) # Size (B, d_z, 1)
+        sims = torch.bmm(z_pool, z_anchor).squeeze(-1)
+        return pool.gather(1, sims.topk(k = self.num_negatives, dim = 1)[1])
+
+    def sample(self, batch_ids, anchor_embeddings = None):
+        '''
+        batch_ids: (B,) training IDs of anchors
+        anchor_embeddings: (B, d_z), only used in 'hard' mode (defaults to embeddings[batch_ids])
+
+        output: (B, num_negatives) - gives ints
+        '''
+        if self.device is not None:
+            batch_ids = batch_ids.to(self.device)
+
+        if self.mode == 'uniform':
+            return self.uniform(batch_ids, self.num_negatives)
+        elif self.mode == 'stratified':
+            return self.stratified(batch_ids)
+        else:
+            if anchor_embeddings is None:
+                anchor_embeddings = self.embeddings[batch_ids]
+            return self.hard(batch_ids, anchor_embeddings.to(self.embeddings.device))
+
+class EmbeddingBank:
+    '''
+    Device-resident bank of encoder embeddings for every training sample, indexed by training ID
+        - Precomputed once from the encoder, so negatives are a gather instead of a forward pass
+        - momentum = None keeps the bank fixed (frozen encoder), otherwise refresh() blends in new embeddings
+    '''
+    @torch.no_grad()
+    def __init__(self, encoder, dataX, dataT, batch_size = 64, momentum = None):
+        '''
+        encoder: TransformerMVTS
+        dataX: (T, Nx, d)
+        dataT: (T, Nx)
+        '''
+        self.momentum = momentum
+        was_training = encoder.training
+        encoder.eval()
+        _, self.bank = batch_forwards_TransformerMVTS(encoder, dataX, dataT, batch_size = batch_size) # Size (Nx, d_z)
+        encoder.train(was_training)
+
+    def __len__(self):
+        return self.bank.shape[0]
+
+    def gather(self, inds):
+        '''
+        inds: (B, num_negatives) - output of basic_negative_sampling
+
+        output: (B, d_z, num_negatives) - layout expected by SimCLRLoss
+        '''
+        return self.bank[inds.to(self.bank.device)].transpose(1, 2)
+
+    @torch.no_grad()
+    def refresh(self, ids, z):
+        '''
+        Momentum update of bank entries for ids with fresh embeddings z (B, d_z)
+        '''
+        if self.momentum is None:
+            return
+        ids = ids.to(self.bank.device)
+        self.bank[ids] = self.momentum * self.bank[ids] + (1 - self.momentum) * z.detach()
 
 
 @torch.no_grad() # No grad so gradients aren't carried into similarity computations on batch
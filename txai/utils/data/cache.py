@@ -0,0 +1,104 @@
+'''
+Versioned, memory-mapped cache of preprocessed dataset splits
+    - One directory per (dataset, loader arguments), under v<CACHE_VERSION>/
+    - Each split is stored as contiguous .npy arrays: X float32 (T, N, d), times float32 (T, N), y int64 (N,),
+        idx int64 (N,) (indices into the raw dataset)
+    - Extra arrays (normalization stats, ground-truth explanations, ...) are stored alongside as <name>.npy
+    - meta.json records shapes, loader arguments and size/mtime of the source files; a cache is rebuilt if they change
+    - Arrays are opened with np.load(mmap_mode = 'c'), so opening a cache is O(1) and data is only paged in when used
+
+Usage (inside a loader):
+    path = cache_path(cache_dir, 'pam', split_no = 1)
+    cached = load_split_cache(path, sources = [...])
+    if cached is None:
+        ... preprocess ...
+        save_split_cache(path, {'train': (X, times, y, idx), ...}, extras = {'mf': mf}, sources = [...])
+'''
+
+import os, json, shutil
+import torch
+import numpy as np
+
+CACHE_VERSION = 1
+
+split_names = ('train', 'val', 'test')
+split_fields = ('X', 'times', 'y', 'idx')
+field_dtypes = {'X': np.float32, 'times': np.float32, 'y': np.int64, 'idx': np.int64}
+
+def cache_path(cache_dir, name, **kwargs):
+    '''
+    Directory for dataset name and loader arguments kwargs, e.g. <cache_dir>/v1/pam_gethalf=False_split_no=1
+    '''
+    key = '_'.join([name] + ['{}={}'.format(k, kwargs[k]) for k in sorted(kwargs.keys())])
+    return os.path.join(cache_dir, 'v{}'.format(CACHE_VERSION), key)
+
+def source_signature(sources):
+    # Size and mtime of each source file, None if missing
+    sig = {}
+    for s in sources:
+        if os.path.exists(s):
+            st = os.stat(s)
+            sig[s] = [st.st_size, int(st.st_mtime)]
+        else:
+            sig[s] = None
+    return sig
+
+def to_numpy(x, dtype):
+    if torch.is_tensor(x):
+        x = x.detach().cpu().numpy()
+    return np.ascontiguousarray(np.asarray(x), dtype = dtype)
+
+def save_split_cache(path, splits, extras = None, sources = (), args = None):
+    '''
+    splits: dict split name -> (X, times, y, idx), tensors or arrays
+    extras: dict name -> array (float32 unless integer)
+    Written to a temporary directory first, then moved in place
+    '''
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    meta = {'version': CACHE_VERSION, 'args': args, 'sources': source_signature(sources), 'splits': {}, 'extras': {}}
+
+    for split, arrays in splits.items():
+        meta['splits'][split] = {}
+        for field, a in zip(split_fields, arrays):
+            a = to_numpy(a, field_dtypes[field])
+            np.save(os.path.join(tmp_path, '{}_{}.npy'.format(split, field)), a)
+            meta['splits'][split][field] = list(a.shape)
+
+    for name, a in ({} if extras is None else extras).items():
+        a = np.asarray(a.detach().cpu().numpy() if torch.is_tensor(a) else a)
+        a = np.ascontiguousarray(a, dtype = np.int64 if np.issubdtype(a.dtype, np.integer) else np.float32)
+        np.save(os.path.join(tmp_path, '{}.npy'.format(name)), a)
+        meta['extras'][name] = list(a.shape)
+
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+def load_split_cache(path, sources = ()):
+    '''
+    Returns (splits, extras) with torch tensors backed by memory maps, or None if no valid cache exists
+        - splits: dict split name -> (X, times, y, idx)
+    '''
+    meta_file = os.path.join(path, 'meta.json')
+    if not os.path.exists(meta_file):
+        return None
+    with open(meta_file) as f:
+        meta = json.load(f)
+    if (meta['version'] != CACHE_VERSION) or (meta['sources'] != source_signature(sources)):
+        return None
+
+    def open_array(fname):
+        # Copy-on-write map: tensors are writable without touching the file
+        return torch.from_numpy(np.load(os.path.join(path, fname), mmap_mode = 'c'))
+
+    splits = {split: tuple(open_array('{}_{}.npy'.format(split, field)) for field in split_fields)
+        for split in meta['splits'].keys()}
+    extras = {name: open_array('{}.npy'.format(name)) for name in meta['extras'].keys()}
+    return splits, extras
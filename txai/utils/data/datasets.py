@@ -1,5 +1,7 @@
 import torch
 
+from txai.utils.functional import index_batch
+
 class DatasetwInds(torch.utils.data.Dataset):
     def __init__(self, X, times, y):
         self.X = X
@@ -8,9 +10,63 @@ class DatasetwInds(torch.utils.data.Dataset):
 
     def __len__(self):
         return self.X.shape[1]
-    
+
     def __getitem__(self, idx):
+        if torch.is_tensor(idx) and idx.dim() > 0: # Batch of indices, e.g. from IndexBatchSampler
+            return self.get_batch(idx)
         x = self.X[:,idx,:]
         T = self.times[:,idx]
         y = self.y[idx]
-        return x, T, y, torch.tensor(idx).long().to(x.device)
\ No newline at end of file
+        return x, T, y, torch.tensor(idx).long().to(x.device)
+
+    def get_batch(self, idx):
+        idx = idx.long().to(self.X.device)
+        return index_batch(self.X, self.times, self.y, idx) + (idx,)
+
+class IndexBatchSampler(torch.utils.data.Sampler):
+    '''
+    Yields batches of indices as one LongTensor each (instead of lists of ints)
+        - device: where indices (and the shuffling permutation) live, should match the dataset storage
+        - generator: optional torch.Generator on the same device
+    '''
+    def __init__(self, n, batch_size, shuffle = False, drop_last = False, device = None, generator = None):
+        self.n = n
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.device = device
+        self.generator = generator
+
+    def __iter__(self):
+        if self.shuffle:
+            order = torch.randperm(self.n, device = self.device, generator = self.generator)
+        else:
+            order = torch.arange(self.n, device = self.device)
+        for batch in torch.split(order, self.batch_size):
+            if self.drop_last and batch.shape[0] < self.batch_size:
+                break
+            yield batch
+
+    def __len__(self):
+        if self.drop_last:
+            return self.n // self.batch_size
+        return (self.n + self.batch_size - 1) // self.batch_size
+
+class BatchLoader:
+    '''
+    Drop-in for torch.utils.data.DataLoader over in-memory datasets with a get_batch(idx) method
+    (DatasetwInds, SynthTrainDataset): one index_select per batch, no per-sample collation
+        - Iterating gives the same batch-first tuples as DataLoader(dataset, batch_size, shuffle)
+    '''
+    def __init__(self, dataset, batch_size = 1, shuffle = False, drop_last = False, generator = None):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.sampler = IndexBatchSampler(len(dataset), batch_size, shuffle = shuffle, drop_last = drop_last,
+            device = dataset.X.device, generator = generator)
+
+    def __iter__(self):
+        for idx in self.sampler:
+            yield self.dataset.get_batch(idx)
+
+    def __len__(self):
+        return len(self.sampler)
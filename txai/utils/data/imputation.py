@@ -0,0 +1,122 @@
+'''
+Vectorized imputation of irregularly sampled clinical series (P12/P19), replaces the per-sample/per-feature loops
+    - X_features: (N, T, F) features, X_time: (N, T) or (N, T, 1) times, missing entries equal missing_value_num
+    - Only the first time_length[i] steps of each sample are imputed (see series_lengths)
+    - forward_imputation: last observation carried forward via a cumulative max of observed indices
+    - mean_imputation: one masked assignment for the whole array
+    - cubic_spline_imputation: features sharing the same observation times are fit as one multi-column CubicSpline,
+        samples can be split into chunks over a process pool (opt-in through n_workers)
+All functions fill X_features in place and return it, like the originals in utils_phy12.py.
+'''
+
+import os
+import numpy as np
+import multiprocessing as mp
+
+def series_lengths(X_time, missing_value_num):
+    '''
+    Number of valid time steps per sample: index of the first missing time stamp, ignoring t = 0 at the first step
+    (the first measurement can be at time 0), T if no time stamp is missing
+    '''
+    N, T = X_time.shape[0], X_time.shape[1]
+    missing = (np.asarray(X_time).reshape(N, T, -1)[:,:,0] == missing_value_num)
+    missing[:,0] = False
+    return np.where(missing.any(axis = 1), missing.argmax(axis = 1), T)
+
+def valid_steps(X_time, missing_value_num):
+    # (N, T) mask of time steps inside each series
+    T = X_time.shape[1]
+    return np.arange(T)[None,:] < series_lengths(X_time, missing_value_num)[:,None]
+
+def mean_imputation(X_features, X_time, mean_features, missing_value_num):
+    valid = valid_steps(X_time, missing_value_num)
+
+    # check for inconsistency
+    n_inconsistent = int(np.any(X_features * ~valid[:,:,None], axis = (1, 2)).sum())
+    if n_inconsistent > 0:
+        print('Inconsistency between X_features and X_time: features are measured without time stamp ({} samples).'.format(n_inconsistent))
+
+    fill = (X_features == missing_value_num) & valid[:,:,None]
+    X_features[fill] = np.broadcast_to(np.asarray(mean_features, dtype = X_features.dtype), X_features.shape)[fill]
+    return X_features
+
+def forward_imputation(X_features, X_time, missing_value_num):
+    N, T, F = X_features.shape
+    valid = valid_steps(X_time, missing_value_num)[:,:,None]
+    observed = (X_features != missing_value_num) & valid
+
+    # Index of the last observation at or before each step, -1 before the first one:
+    last_obs = np.where(observed, np.arange(T)[None,:,None], -1)
+    np.maximum.accumulate(last_obs, axis = 1, out = last_obs)
+
+    fill = ~observed & valid & (last_obs >= 0)
+    X_features[fill] = np.take_along_axis(X_features, np.maximum(last_obs, 0), axis = 1)[fill]
+    return X_features
+
+def spline_impute_sample(features, times, length, missing_value_num):
+    '''
+    Cubic spline imputation of one sample, features (T, F) filled in place
+        - Features are grouped by observation pattern, each group is one CubicSpline with (n_obs, n_features) values
+    '''
+    from scipy.interpolate import CubicSpline
+
+    valid_ts = features[:length]
+    t = times[:length]
+    observed = (valid_ts != 0) # Same as np.nonzero in the original loop
+    n_obs = observed.sum(axis = 0)
+
+    cols = np.where(n_obs > 1)[0] # we need at least 2 observations to fit cubic spline
+    if cols.size == 0:
+        return features
+    patterns, group = np.unique(observed[:,cols].T, axis = 0, return_inverse = True)
+    group = group.reshape(-1)
+
+    for g, pattern in enumerate(patterns):
+        gcols = cols[group == g]
+        obs_idx = np.where(pattern)[0]
+        cs = CubicSpline(t[obs_idx], valid_ts[obs_idx][:,gcols], axis = 0)
+        interp = cs(t)
+
+        block = valid_ts[:,gcols]
+        missing = (block == missing_value_num)
+        block[missing] = interp[missing]
+
+        # set values before first measurement / after last measurement to the value of first / last measurement
+        first_obs_index, last_obs_index = obs_idx[0], obs_idx[-1]
+        block[:first_obs_index] = block[first_obs_index]
+        block[last_obs_index:] = block[last_obs_index]
+        valid_ts[:,gcols] = block
+
+    return features
+
+def spline_impute_chunk(args):
+    features, times, lengths, missing_value_num = args
+    for i in range(features.shape[0]):
+        spline_impute_sample(features[i], times[i], lengths[i], missing_value_num)
+    return features
+
+def cubic_spline_imputation(X_features, X_time, missing_value_num, n_workers = 1, chunk_size = 256):
+    '''
+    n_workers: size of the process pool, 1 runs in this process, None uses all CPUs
+        - The pool uses spawn: calling scripts need an if __name__ == '__main__' guard
+    chunk_size: samples per pool task
+    '''
+    N, T, F = X_features.shape
+    lengths = series_lengths(X_time, missing_value_num)
+    times = np.asarray(X_time).reshape(N, T, -1)[:,:,0]
+
+    chunks = [(np.array(X_features[s:s + chunk_size]), times[s:s + chunk_size], lengths[s:s + chunk_size], missing_value_num)
+        for s in range(0, N, chunk_size)]
+
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+    n_workers = min(n_workers, len(chunks))
+    if n_workers > 1:
+        with mp.get_context('spawn').Pool(n_workers) as pool:
+            results = pool.map(spline_impute_chunk, chunks)
+    else:
+        results = map(spline_impute_chunk, chunks)
+
+    for s, imputed in zip(range(0, N, chunk_size), results):
+        X_features[s:s + chunk_size] = imputed
+
+    return X_features
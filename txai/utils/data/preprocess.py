@@ -4,6 +4,7 @@ import numpy as np
 import pandas as pd
 import sys, os
 from .utils_phy12 import *
+from .cache import cache_path, load_split_cache, save_split_cache, split_names
 
 base_path = '/home/owq978/TimeSeriesXAI/PAMdata/PAMAP2data/'
 
@@ -53,52 +54,69 @@ class RWDataset(torch.utils.data.Dataset):
         return x, time, y 
 
 
-def process_PAM(split_no = 1, device = None, base_path = base_path, gethalf = False):
+def process_PAM(split_no = 1, device = None, base_path = base_path, gethalf = False, cache_dir = None):
+    '''
+    cache_dir: if given, preprocessed splits are stored there once (see txai.utils.data.cache) and memory-mapped afterwards
+        - gethalf is applied after loading, so both settings share a cache
+    '''
     split_path = 'splits/PAMAP2_split_{}.npy'.format(split_no)
-    idx_train, idx_val, idx_test = np.load(os.path.join(base_path, split_path), allow_pickle=True)
+    sources = [os.path.join(base_path, split_path), base_path + '/processed_data/PTdict_list.npy', 
+        base_path + '/processed_data/arr_outcomes.npy']
 
-    Pdict_list = np.load(base_path + '/processed_data/PTdict_list.npy', allow_pickle=True)
-    arr_outcomes = np.load(base_path + '/processed_data/arr_outcomes.npy', allow_pickle=True)
+    cached = None
+    if cache_dir is not None:
+        path = cache_path(cache_dir, 'pam', split_no = split_no)
+        cached = load_split_cache(path, sources = sources)
 
-    Ptrain = Pdict_list[idx_train]
-    Pval = Pdict_list[idx_val]
-    Ptest = Pdict_list[idx_test]
+    if cached is not None:
+        splits, _ = cached
+    else:
+        idx_train, idx_val, idx_test = np.load(os.path.join(base_path, split_path), allow_pickle=True)
 
-    y = arr_outcomes[:, -1].reshape((-1, 1))
+        Pdict_list = np.load(base_path + '/processed_data/PTdict_list.npy', allow_pickle=True)
+        arr_outcomes = np.load(base_path + '/processed_data/arr_outcomes.npy', allow_pickle=True)
 
-    ytrain = y[idx_train]
-    yval = y[idx_val]
-    ytest = y[idx_test]
+        Ptrain = Pdict_list[idx_train]
+        Pval = Pdict_list[idx_val]
+        Ptest = Pdict_list[idx_test]
 
-    #return Ptrain, Pval, Ptest, ytrain, yval, ytest
+        y = arr_outcomes[:, -1].reshape((-1, 1))
 
-    T, F = Ptrain[0].shape
-    D = 1
+        ytrain = y[idx_train]
+        yval = y[idx_val]
+        ytest = y[idx_test]
 
-    Ptrain_tensor = Ptrain
-    Ptrain_static_tensor = np.zeros((len(Ptrain), D))
+        #return Ptrain, Pval, Ptest, ytrain, yval, ytest
 
-    mf, stdf = getStats(Ptrain)
-    Ptrain_tensor, Ptrain_static_tensor, Ptrain_time_tensor, ytrain_tensor = tensorize_normalize_other(Ptrain, ytrain, mf, stdf)
-    Pval_tensor, Pval_static_tensor, Pval_time_tensor, yval_tensor = tensorize_normalize_other(Pval, yval, mf, stdf)
-    Ptest_tensor, Ptest_static_tensor, Ptest_time_tensor, ytest_tensor = tensorize_normalize_other(Ptest, ytest, mf, stdf)
+        mf, stdf = getStats(Ptrain)
+        Ptrain_tensor, Ptrain_static_tensor, Ptrain_time_tensor, ytrain_tensor = tensorize_normalize_other(Ptrain, ytrain, mf, stdf)
+        Pval_tensor, Pval_static_tensor, Pval_time_tensor, yval_tensor = tensorize_normalize_other(Pval, yval, mf, stdf)
+        Ptest_tensor, Ptest_static_tensor, Ptest_time_tensor, ytest_tensor = tensorize_normalize_other(Ptest, ytest, mf, stdf)
 
-    Ptrain_tensor = Ptrain_tensor.permute(1, 0, 2)
-    Pval_tensor = Pval_tensor.permute(1, 0, 2)
-    Ptest_tensor = Ptest_tensor.permute(1, 0, 2)
+        Ptrain_tensor = Ptrain_tensor.permute(1, 0, 2)
+        Pval_tensor = Pval_tensor.permute(1, 0, 2)
+        Ptest_tensor = Ptest_tensor.permute(1, 0, 2)
 
-    if gethalf:
-        Ptrain_tensor = Ptrain_tensor[:,:,:(Ptrain_tensor.shape[-1] // 2)]
-        Pval_tensor = Pval_tensor[:,:,:(Pval_tensor.shape[-1] // 2)]
-        Ptest_tensor = Ptest_tensor[:,:,:(Ptest_tensor.shape[-1] // 2)]
+        Ptrain_time_tensor = Ptrain_time_tensor.squeeze(2).permute(1, 0)
+        Pval_time_tensor = Pval_time_tensor.squeeze(2).permute(1, 0)
+        Ptest_time_tensor = Ptest_time_tensor.squeeze(2).permute(1, 0)
 
-    Ptrain_time_tensor = Ptrain_time_tensor.squeeze(2).permute(1, 0)
-    Pval_time_tensor = Pval_time_tensor.squeeze(2).permute(1, 0)
-    Ptest_time_tensor = Ptest_time_tensor.squeeze(2).permute(1, 0)
+        splits = {
+            'train': (Ptrain_tensor, Ptrain_time_tensor, ytrain_tensor, idx_train),
+            'val': (Pval_tensor, Pval_time_tensor, yval_tensor, idx_val),
+            'test': (Ptest_tensor, Ptest_time_tensor, ytest_tensor, idx_test),
+        }
+        if cache_dir is not None:
+            save_split_cache(path, splits, extras = {'mf': mf, 'stdf': stdf}, sources = sources, args = {'split_no': split_no})
+
+    chunks = []
+    for split in split_names:
+        X, time, y, _ = splits[split]
+        if gethalf:
+            X = X[:,:,:(X.shape[-1] // 2)]
+        chunks.append(PAMchunk(X, None, time, y, device = device)) # No static features: tensorize_normalize_other returns None
 
-    train_chunk = PAMchunk(Ptrain_tensor, Ptrain_static_tensor, Ptrain_time_tensor, ytrain_tensor, device = device)
-    val_chunk = PAMchunk(Pval_tensor, Pval_static_tensor, Pval_time_tensor, yval_tensor, device = device)
-    test_chunk = PAMchunk(Ptest_tensor, Ptest_static_tensor, Ptest_time_tensor, ytest_tensor, device = device)
+    train_chunk, val_chunk, test_chunk = chunks
 
     return train_chunk, val_chunk, test_chunk
 
@@ -229,110 +247,150 @@ def process_ECG(split_no = 1, device = None, base_path = ecg_base_path):
 
 mitecg_base_path = '/n/data1/hms/dbmi/zitnik/lab/users/owq978/TimeSeriesCBM/datasets/MITECG'
 def process_MITECG(split_no = 1, device = None, hard_split = False, normalize = False, exclude_pac_pvc = False, balance_classes = False, div_time = False, 
-        need_binarize = False, base_path = mitecg_base_path):
+        need_binarize = False, base_path = mitecg_base_path, cache_dir = None):
+    '''
+    cache_dir: if given, preprocessed splits are stored there once (see txai.utils.data.cache) and memory-mapped afterwards
+        - One cache per combination of the preprocessing flags
+    '''
 
     split_path = 'split={}.pt'.format(split_no)
-    idx_train, idx_val, idx_test = torch.load(os.path.join(base_path, split_path))
-    if hard_split:
-        X = torch.load(os.path.join(base_path, 'all_data/X.pt'))
-        y = torch.load(os.path.join(base_path, 'all_data/y.pt')).squeeze()
+    sources = [os.path.join(base_path, split_path), os.path.join(base_path, 'all_data.pt'), os.path.join(base_path, 'all_data/X.pt')]
+    args = {'split_no': split_no, 'hard_split': hard_split, 'normalize': normalize, 'exclude_pac_pvc': exclude_pac_pvc, 
+        'balance_classes': balance_classes, 'div_time': div_time, 'need_binarize': need_binarize}
 
-        # Make times on the fly:
-        times = torch.zeros(X.shape[0],X.shape[1])
-        for i in range(X.shape[1]):
-            times[:,i] = torch.arange(360)
+    cached = None
+    if cache_dir is not None:
+        path = cache_path(cache_dir, 'mitecg', **args)
+        cached = load_split_cache(path, sources = sources)
 
-        saliency = torch.load(os.path.join(base_path, 'all_data/saliency.pt'))
-        
+    if cached is not None:
+        splits, extras = cached
     else:
-        X, times, y = torch.load(os.path.join(base_path, 'all_data.pt'))
-
-    Ptrain, time_train, ytrain = X[:,idx_train,:].float(), times[:,idx_train], y[idx_train].long()
-    Pval, time_val, yval = X[:,idx_val,:].float(), times[:,idx_val], y[idx_val].long()
-    Ptest, time_test, ytest = X[:,idx_test,:].float(), times[:,idx_test], y[idx_test].long()
-
-    if normalize:
-
-        # Get mean, std of the whole sample from training data, apply to val, test:
-        mu = Ptrain.mean()
-        std = Ptrain.std()
-        Ptrain = (Ptrain - mu) / std
-        Pval = (Pval - mu) / std
-        Ptest = (Ptest - mu) / std
-
-        # Normalize each sample to between 0,1:
-        # samp_len = Ptrain.shape[0]
-        # batch_mins = Ptrain.min(dim=0)[0].unsqueeze(0).repeat(samp_len, 1, 1)
-        # batch_maxes = Ptrain.max(dim=0)[0].unsqueeze(0).repeat(samp_len, 1, 1)
-        # Ptrain = (Ptrain -  batch_mins) / batch_maxes 
-
-        # batch_mins = Pval.min(dim=0)[0].unsqueeze(0).repeat(samp_len, 1, 1)
-        # batch_maxes = Pval.max(dim=0)[0].unsqueeze(0).repeat(samp_len, 1, 1)
-        # Pval = (Pval -  batch_mins) / batch_maxes 
-
-        # batch_mins = Ptest.min(dim=0)[0].unsqueeze(0).repeat(samp_len, 1, 1)
-        # batch_maxes = Ptest.max(dim=0)[0].unsqueeze(0).repeat(samp_len, 1, 1)
-        # Ptest = (Ptest -  batch_mins) / batch_maxes 
-
-    if div_time:
-        time_train = time_train / 60.0
-        time_val = time_val / 60.0
-        time_test = time_test / 60.0
-
-    if exclude_pac_pvc:
-        train_mask_in = (ytrain < 3)
-        Ptrain = Ptrain[:,train_mask_in,:]
-        time_train = time_train[:,train_mask_in]
-        ytrain = ytrain[train_mask_in]
-
-        val_mask_in = (yval < 3)
-        Pval = Pval[:,val_mask_in,:]
-        time_val = time_val[:,val_mask_in]
-        yval = yval[val_mask_in]
-
-        test_mask_in = (ytest < 3)
-        Ptest = Ptest[:,test_mask_in,:]
-        time_test = time_test[:,test_mask_in]
-        ytest = ytest[test_mask_in]
+        idx_train, idx_val, idx_test = torch.load(os.path.join(base_path, split_path))
+        idx_train, idx_val, idx_test = torch.as_tensor(idx_train), torch.as_tensor(idx_val), torch.as_tensor(idx_test)
+        if hard_split:
+            X = torch.load(os.path.join(base_path, 'all_data/X.pt'))
+            y = torch.load(os.path.join(base_path, 'all_data/y.pt')).squeeze()
+
+            # Make times on the fly:
+            times = torch.zeros(X.shape[0],X.shape[1])
+            for i in range(X.shape[1]):
+                times[:,i] = torch.arange(360)
+
+            saliency = torch.load(os.path.join(base_path, 'all_data/saliency.pt'))
+        
+        else:
+            X, times, y = torch.load(os.path.join(base_path, 'all_data.pt'))
+
+        Ptrain, time_train, ytrain = X[:,idx_train,:].float(), times[:,idx_train], y[idx_train].long()
+        Pval, time_val, yval = X[:,idx_val,:].float(), times[:,idx_val], y[idx_val].long()
+        Ptest, time_test, ytest = X[:,idx_test,:].float(), times[:,idx_test], y[idx_test].long()
+
+        if normalize:
+
+            # Get mean, std of the whole sample from training data, apply to val, test:
+            mu = Ptrain.mean()
+            std = Ptrain.std()
+            Ptrain = (Ptrain - mu) / std
+            Pval = (Pval - mu) / std
+            Ptest = (Ptest - mu) / std
+
+            # Normalize each sample to between 0,1:
+            # samp_len = Ptrain.shape[0]
+            # batch_mins = Ptrain.min(dim=0)[0].unsqueeze(0).repeat(samp_len, 1, 1)
+            # batch_maxes = Ptrain.max(dim=0)[0].unsqueeze(0).repeat(samp_len, 1, 1)
+            # Ptrain = (Ptrain -  batch_mins) / batch_maxes 
+
+            # batch_mins = Pval.min(dim=0)[0].unsqueeze(0).repeat(samp_len, 1, 1)
+            # batch_maxes = Pval.max(dim=0)[0].unsqueeze(0).repeat(samp_len, 1, 1)
+            # Pval = (Pval -  batch_mins) / batch_maxes 
+
+            # batch_mins = Ptest.min(dim=0)[0].unsqueeze(0).repeat(samp_len, 1, 1)
+            # batch_maxes = Ptest.max(dim=0)[0].unsqueeze(0).repeat(samp_len, 1, 1)
+            # Ptest = (Ptest -  batch_mins) / batch_maxes 
+
+        if div_time:
+            time_train = time_train / 60.0
+            time_val = time_val / 60.0
+            time_test = time_test / 60.0
+
+        if exclude_pac_pvc:
+            train_mask_in = (ytrain < 3)
+            Ptrain = Ptrain[:,train_mask_in,:]
+            time_train = time_train[:,train_mask_in]
+            ytrain = ytrain[train_mask_in]
+            idx_train = idx_train[train_mask_in]
+
+            val_mask_in = (yval < 3)
+            Pval = Pval[:,val_mask_in,:]
+            time_val = time_val[:,val_mask_in]
+            yval = yval[val_mask_in]
+            idx_val = idx_val[val_mask_in]
+
+            test_mask_in = (ytest < 3)
+            Ptest = Ptest[:,test_mask_in,:]
+            time_test = time_test[:,test_mask_in]
+            ytest = ytest[test_mask_in]
+            idx_test = idx_test[test_mask_in]
     
-    if need_binarize:
-        ytrain = (ytrain > 0).long()
-        ytest = (ytest > 0).long()
-        yval = (yval > 0).long()
-
-    if balance_classes:
-        diff_to_mask = (ytrain == 0).sum() - (ytrain == 1).sum()
-        all_zeros = (ytrain == 0).nonzero(as_tuple=True)[0]
-        mask_out = all_zeros[:diff_to_mask]
-        to_mask_in = torch.tensor([not (i in mask_out) for i in torch.arange(Ptrain.shape[1])])
-        print('Num before', (ytrain == 0).sum())
-        Ptrain = Ptrain[:,to_mask_in,:]
-        time_train = time_train[:,to_mask_in]
-        ytrain = ytrain[to_mask_in]
-        print('Num after 0', (ytrain == 0).sum())
-        print('Num after 1', (ytrain == 1).sum())
-
-        diff_to_mask = (yval == 0).sum() - (yval == 1).sum()
-        all_zeros = (yval == 0).nonzero(as_tuple=True)[0]
-        mask_out = all_zeros[:diff_to_mask]
-        to_mask_in = torch.tensor([not (i in mask_out) for i in torch.arange(Pval.shape[1])])
-        print('Num before', (yval == 0).sum())
-        Pval = Pval[:,to_mask_in,:]
-        time_val = time_val[:,to_mask_in]
-        yval = yval[to_mask_in]
-        print('Num after 0', (yval == 0).sum())
-        print('Num after 1', (yval == 1).sum())
-
-        diff_to_mask = (ytest == 0).sum() - (ytest == 1).sum()
-        all_zeros = (ytest == 0).nonzero(as_tuple=True)[0]
-        mask_out = all_zeros[:diff_to_mask]
-        to_mask_in = torch.tensor([not (i in mask_out) for i in torch.arange(Ptest.shape[1])])
-        print('Num before', (ytest == 0).sum())
-        Ptest = Ptest[:,to_mask_in,:]
-        time_test = time_test[:,to_mask_in]
-        ytest = ytest[to_mask_in]
-        print('Num after 0', (ytest == 0).sum())
-        print('Num after 1', (ytest == 1).sum())
+        if need_binarize:
+            ytrain = (ytrain > 0).long()
+            ytest = (ytest > 0).long()
+            yval = (yval > 0).long()
+
+        if balance_classes:
+            diff_to_mask = (ytrain == 0).sum() - (ytrain == 1).sum()
+            all_zeros = (ytrain == 0).nonzero(as_tuple=True)[0]
+            mask_out = all_zeros[:diff_to_mask]
+            to_mask_in = torch.tensor([not (i in mask_out) for i in torch.arange(Ptrain.shape[1])])
+            print('Num before', (ytrain == 0).sum())
+            Ptrain = Ptrain[:,to_mask_in,:]
+            time_train = time_train[:,to_mask_in]
+            ytrain = ytrain[to_mask_in]
+            idx_train = idx_train[to_mask_in]
+            print('Num after 0', (ytrain == 0).sum())
+            print('Num after 1', (ytrain == 1).sum())
+
+            diff_to_mask = (yval == 0).sum() - (yval == 1).sum()
+            all_zeros = (yval == 0).nonzero(as_tuple=True)[0]
+            mask_out = all_zeros[:diff_to_mask]
+            to_mask_in = torch.tensor([not (i in mask_out) for i in torch.arange(Pval.shape[1])])
+            print('Num before', (yval == 0).sum())
+            Pval = Pval[:,to_mask_in,:]
+            time_val = time_val[:,to_mask_in]
+            yval = yval[to_mask_in]
+            idx_val = idx_val[to_mask_in]
+            print('Num after 0', (yval == 0).sum())
+            print('Num after 1', (yval == 1).sum())
+
+            diff_to_mask = (ytest == 0).sum() - (ytest == 1).sum()
+            all_zeros = (ytest == 0).nonzero(as_tuple=True)[0]
+            mask_out = all_zeros[:diff_to_mask]
+            to_mask_in = torch.tensor([not (i in mask_out) for i in torch.arange(Ptest.shape[1])])
+            print('Num before', (ytest == 0).sum())
+            Ptest = Ptest[:,to_mask_in,:]
+            time_test = time_test[:,to_mask_in]
+            ytest = ytest[to_mask_in]
+            idx_test = idx_test[to_mask_in]
+            print('Num after 0', (ytest == 0).sum())
+            print('Num after 1', (ytest == 1).sum())
+
+        splits = {
+            'train': (Ptrain, time_train, ytrain, idx_train),
+            'val': (Pval, time_val, yval, idx_val),
+            'test': (Ptest, time_test, ytest, idx_test),
+        }
+        extras = {}
+        if hard_split:
+            gt_exps = saliency.transpose(0,1).unsqueeze(-1)[:,idx_test,:]
+            extras['gt_exps'] = gt_exps
+
+        if cache_dir is not None:
+            save_split_cache(path, splits, extras = extras, sources = sources, args = args)
+
+    Ptrain, time_train, ytrain, _ = splits['train']
+    Pval, time_val, yval, _ = splits['val']
+    Ptest, time_test, ytest, _ = splits['test']
 
     train_chunk = ECGchunk(Ptrain, None, time_train, ytrain, device = device)
     val_chunk = ECGchunk(Pval, None, time_val, yval, device = device)
@@ -344,10 +402,7 @@ def process_MITECG(split_no = 1, device = None, hard_split = False, normalize =
     print('Num after 1', (ytest == 1).sum())
 
     if hard_split:
-        gt_exps = saliency.transpose(0,1).unsqueeze(-1)[:,idx_test,:]
-        if exclude_pac_pvc:
-            gt_exps = gt_exps[:,test_mask_in,:]
-        return train_chunk, val_chunk, test_chunk, gt_exps
+        return train_chunk, val_chunk, test_chunk, extras['gt_exps']
     else:
         return train_chunk, val_chunk, test_chunk
 
@@ -383,56 +438,66 @@ class EpiDataset(torch.utils.data.Dataset):
         return x, T, y 
 
 epi_base_path = '/home/owq978/TimeSeriesXAI/ECGdata/Epilepsy'
-def process_Epilepsy(split_no = 1, device = None, base_path = epi_base_path):
+def process_Epilepsy(split_no = 1, device = None, base_path = epi_base_path, cache_dir = None):
+    '''
+    cache_dir: if given, preprocessed splits are stored there once (see txai.utils.data.cache) and memory-mapped afterwards
+    '''
 
     # train = torch.load(os.path.join(loc, 'train.pt'))
     # val = torch.load(os.path.join(loc, 'val.pt'))
     # test = torch.load(os.path.join(loc, 'test.pt'))
 
     split_path = 'split_{}.npy'.format(split_no)
-    idx_train, idx_val, idx_test = np.load(os.path.join(base_path, split_path), allow_pickle = True)
+    sources = [os.path.join(base_path, split_path), os.path.join(base_path, 'all_epilepsy.pt')]
 
-    # Ptrain, Pval, Ptest = train['samples'].transpose(1, 2), val['samples'].transpose(1, 2), test['samples'].transpose(1, 2)
-    # ytrain, yval, ytest = train['labels'], val['labels'], test['labels']
+    cached = None
+    if cache_dir is not None:
+        path = cache_path(cache_dir, 'epilepsy', split_no = split_no)
+        cached = load_split_cache(path, sources = sources)
 
-    X, y = torch.load(os.path.join(base_path, 'all_epilepsy.pt'))
+    if cached is not None:
+        splits, _ = cached
+    else:
+        idx_train, idx_val, idx_test = np.load(os.path.join(base_path, split_path), allow_pickle = True)
 
-    Ptrain, ytrain = X[idx_train], y[idx_train]
-    Pval, yval = X[idx_val], y[idx_val]
-    Ptest, ytest = X[idx_test], y[idx_test]
+        # Ptrain, Pval, Ptest = train['samples'].transpose(1, 2), val['samples'].transpose(1, 2), test['samples'].transpose(1, 2)
+        # ytrain, yval, ytest = train['labels'], val['labels'], test['labels']
 
-    T, F = Ptrain[0].shape
-    D = 1
+        X, y = torch.load(os.path.join(base_path, 'all_epilepsy.pt'))
 
-    Ptrain_static_tensor = np.zeros((len(Ptrain), D))
+        Ptrain, ytrain = X[idx_train], y[idx_train]
+        Pval, yval = X[idx_val], y[idx_val]
+        Ptest, ytest = X[idx_test], y[idx_test]
 
-    mf, stdf = getStats(Ptrain)
-    #print('Before tensor_normalize_other', Ptrain.shape)
-    Ptrain_tensor, Ptrain_static_tensor, Ptrain_time_tensor, ytrain_tensor = tensorize_normalize_ECG(Ptrain, ytrain, mf, stdf)
-    Pval_tensor, Pval_static_tensor, Pval_time_tensor, yval_tensor = tensorize_normalize_ECG(Pval, yval, mf, stdf)
-    Ptest_tensor, Ptest_static_tensor, Ptest_time_tensor, ytest_tensor = tensorize_normalize_ECG(Ptest, ytest, mf, stdf)
-    #print('After tensor_normalize (X)', Ptrain_tensor.shape)
+        mf, stdf = getStats(Ptrain)
+        #print('Before tensor_normalize_other', Ptrain.shape)
+        Ptrain_tensor, Ptrain_static_tensor, Ptrain_time_tensor, ytrain_tensor = tensorize_normalize_ECG(Ptrain, ytrain, mf, stdf)
+        Pval_tensor, Pval_static_tensor, Pval_time_tensor, yval_tensor = tensorize_normalize_ECG(Pval, yval, mf, stdf)
+        Ptest_tensor, Ptest_static_tensor, Ptest_time_tensor, ytest_tensor = tensorize_normalize_ECG(Ptest, ytest, mf, stdf)
+        #print('After tensor_normalize (X)', Ptrain_tensor.shape)
 
-    Ptrain_tensor = Ptrain_tensor.permute(2, 0, 1)
-    Pval_tensor = Pval_tensor.permute(2, 0, 1)
-    Ptest_tensor = Ptest_tensor.permute(2, 0, 1)
+        Ptrain_tensor = Ptrain_tensor.permute(2, 0, 1)
+        Pval_tensor = Pval_tensor.permute(2, 0, 1)
+        Ptest_tensor = Ptest_tensor.permute(2, 0, 1)
 
-    #print('Before s-permute', Ptrain_time_tensor.shape)
-    Ptrain_time_tensor = Ptrain_time_tensor.squeeze(2).permute(1, 0)
-    Pval_time_tensor = Pval_time_tensor.squeeze(2).permute(1, 0)
-    Ptest_time_tensor = Ptest_time_tensor.squeeze(2).permute(1, 0)
+        #print('Before s-permute', Ptrain_time_tensor.shape)
+        Ptrain_time_tensor = Ptrain_time_tensor.squeeze(2).permute(1, 0)
+        Pval_time_tensor = Pval_time_tensor.squeeze(2).permute(1, 0)
+        Ptest_time_tensor = Ptest_time_tensor.squeeze(2).permute(1, 0)
 
-    # print('X', Ptrain_tensor)
-    # print('time', Ptrain_time_tensor)
-    print('X', Ptrain_tensor.shape)
-    print('time', Ptrain_time_tensor.shape)
-    # print('time of 0', Ptrain_time_tensor.sum())
-    # print('train under 0', (Ptrain_tensor > 1e-10).sum() / Ptrain_tensor.shape[1])
-    #print('After s-permute', Ptrain_time_tensor.shape)
-    #exit()
-    train_chunk = ECGchunk(Ptrain_tensor, None, Ptrain_time_tensor, ytrain_tensor, device = device)
-    val_chunk = ECGchunk(Pval_tensor, None, Pval_time_tensor, yval_tensor, device = device)
-    test_chunk = ECGchunk(Ptest_tensor, None, Ptest_time_tensor, ytest_tensor, device = device)
+        splits = {
+            'train': (Ptrain_tensor, Ptrain_time_tensor, ytrain_tensor, idx_train),
+            'val': (Pval_tensor, Pval_time_tensor, yval_tensor, idx_val),
+            'test': (Ptest_tensor, Ptest_time_tensor, ytest_tensor, idx_test),
+        }
+        if cache_dir is not None:
+            save_split_cache(path, splits, extras = {'mf': mf, 'stdf': stdf}, sources = sources, args = {'split_no': split_no})
+
+    print('X', splits['train'][0].shape)
+    print('time', splits['train'][1].shape)
+
+    train_chunk, val_chunk, test_chunk = [ECGchunk(splits[split][0], None, splits[split][1], splits[split][2], device = device) 
+        for split in split_names]
 
     return train_chunk, val_chunk, test_chunk
 
@@ -453,7 +518,22 @@ def decomposition_statistics(pool_layer, X):
 
 boiler_base_path = "/content/drive/MyDrive/dataverse_files/extracted_data/Boiler"
 
-def process_Boiler(split_no = 1, device = None, base_path = boiler_base_path, normalize = False):
+def process_Boiler(split_no = 1, device = None, base_path = boiler_base_path, normalize = False, cache_dir = None):
+    '''
+    cache_dir: if given, split tensors are stored there once (see txai.utils.data.cache) and memory-mapped afterwards
+    '''
+    split_path = os.path.join(base_path, 'split={}.pt'.format(split_no))
+    sources = [split_path] + [os.path.join(base_path, f) for f in ('xfull.pt', 'yfull.pt', 'sfull.pt')]
+
+    if cache_dir is not None:
+        path = cache_path(cache_dir, 'boiler', split_no = split_no, normalize = normalize)
+        cached = load_split_cache(path, sources = sources)
+        if cached is not None:
+            splits, extras = cached
+            train_d, val_d, test_d = [[splits[split][0].to(device), splits[split][1].to(device), splits[split][2].to(device)] 
+                for split in split_names]
+            return train_d, val_d, test_d, extras['stest'].to(device)
+
     x_full = torch.load(os.path.join(base_path, 'xfull.pt')).to(device).float()
     y_full = torch.load(os.path.join(base_path, 'yfull.pt')).to(device).long()
     sfull = torch.load(os.path.join(base_path, 'sfull.pt')).to(device).float()
@@ -462,11 +542,9 @@ def process_Boiler(split_no = 1, device = None, base_path = boiler_base_path, no
     print('yfull', y_full.shape)
     # exit()
 
-    T_full = torch.zeros(36, x_full.shape[1]).to(device)
-    for i in range(T_full.shape[1]):
-        T_full[:,i] = torch.arange(36)
+    T_full = torch.arange(36, device = device).float().unsqueeze(1).repeat(1, x_full.shape[1])
 
-    idx_train, idx_val, idx_test = torch.load(os.path.join(base_path, 'split={}.pt'.format(split_no)))
+    idx_train, idx_val, idx_test = torch.load(split_path)
 
     train_d = [x_full[:,idx_train,:], T_full[:,idx_train], y_full[idx_train]]
     val_d = [x_full[:,idx_val,:], T_full[:,idx_val], y_full[idx_val]]
@@ -482,6 +560,10 @@ def process_Boiler(split_no = 1, device = None, base_path = boiler_base_path, no
 
     stest = sfull[:,idx_test,:]
 
+    if cache_dir is not None:
+        splits = {split: (d[0], d[1], d[2], idx) for split, d, idx in zip(split_names, (train_d, val_d, test_d), (idx_train, idx_val, idx_test))}
+        save_split_cache(path, splits, extras = {'stest': stest}, sources = sources, args = {'split_no': split_no, 'normalize': normalize})
+
     return train_d, val_d, test_d, stest
 
 
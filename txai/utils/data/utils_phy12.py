@@ -9,6 +9,8 @@ import torch.optim as optim
 
 import time
 
+from txai.utils.data import imputation
+
 from sklearn.metrics import roc_auc_score
 from sklearn.metrics import average_precision_score
 
@@ -140,21 +142,58 @@ def get_data_split(base_path, split_path, split_type='random', reverse=False, ba
     return Ptrain, Pval, Ptest, ytrain, yval, ytest
 
 
-def getStats(P_tensor):
+def masked_moments(X):
+    """
+    Count, mean and sum of squared deviations of the positive (observed) entries of each column of X (n, F)
+    """
+    X = np.asarray(X, dtype=np.float64)
+    M = X > 0
+    n = M.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(M, X, 0).sum(axis=0) / n
+    M2 = (np.where(M, X - mean, 0) ** 2).sum(axis=0)
+    return n, mean, M2
+
+
+def combine_moments(a, b):
+    """ Merges (n, mean, M2) of two chunks (Chan et al. parallel variance) """
+    n_a, mean_a, M2_a = a
+    n_b, mean_b, M2_b = b
+    n = n_a + n_b
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delta = mean_b - mean_a
+        mean = np.where(n_a == 0, mean_b, np.where(n_b == 0, mean_a, mean_a + delta * n_b / n))
+        M2 = M2_a + M2_b + np.where((n_a > 0) & (n_b > 0), delta ** 2 * n_a * n_b / n, 0)
+    return n, mean, M2
+
+
+def sample_chunks(P_tensor, chunk_size=None):
+    """ Yields chunks of samples (first dim) of an array/tensor/memmap as numpy arrays """
+    N = P_tensor.shape[0]
+    chunk_size = N if chunk_size is None else chunk_size
+    for start in range(0, N, chunk_size):
+        chunk = P_tensor[start:start + chunk_size]
+        if torch.is_tensor(chunk):
+            chunk = chunk.detach().cpu().numpy()
+        yield start, np.asarray(chunk)
+
+
+def getStats(P_tensor, chunk_size=None):
+    """
+    Per-feature mean/std of observed (> 0) values of P_tensor (N, T, F), one pass over the data
+        - chunk_size: number of samples per chunk, for archives (e.g. np.memmap) larger than RAM
+    """
     N, T, F = P_tensor.shape
-    if isinstance(P_tensor, np.ndarray):
-        Pf = P_tensor.transpose((2, 0, 1)).reshape(F, -1)
-    else:
-        Pf = P_tensor.permute(2, 0, 1).reshape(F, -1).detach().clone().cpu().numpy()
-    mf = np.zeros((F, 1))
-    stdf = np.ones((F, 1))
     eps = 1e-7
-    for f in range(F):
-        vals_f = Pf[f, :]
-        vals_f = vals_f[vals_f > 0]
-        mf[f] = np.mean(vals_f)
-        stdf[f] = np.std(vals_f)
-        stdf[f] = np.max([stdf[f], eps])
+    moments = None
+    for _, chunk in sample_chunks(P_tensor, chunk_size):
+        m = masked_moments(chunk.reshape(-1, F))
+        moments = m if moments is None else combine_moments(moments, m)
+    n, mean, M2 = moments
+    with np.errstate(invalid='ignore', divide='ignore'):
+        std = np.sqrt(M2 / n)
+    mf = mean.reshape(F, 1)
+    stdf = np.maximum(std, eps).reshape(F, 1)
     return mf, stdf
 
 
@@ -166,12 +205,7 @@ def get_features_mean(X_features):
     :return: list of means for all features
     """
     samples, timesteps, features = X_features.shape
-    X = np.reshape(X_features, newshape=(samples*timesteps, features)).T
-    means = []
-    for row in X:
-        row = row[row > 0]
-        means.append(np.mean(row))
-    return means
+    return list(masked_moments(np.reshape(X_features, (samples*timesteps, features)))[1])
 
 
 def mean_imputation(X_features, X_time, mean_features, missing_value_num):
@@ -183,28 +217,7 @@ def mean_imputation(X_features, X_time, mean_features, missing_value_num):
     :param mean_features: mean values of features from the training set
     :return: X_features, filled with mean values instead of zeros (missing observations)
     """
-    time_length = []
-    for times in X_time:
-        if np.where(times == missing_value_num)[0].size == 0:
-            time_length.append(times.shape[0])
-        elif np.where(times == missing_value_num)[0][0] == 0:
-            time_length.append(np.where(times == missing_value_num)[0][1])
-        else:
-            time_length.append(np.where(times == missing_value_num)[0][0])
-
-    # check for inconsistency
-    for i in range(len(X_features)):
-        if np.any(X_features[i, time_length[i]:, :]):
-            print('Inconsistency between X_features and X_time: features are measured without time stamp.')
-
-    # impute times series features
-    for i, sample in enumerate(X_features):
-        X_features_relevant = sample[:time_length[i], :]
-        missing_values_idx = np.where(X_features_relevant == missing_value_num)
-        for row, col in zip(*missing_values_idx):
-            X_features[i, row, col] = mean_features[col]
-
-    return X_features
+    return imputation.mean_imputation(X_features, X_time, mean_features, missing_value_num)
 
 
 def forward_imputation(X_features, X_time, missing_value_num):
@@ -215,97 +228,47 @@ def forward_imputation(X_features, X_time, missing_value_num):
     :param X_time: times, when observations were measured
     :return: X_features, filled with last measurements instead of zeros (missing observations)
     """
-    time_length = []
-    for times in X_time:
-        if np.where(times == missing_value_num)[0].size == 0:
-            time_length.append(times.shape[0])
-        elif np.where(times == missing_value_num)[0][0] == 0:
-            time_length.append(np.where(times == missing_value_num)[0][1])
-        else:
-            time_length.append(np.where(times == missing_value_num)[0][0])
-
-    # impute times series features
-    for i, sample in enumerate(X_features):
-        for j, ts in enumerate(sample.T):   # note the transposed matrix
-            first_observation = True
-            current_value = -1
-            for k, observation in enumerate(ts[:time_length[i]]):
-                if X_features[i, k, j] == missing_value_num and first_observation:
-                    continue
-                elif X_features[i, k, j] != missing_value_num:
-                    current_value = X_features[i, k, j]
-                    first_observation = False
-                elif X_features[i, k, j] == missing_value_num and not first_observation:
-                    X_features[i, k, j] = current_value
-
-    return X_features
-
-
-def cubic_spline_imputation(X_features, X_time, missing_value_num):
+    return imputation.forward_imputation(X_features, X_time, missing_value_num)
+
+
+def cubic_spline_imputation(X_features, X_time, missing_value_num, n_workers=1):
     """
     Fill X_features missing values with cubic spline interpolation.
 
     :param X_features: time series features for all samples
     :param X_time: times, when observations were measured
+    :param n_workers: size of the process pool fitting splines, 1 runs in this process, None uses all CPUs
     :return: X_features, filled with interpolated values
     """
-    from scipy.interpolate import CubicSpline
-
-    time_length = []
-    for times in X_time:
-        if np.where(times == missing_value_num)[0].size == 0:
-            time_length.append(times.shape[0])
-        elif np.where(times == missing_value_num)[0][0] == 0:
-            time_length.append(np.where(times == missing_value_num)[0][1])
-        else:
-            time_length.append(np.where(times == missing_value_num)[0][0])
-
-    # impute times series features
-    for i, sample in enumerate(X_features):
-        for j, ts in enumerate(sample.T):   # note the transposed matrix
-            valid_ts = ts[:time_length[i]]
-            zero_idx = np.where(valid_ts == missing_value_num)[0]
-            non_zero_idx = np.nonzero(valid_ts)[0]
-            y = valid_ts[non_zero_idx]
+    return imputation.cubic_spline_imputation(X_features, X_time, missing_value_num, n_workers=n_workers)
 
-            if len(y) > 1:   # we need at least 2 observations to fit cubic spline
-                x = X_time[i, :time_length[i], 0][non_zero_idx]
-                x2interpolate = X_time[i, :time_length[i], 0][zero_idx]
 
-                cs = CubicSpline(x, y)
-                interpolated_ts = cs(x2interpolate)
-                valid_ts[zero_idx] = interpolated_ts
-
-                # set values before first measurement to the value of first measurement
-                first_obs_index = non_zero_idx[0]
-                valid_ts[:first_obs_index] = np.full(shape=first_obs_index, fill_value=valid_ts[first_obs_index])
-
-                # set values after last measurement to the value of last measurement
-                last_obs_index = non_zero_idx[-1]
-                valid_ts[last_obs_index:] = np.full(shape=time_length[i] - last_obs_index, fill_value=valid_ts[last_obs_index])
-
-                X_features[i, :time_length[i], j] = valid_ts
-
-    return X_features
-
-
-def mask_normalize(P_tensor, mf, stdf):
-    """ Normalize time series variables. Missing ones are set to zero after normalization. """
+def mask_normalize(P_tensor, mf, stdf, out=None, chunk_size=None):
+    """
+    Normalize time series variables. Missing ones are set to zero after normalization.
+        - Returns (N, T, 2F): normalized values, then the observation mask
+        - out: optional preallocated (N, T, 2F) array (e.g. np.memmap) written in place
+        - chunk_size: number of samples normalized at once, bounds temporary memory
+    """
     N, T, F = P_tensor.shape
-    Pf = P_tensor.transpose((2,0,1)).reshape(F,-1)
-    M = 1*(P_tensor>0) + 0*(P_tensor<=0)
-    M_3D = M.transpose((2, 0, 1)).reshape(F, -1)
-    for f in range(F):
-        Pf[f] = (Pf[f]-mf[f])/(stdf[f]+1e-18)
-    Pf = Pf * M_3D
-    Pnorm_tensor = Pf.reshape((F,N,T)).transpose((1,2,0))
-    Pfinal_tensor = np.concatenate([Pnorm_tensor, M], axis=2)
-    return Pfinal_tensor
+    mf = np.asarray(mf).reshape(1, 1, F)
+    stdf = np.asarray(stdf).reshape(1, 1, F) + 1e-18
+    for start, chunk in sample_chunks(P_tensor, chunk_size):
+        M = chunk > 0
+        if out is None:
+            dtype = chunk.dtype if np.issubdtype(chunk.dtype, np.floating) else np.float64
+            out = np.empty((N, T, 2 * F), dtype=np.result_type(dtype, mf.dtype))
+        end = start + chunk.shape[0]
+        norm = out[start:end, :, :F]
+        np.subtract(chunk, mf, out=norm, casting='unsafe')
+        np.divide(norm, stdf, out=norm, casting='unsafe')
+        norm *= M
+        out[start:end, :, F:] = M
+    return out
 
 
 def getStats_static(P_tensor, dataset='P12'):
     N, S = P_tensor.shape
-    Ps = P_tensor.transpose((1, 0))
     ms = np.zeros((S, 1))
     ss = np.ones((S, 1))
 
@@ -319,31 +282,27 @@ def getStats_static(P_tensor, dataset='P12'):
         # ['apacheadmissiondx' 'ethnicity' 'gender' 'admissionheight' 'admissionweight'] -> 399 dimensions
         bool_categorical = [1] * 397 + [0] * 2
 
-    for s in range(S):
-        if bool_categorical[s] == 0:  # if not categorical
-            vals_s = Ps[s, :]
-            vals_s = vals_s[vals_s > 0]
-            ms[s] = np.mean(vals_s)
-            ss[s] = np.std(vals_s)
+    # Masked moments of all non-categorical columns at once:
+    cont = np.where(np.asarray(bool_categorical) == 0)[0]
+    n, mean, M2 = masked_moments(np.asarray(P_tensor)[:, cont])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ms[cont, 0] = mean
+        ss[cont, 0] = np.sqrt(M2 / n)
     return ms, ss
 
 
 def mask_normalize_static(P_tensor, ms, ss):
+    """ Normalizes static variables in place (P_tensor must be a float array), missing ones are set to zero """
     N, S = P_tensor.shape
-    Ps = P_tensor.transpose((1, 0))
 
     # input normalization
-    for s in range(S):
-        Ps[s] = (Ps[s] - ms[s]) / (ss[s] + 1e-18)
+    P_tensor -= np.asarray(ms).reshape(1, S)
+    P_tensor /= (np.asarray(ss).reshape(1, S) + 1e-18)
 
     # set missing values to zero after normalization
-    for s in range(S):
-        idx_missing = np.where(Ps[s, :] <= 0)
-        Ps[s, idx_missing] = 0
+    P_tensor[P_tensor <= 0] = 0
 
-    # reshape back
-    Pnorm_tensor = Ps.reshape((S, N)).transpose((1, 0))
-    return Pnorm_tensor
+    return P_tensor
 
 
 def tensorize_normalize(P, y, mf, stdf, ms, ss):
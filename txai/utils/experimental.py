@@ -18,6 +18,80 @@ from txai.baselines import TSR
 from captum.attr import IntegratedGradients, Saliency
 from txai.utils.baseline_comp.run_dynamask import run_dynamask
 
+def ig_attribute(IG, X, times, y, n_steps = 50, internal_batch_size = None):
+    '''
+    Runs captum IG on a batch given in (T, B, d) format, returns (T, B, d) attributions
+    '''
+    # Transform inputs to captum-like (batch first):
+    x = X.transpose(0, 1)
+    time = times.transpose(0,1)
+    attr = IG.attribute(x, target = y, n_steps = n_steps, internal_batch_size = internal_batch_size,
+        additional_forward_args = (time, None, True))
+    return attr.transpose(0, 1).detach()
+
+# Per-process state for IG workers, set once by _ig_worker_init:
+_ig_worker_state = {}
+
+def _ig_worker_init(model, n_steps, internal_batch_size, threads_per_worker):
+    torch.set_num_threads(threads_per_worker)
+    model.eval()
+    _ig_worker_state['IG'] = IntegratedGradients(model)
+    _ig_worker_state['kwargs'] = {'n_steps': n_steps, 'internal_batch_size': internal_batch_size}
+
+def _ig_worker(chunk):
+    X, times, y = chunk
+    return ig_attribute(_ig_worker_state['IG'], X, times, y, **_ig_worker_state['kwargs'])
+
+class IGExplainer:
+    '''
+    Integrated Gradients with a reused captum object
+        - Called as explainer(model, x, time, y) on single samples (same as other get_explainer outputs)
+        - attribute_batch runs whole (T, B, d) blocks, optionally split over CPU worker processes
+
+    n_steps: number of interpolation steps between baseline and input
+    internal_batch_size: max number of interpolated inputs per forward/backward (None = all n_steps * B at once)
+    n_workers: number of CPU processes in attribute_batch (1 runs in this process)
+    '''
+    def __init__(self, n_steps = 50, internal_batch_size = None, n_workers = 1, threads_per_worker = 1):
+        self.n_steps = n_steps
+        self.internal_batch_size = internal_batch_size
+        self.n_workers = n_workers
+        self.threads_per_worker = threads_per_worker
+        self.model = None
+        self.IG = None
+
+    def get_ig(self, model):
+        # Only rebuild captum object when the model changes:
+        if model is not self.model:
+            self.model = model
+            self.IG = IntegratedGradients(model)
+        return self.IG
+
+    def __call__(self, model, x, time, y):
+        attr = ig_attribute(self.get_ig(model), x, time, y, 
+            n_steps = self.n_steps, internal_batch_size = self.internal_batch_size)
+        return attr.transpose(0, 1) # Batch first, as before
+
+    def attribute_batch(self, model, X, times, y, batch_size = 64):
+        '''
+        X: (T, B, d), times: (T, B), y: (B,)
+        Returns (T, B, d) attributions
+        '''
+        chunks = [(X[:,i:(i + batch_size),:], times[:,i:(i + batch_size)], y[i:(i + batch_size)]) 
+            for i in range(0, X.shape[1], batch_size)]
+
+        if (self.n_workers > 1) and (X.device.type == 'cpu'):
+            ctx = torch.multiprocessing.get_context('spawn')
+            with ctx.Pool(self.n_workers, initializer = _ig_worker_init, 
+                    initargs = (model, self.n_steps, self.internal_batch_size, self.threads_per_worker)) as pool:
+                attrs = pool.map(_ig_worker, chunks)
+        else:
+            IG = self.get_ig(model)
+            attrs = [ig_attribute(IG, *c, n_steps = self.n_steps, internal_batch_size = self.internal_batch_size) 
+                for c in chunks]
+
+        return torch.cat(attrs, dim = 1)
+
 def get_explainer(key, args, device = None):
 
     key = key.lower()
@@ -41,13 +115,12 @@ def get_explainer(key, args, device = None):
             return torch.from_numpy(out).to(device)
 
     elif key == 'ig':
-        def explainer(model, x, time, y): 
-            IG = IntegratedGradients(model)
-            # Transform inputs to captum-like (batch first):
-            x = x.transpose(0, 1)
-            time = time.transpose(0,1)
-            attr = IG.attribute(x, target = y, additional_forward_args = (time, None, True))
-            return attr
+        explainer = IGExplainer(
+            n_steps = getattr(args, 'ig_steps', 50),
+            internal_batch_size = getattr(args, 'ig_internal_batch_size', None),
+            n_workers = getattr(args, 'n_workers', 1),
+            threads_per_worker = getattr(args, 'threads_per_worker', 1),
+        )
 
     elif key == 'random':
         def explainer(model, x, time, y):
@@ -33,6 +33,19 @@ def transform_to_attn_mask(linear_mask):
     attn_mask = attn_mask * attn_mask.transpose(1, 2) # Flip and multiply
     return attn_mask
 
+def transform_to_keep_mask(linear_mask):
+    '''
+    (B, T) keep-vector version of transform_to_attn_mask, for attn_keep in MultiHeadAttnMask
+        - attn_keep = m gives the same attention as attn_mask = m[:,:,None] * m[:,None,:]
+    NOTE: If linear_mask is multivariate, expects (B, T, d) size
+    '''
+
+    if len(linear_mask.shape) > 2:
+        # Same differentiable reduction as transform_to_attn_mask:
+        linear_mask = F.hardtanh(linear_mask.sum(dim=-1))
+
+    return linear_mask
+
 def js_divergence(p: Tensor, q: Tensor, log_already = False) -> Tensor:
     # JSD(P || Q)
     # Assumes both have alread
@@ -52,6 +65,24 @@ def js_divergence_logsoftmax(p: Tensor, q: Tensor) -> Tensor:
     m = 0.5 * (p.softmax(dim=-1) + q.softmax(dim=-1))
     return (0.5 * F.kl_div(p.log_softmax(dim=-1), m, reduction = 'mean') + 0.5 * F.kl_div(q.log_softmax(dim=-1), m, reduction = 'mean'))
 
+def pairwise_js_divergence(log_p: Tensor) -> Tensor:
+    '''
+    JSD between all pairs of rows of log_p, a (B, C) matrix of log-probabilities
+        - Returns (B, B) matrix with JSD(P_i || P_j) (summed over classes) on the strict upper triangle, 0 elsewhere
+        - Cross terms are computed with matmuls; only the mixture entropy needs a (B, B, C) buffer
+    '''
+    p = log_p.exp()
+    m = 0.5 * (p.unsqueeze(1) + p.unsqueeze(0)) # Size (B, B, C)
+    neg_ent_m = torch.xlogy(m, m).sum(dim=-1)
+
+    # sum_c m_ij * (log p_i + log p_j) from self and cross terms:
+    self_term = (p * log_p).sum(dim=-1)
+    cross = torch.matmul(p, log_p.transpose(0, 1)) # cross[i,j] = sum_c p_i * log p_j
+    m_logp = 0.5 * (self_term.unsqueeze(1) + self_term.unsqueeze(0) + cross + cross.transpose(0, 1))
+
+    jsd = neg_ent_m - 0.5 * m_logp
+    return torch.triu(jsd, diagonal = 1)
+
 def cosine_sim_matrix(z1, z2):
     # Shape: (B1, d_z), (B2, d_z)
     z1 = F.normalize(z1, dim = -1)
@@ -102,4 +133,12 @@ def stratified_sample(y, n):
         extra_samples_indices = remaining_indices[torch.randperm(len(remaining_indices))][:extra_samples]
         samples = torch.cat((samples, extra_samples_indices))
 
-    return samples
\ No newline at end of file
+    return samples
+
+def index_batch(X, times, y, idx):
+    '''
+    One index_select per tensor on (T, N, d) storage, returns batch-first (B, T, d), (B, T), (B,)
+        - Same layout as the default DataLoader collate of single samples (X and times are transposed views)
+    '''
+    idx = idx.to(X.device)
+    return X.index_select(1, idx).transpose(0, 1), times.index_select(1, idx).transpose(0, 1), y.index_select(0, idx)
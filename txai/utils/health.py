@@ -0,0 +1,82 @@
+import contextlib
+import torch
+
+class HealthMonitor:
+    '''
+    Opt-in NaN checks for tensors on the training/inference hot path
+        - Replaces unconditional `x.isnan().sum() > 0` checks, which force a host sync on every call
+        - Checks only run on every `every`-th step (step() advances the counter)
+        - async_check: NaN counts are accumulated on device and only read in flush() (every flush_every steps),
+            so checks never block the device
+        - on_error: 'raise' (FloatingPointError), 'exit' (print and exit, old trainer behavior) or 'print'
+
+    Usage:
+        monitor = HealthMonitor(every = 10, async_check = True)
+        with monitor_health(monitor): # Also enables checks inside TransformerMVTS.embed
+            out = model(...)
+            monitor.check('out', out)
+        monitor.step()
+    '''
+    def __init__(self, every = 1, async_check = False, flush_every = 100, on_error = 'raise'):
+        self.every = every
+        self.async_check = async_check
+        self.flush_every = flush_every
+        self.on_error = on_error
+        self.step_count = 0
+        self.pending = {}
+
+    def active(self):
+        return (self.step_count % self.every) == 0
+
+    def check(self, name, x):
+        if not self.active():
+            return
+        n_nan = torch.isnan(x.detach()).sum()
+        if self.async_check:
+            self.pending[name] = (self.pending[name] + n_nan) if name in self.pending else n_nan
+        else:
+            n_nan = int(n_nan) # Sync
+            if n_nan > 0:
+                self.report(name, n_nan)
+
+    def step(self):
+        self.step_count += 1
+        if self.async_check and (self.step_count % self.flush_every == 0):
+            self.flush()
+
+    def flush(self):
+        pending, self.pending = self.pending, {}
+        for name, n_nan in pending.items():
+            n_nan = int(n_nan)
+            if n_nan > 0:
+                self.report(name, n_nan)
+
+    def report(self, name, n_nan):
+        msg = '{}: {} NaN values (step {})'.format(name, n_nan, self.step_count)
+        if self.on_error == 'print':
+            print(msg)
+        elif self.on_error == 'exit':
+            print(msg)
+            exit()
+        else:
+            raise FloatingPointError(msg)
+
+# Monitor used by health_check calls inside models, None disables them:
+_active_monitor = {'monitor': None}
+
+@contextlib.contextmanager
+def monitor_health(monitor):
+    prev = _active_monitor['monitor']
+    _active_monitor['monitor'] = monitor
+    try:
+        yield monitor
+    finally:
+        _active_monitor['monitor'] = prev
+
+def health_check(name, x):
+    '''
+    No-op unless a HealthMonitor is active through monitor_health
+    '''
+    monitor = _active_monitor['monitor']
+    if monitor is not None:
+        monitor.check(name, x)
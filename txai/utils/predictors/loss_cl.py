@@ -2,7 +2,32 @@ import math
 import torch
 import torch.nn.functional as F
 
-from txai.utils.functional import js_divergence, js_divergence_logsoftmax
+from txai.utils.functional import js_divergence, pairwise_js_divergence
+
+def sample_pair_inds(B, n_pairs, distinct = False, device = None):
+    '''
+    Samples n_pairs (i, j) index pairs uniformly with replacement
+        - distinct = True samples only i != j (uniform over unordered pairs for symmetric scores)
+    '''
+    if distinct and B < 2:
+        raise ValueError('distinct pairs require B >= 2, got B = {}'.format(B))
+    lhs = torch.randint(0, B, (n_pairs,), device = device)
+    if distinct:
+        # Offset in [1, B-1] keeps rhs uniform over all indices except lhs
+        rhs = (lhs + torch.randint(1, B, (n_pairs,), device = device)) % B
+    else:
+        rhs = torch.randint(0, B, (n_pairs,), device = device)
+    return lhs, rhs
+
+def unbiased_squared_mean(d):
+    '''
+    Unbiased estimate of (E[d])^2 from i.i.d. samples d of shape (n,)
+        - U-statistic over distinct sample pairs, may be slightly negative for small n
+    '''
+    n = d.shape[0]
+    if n < 2:
+        raise ValueError('unbiased_squared_mean requires at least 2 samples, got {}'.format(n))
+    return (d.sum().pow(2) - d.pow(2).sum()) / (n * (n - 1))
 
 class SimCLRLoss(torch.nn.Module):
     def __init__(self, temperature = 1.0):
@@ -59,22 +84,11 @@ class LabelConsistencyLoss(torch.nn.Module):
         # assert not torch.any(torch.isnan(full_labels_ls)), "NAN full_labels"
 
 
-        # Enumerate batch:
-        combs = torch.combinations(torch.arange(mask_labels_ls.shape[0]), r = 2, with_replacement = False)
-
-        mask_labels_expanded_lhs = mask_labels_ls[combs[:,0],:]
-        mask_labels_expanded_rhs = mask_labels_ls[combs[:,1],:]
-
-        full_labels_expanded_lhs = full_labels_ls[combs[:,0],:]    
-        full_labels_expanded_rhs = full_labels_ls[combs[:,1],:]
-
-        # print('embeddings', embeddings.shape)
-        # print('pos', positives.shape)
-        # print('negatives', negatives.shape)
-
-        # Sim to positives:
-        score_mask = js_divergence(mask_labels_expanded_lhs, mask_labels_expanded_rhs, log_already = True)
-        score_full = js_divergence(full_labels_expanded_lhs, full_labels_expanded_rhs, log_already = True)
+        # Mean JSD over all pairs i < j, normalized by classes as in js_divergence:
+        B, C = mask_labels_ls.shape
+        n_pairs = B * (B - 1) / 2
+        score_mask = pairwise_js_divergence(mask_labels_ls).sum() / (n_pairs * C)
+        score_full = pairwise_js_divergence(full_labels_ls).sum() / (n_pairs * C)
 
         score = (score_mask - score_full).pow(2).mean()
         #score = (score_mask -  score_full).abs().mean()
@@ -122,22 +136,47 @@ class LabelConsistencyLoss_LS(torch.nn.Module):
         negatives: (B, d, n_neg) shape
         '''
 
-        # Enumerate batch:
-        combs = torch.combinations(torch.arange(mask_labels.shape[0]), r = 2, with_replacement = False)
+        # Mean JSD over all pairs i < j, normalized by classes as in js_divergence_logsoftmax:
+        B, C = mask_labels.shape
+        n_pairs = B * (B - 1) / 2
+        score_mask = pairwise_js_divergence(mask_labels.log_softmax(dim=-1)).sum() / (n_pairs * C)
+        score_full = pairwise_js_divergence(full_labels.log_softmax(dim=-1)).sum() / (n_pairs * C)
 
-        mask_labels_expanded_lhs = mask_labels[combs[:,0],:]
-        mask_labels_expanded_rhs = mask_labels[combs[:,1],:]
+        score = (score_mask - score_full).pow(2).mean()
 
-        full_labels_expanded_lhs = full_labels[combs[:,0],:]    
-        full_labels_expanded_rhs = full_labels[combs[:,1],:]
+        return score
 
-        # Sim to positives:
-        score_mask = js_divergence_logsoftmax(mask_labels_expanded_lhs, mask_labels_expanded_rhs)
-        score_full = js_divergence_logsoftmax(full_labels_expanded_lhs, full_labels_expanded_rhs)
+class LabelConsistencyLoss_Sampled(torch.nn.Module):
+    def __init__(self, n_pairs = 4096):
+        super(LabelConsistencyLoss_Sampled, self).__init__()
+        if n_pairs < 2:
+            raise ValueError('n_pairs must be >= 2 for the unbiased estimate, got {}'.format(n_pairs))
+        self.n_pairs = n_pairs
 
-        score = (score_mask - score_full).pow(2).mean()
+    def forward(self, mask_labels, full_labels):
+        '''
+        Pair-sampled estimate of LabelConsistencyLoss for large batches
+            - Samples n_pairs pairs i != j instead of enumerating all B(B-1)/2 combinations
+            - LabelConsistencyLoss is (mean_pairs JSD_mask - mean_pairs JSD_full)^2, estimated without bias
+              through unbiased_squared_mean over per-pair differences
+        '''
+        if mask_labels.shape[0] < 2: # No pairs, e.g. last batch of size 1
+            return 0.0 * mask_labels.sum()
 
-        return score
+        mask_labels_ls = mask_labels.log_softmax(dim=-1)
+        full_labels_ls = full_labels.log_softmax(dim=-1)
+
+        lhs, rhs = sample_pair_inds(mask_labels_ls.shape[0], self.n_pairs, distinct = True, device = mask_labels_ls.device)
+
+        def pair_jsd(ls):
+            p, q = ls[lhs,:], ls[rhs,:]
+            m = 0.5 * (p.exp() + q.exp())
+            # Mean over classes matches reduction = 'mean' in js_divergence once averaged over pairs
+            return 0.5 * (F.kl_div(p, m, reduction = 'none') + F.kl_div(q, m, reduction = 'none')).mean(dim=-1)
+
+        d = pair_jsd(mask_labels_ls) - pair_jsd(full_labels_ls)
+
+        return unbiased_squared_mean(d)
 
 class LabelAlignmentLoss(torch.nn.Module):
     def __init__(self):
@@ -216,6 +255,35 @@ class EmbedConsistencyLoss(torch.nn.Module):
 
         return score 
 
+class EmbedConsistencyLoss_Sampled(torch.nn.Module):
+    def __init__(self, n_pairs = 4096, normalize_distance = False):
+        super(EmbedConsistencyLoss_Sampled, self).__init__()
+        if n_pairs < 2:
+            raise ValueError('n_pairs must be >= 2, got {}'.format(n_pairs))
+        self.n_pairs = n_pairs
+        self.normalize_distance = normalize_distance
+
+    def forward(self, original_embeddings, concept_embeddings):
+        '''
+        Pair-sampled estimate of EmbedConsistencyLoss for large batches
+            - Samples n_pairs entries of the (B, B) similarity matrices, never materializing them
+            - Unbiased for the mean over all B^2 entries (normalize_distance uses the sampled variance)
+        '''
+        original_embeddings = F.normalize(original_embeddings, dim = -1)
+        concept_embeddings = F.normalize(concept_embeddings, dim = -1)
+
+        lhs, rhs = sample_pair_inds(original_embeddings.shape[0], self.n_pairs, device = original_embeddings.device)
+
+        original_sims = (original_embeddings[lhs,:] * original_embeddings[rhs,:]).sum(dim=-1) # Size (n_pairs,)
+        concept_sims = (concept_embeddings[lhs,:] * concept_embeddings[rhs,:]).sum(dim=-1) # Size (n_pairs,)
+
+        score = (original_sims - concept_sims).pow(2).mean()
+
+        if self.normalize_distance:
+            score /= original_sims.var()
+
+        return score
+
 class SimCLRwConsistencyLoss(torch.nn.Module):
     def __init__(self, lam = 1.0, temperature = 1.0):
         super(SimCLRwConsistencyLoss, self).__init__()
@@ -0,0 +1,132 @@
+'''
+Generates TimeX saliency explanations (TimeXModel.get_saliency_explanation) for large test archives
+    - Splits samples into chunks, chunks are divided round-robin over worker processes
+    - Each worker has its own CPU thread budget and writes into a shared np.memmap of shape (T, N, d)
+    - Finished chunks are recorded in a sidecar flag file, so rerunning with the same out_path resumes
+
+Usage:
+    python -m txai.utils.sharded_explain --model_path model.pt --X_path X.npy --times_path times.npy --out_path exps.dat --n_workers 8
+'''
+
+import os, json, time, argparse
+import torch
+import numpy as np
+import torch.multiprocessing as mp
+
+from txai.models.bc_model import TimeXModel
+
+def meta_path(out_path):
+    return out_path + '.json'
+
+def done_path(out_path):
+    return out_path + '.done'
+
+def open_outputs(out_path, shape, chunk_size):
+    '''
+    Creates the output memmap and chunk flags, or reopens them if a run with the same layout exists
+    '''
+    T, N, d = shape
+    n_chunks = (N + chunk_size - 1) // chunk_size
+    meta = {'shape': [T, N, d], 'chunk_size': chunk_size, 'dtype': 'float32'}
+
+    if os.path.exists(meta_path(out_path)):
+        with open(meta_path(out_path)) as f:
+            old_meta = json.load(f)
+        if old_meta != meta:
+            raise ValueError('Existing output at {} has layout {}, expected {}'.format(out_path, old_meta, meta))
+        mode = 'r+'
+    else:
+        with open(meta_path(out_path), 'w') as f:
+            json.dump(meta, f)
+        mode = 'w+'
+
+    exps = np.memmap(out_path, dtype = np.float32, mode = mode, shape = (T, N, d))
+    done = np.memmap(done_path(out_path), dtype = np.uint8, mode = mode, shape = (n_chunks,))
+    return exps, done
+
+def load_sharded_explanations(out_path):
+    '''
+    Returns explanations as a (T, N, d) tensor backed by the memmap (same layout as generated_exps in occlusion_exp.py)
+    '''
+    with open(meta_path(out_path)) as f:
+        meta = json.load(f)
+    done = np.memmap(done_path(out_path), dtype = np.uint8, mode = 'r')
+    if not done.all():
+        raise ValueError('{} of {} chunks in {} are not finished'.format(int((done == 0).sum()), done.shape[0], out_path))
+    exps = np.memmap(out_path, dtype = np.float32, mode = 'r', shape = tuple(meta['shape']))
+    return torch.from_numpy(np.asarray(exps))
+
+def explain_worker(rank, args, shape):
+    torch.set_num_threads(args.threads_per_worker)
+
+    X = np.load(args.X_path, mmap_mode = 'r')
+    times = np.load(args.times_path, mmap_mode = 'r')
+
+    sdict, config = torch.load(args.model_path, map_location = 'cpu')
+    model = TimeXModel(**config)
+    model.load_state_dict(sdict)
+    model.eval()
+    model.to(args.device)
+
+    exps, done = open_outputs(args.out_path, shape, args.chunk_size)
+    d = shape[2]
+
+    for c in range(rank, done.shape[0], args.n_workers):
+        if done[c]:
+            continue
+        start, end = c * args.chunk_size, min((c + 1) * args.chunk_size, shape[1])
+
+        for bstart in range(start, end, args.batch_size):
+            bend = min(bstart + args.batch_size, end)
+            batch_X = torch.from_numpy(np.ascontiguousarray(X[:,bstart:bend,:])).float().to(args.device)
+            batch_times = torch.from_numpy(np.ascontiguousarray(times[:,bstart:bend])).float().to(args.device)
+
+            with torch.inference_mode():
+                out = model.get_saliency_explanation(batch_X, batch_times, captum_input = False)
+
+            if d == 1:
+                exp = out['mask_in']
+            else:
+                exp = out['mask_in'].transpose(0,1)
+            exps[:,bstart:bend,:] = exp.float().cpu().numpy()
+
+        # Flush data before marking chunk as finished:
+        exps.flush()
+        done[c] = 1
+        done.flush()
+
+    print('Worker {} finished'.format(rank))
+
+def main(args):
+    X = np.load(args.X_path, mmap_mode = 'r')
+    shape = tuple(X.shape)
+    if len(shape) == 2:
+        raise ValueError('X must be (T, N, d), got shape {}'.format(shape))
+
+    # Create/validate outputs once before workers start:
+    _, done = open_outputs(args.out_path, shape, args.chunk_size)
+    print('{} of {} chunks remaining'.format(int((done == 0).sum()), done.shape[0]))
+    del done
+
+    start_time = time.time()
+    if args.n_workers == 1:
+        explain_worker(0, args, shape)
+    else:
+        mp.spawn(explain_worker, args = (args, shape), nprocs = args.n_workers, join = True)
+    print('Runtime: {}'.format(time.time() - start_time))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_path', type = str, help = 'TimeXModel saved with save_state')
+    parser.add_argument('--X_path', type = str, help = '.npy file of inputs, shape (T, N, d)')
+    parser.add_argument('--times_path', type = str, help = '.npy file of times, shape (T, N)')
+    parser.add_argument('--out_path', type = str, help = 'memmap file for explanations, shape (T, N, d)')
+    parser.add_argument('--n_workers', default = 1, type = int)
+    parser.add_argument('--threads_per_worker', default = 1, type = int)
+    parser.add_argument('--batch_size', default = 64, type = int)
+    parser.add_argument('--chunk_size', default = 4096, type = int, help = 'samples per resumable chunk')
+    parser.add_argument('--device', default = 'cpu', type = str)
+
+    args = parser.parse_args()
+
+    main(args)